@@ -0,0 +1,68 @@
+import time
+from typing import Any, Callable, Dict, Optional
+
+import httpx
+
+FINISHED = ("succeeded", "failed", "cancelled")
+
+
+class JobError(Exception):
+    """A job that failed or was cancelled; `job` is its last record."""
+
+    def __init__(self, job: Dict[str, Any]):
+        super().__init__(f"Job {job['id']} {job['status']}: {job.get('error') or 'no result'}")
+        self.job = job
+
+
+class JobClient:
+    """Submits and polls background jobs on the API (`/jobs`).
+
+    Only the job id has to survive a Streamlit rerun or a restarted CLI:
+    `wait()` picks the job up again wherever it is, fetching just the
+    partial output it has not seen yet.
+    """
+
+    def __init__(self, base_url: str, client: Optional[httpx.Client] = None, timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.client = client or httpx.Client(timeout=timeout)
+
+    def _request(self, method: str, path: str, **kwargs) -> Dict[str, Any]:
+        response = self.client.request(method, f"{self.base_url}{path}", **kwargs)
+        response.raise_for_status()
+        return response.json()
+
+    def submit(self, kind: str, params: Dict[str, Any]) -> str:
+        """Enqueue a "generate" or "debate" job and return its id."""
+        return self._request("POST", "/jobs", json={"kind": kind, "params": params})["id"]
+
+    def get(self, job_id: str, offset: int = 0) -> Dict[str, Any]:
+        return self._request("GET", f"/jobs/{job_id}", params={"offset": offset})
+
+    def cancel(self, job_id: str) -> Dict[str, Any]:
+        return self._request("DELETE", f"/jobs/{job_id}")
+
+    def wait(self, job_id: str, on_text: Optional[Callable[[str], None]] = None,
+             poll_interval: float = 1.0, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Poll until the job finishes and return its result.
+
+        New partial output is passed to `on_text` as it appears; JobError
+        is raised if the job failed or was cancelled, TimeoutError after
+        `timeout` seconds (the job keeps running).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        offset = 0
+        while True:
+            job = self.get(job_id, offset)
+            if job["partial"] and on_text is not None:
+                on_text(job["partial"])
+            offset = job["partial_length"]
+            if job["status"] in FINISHED:
+                if job["status"] != "succeeded":
+                    raise JobError(job)
+                return job["result"]
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Job {job_id} still {job['status']} after {timeout}s")
+            time.sleep(poll_interval)
+
+    def close(self):
+        self.client.close()
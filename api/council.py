@@ -1,19 +1,18 @@
-from typing import List, Dict
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Union
 from pydantic import BaseModel
-from llm.provider import OpenRouterLLM
+from config import settings
+from llm.provider import LLMProvider
+from llm.factory import get_shared_llm
+from llm.scheduler import QueueFullError
+from story.extraction import DebateResponse, DebateStep
 
 class CouncilMember(BaseModel):
     name: str
     role: str
     personality: str
-
-class DebateStep(BaseModel):
-    speaker: str
-    content: str
-
-class DebateResponse(BaseModel):
-    debate: List[DebateStep]
-    consensus: str
+    # None uses settings.council_models[name], then settings.council_model
+    model: Optional[str] = None
 
 KRISHNA = CouncilMember(
     name="Krishna-AI",
@@ -35,55 +34,160 @@ ARJUNA = CouncilMember(
 
 MEMBERS = [KRISHNA, DURYODHANA, ARJUNA]
 
-def generate_council_debate(context: str, topic: str) -> DebateResponse:
-    llm = OpenRouterLLM(model="google/gemma-3-27b-it:free") # Use high quality model
-    
-    prompt = f"""
-    You are simulating a debate between three advanced AI entities governing the future world of Kurukshetra 3000.
-    
+def format_transcript(steps: List[DebateStep]) -> str:
+    return "\n".join(f"[Round {step.round}] {step.speaker}: {step.content}" for step in steps)
+
+def build_turn_prompt(member: CouncilMember, others: List[CouncilMember], context: str, topic: str,
+                      transcript: List[DebateStep], round_number: int, rounds: int) -> str:
+    council = "\n".join(f"- {m.name} ({m.role}): {m.personality}" for m in others) or "- (no one else)"
+    debate = format_transcript(transcript) or "(Nobody has spoken yet; open the debate.)"
+    return f"""
+    You are {member.name}, the {member.role}, one of the AI entities governing the future world of Kurukshetra 3000.
+    **Your Personality:** {member.personality}
+
     **The Situation:**
     {context}
-    
+
+    **Topic of Debate:**
+    {topic}
+
+    **The Other Council Members:**
+    {council}
+
+    **Debate so far:**
+    {debate}
+
+    **Instructions:**
+    This is round {round_number} of {rounds}. Give your next turn only: 2-4 intense sentences,
+    in character, answering the other members' latest points and arguing from your personality.
+    Do not write lines for anyone else, do not prefix your name, and use no formatting.
+    """
+
+def build_consensus_prompt(context: str, topic: str, transcript: List[DebateStep]) -> str:
+    return f"""
+    You are the neutral recorder of an AI council governing the future world of Kurukshetra 3000.
+
+    **The Situation:**
+    {context}
+
     **Topic of Debate:**
     {topic}
-    
-    **The Council Members:**
-    1. {KRISHNA.name} ({KRISHNA.role}): {KRISHNA.personality}
-    2. {DURYODHANA.name} ({DURYODHANA.role}): {DURYODHANA.personality}
-    3. {ARJUNA.name} ({ARJUNA.role}): {ARJUNA.personality}
-    
+
+    **The Debate:**
+    {format_transcript(transcript)}
+
     **Instructions:**
-    Generate a short, intense debate (3-4 turns each) between these entities about the topic.
-    They should argue based on their personalities.
-    At the end, provide a "Cyber-Consensus" summaries of their final stance.
-    
-    **Format:**
-    Return the debate STRICTLY as a JSON object with this format:
-    {{
-        "debate": [
-            {{"speaker": "Krishna-AI", "content": "..."}},
-            {{"speaker": "Duryodhana-Net", "content": "..."}}
+    Write the "Cyber-Consensus": 2-3 sentences summarising the council's final stance,
+    naming where the members still disagree. Reply with the summary only.
+    """
+
+def clean_turn(member: CouncilMember, text: str) -> str:
+    # Models often label their own line ("Krishna-AI: ...") or quote it
+    text = text.strip()
+    for prefix in (f"**{member.name}**:", f"**{member.name}:**", f"{member.name}:"):
+        if text.startswith(prefix):
+            text = text[len(prefix):].strip()
+            break
+    if len(text) > 1 and text[0] == text[-1] == '"':
+        text = text[1:-1].strip()
+    return text
+
+def fallback_debate() -> DebateResponse:
+    # Fallback if no member managed a turn
+    return DebateResponse(
+        debate=[
+            DebateStep(speaker="System", content="Council connection unstable. Proceeding with default protocol.")
         ],
-        "consensus": "The council has decided..."
-    }}
+        consensus="Proceed with caution."
+    )
+
+def get_council_llm(api_key: Optional[str] = None, model: Optional[str] = None) -> LLMProvider:
+    return get_shared_llm(model or settings.council_model, api_key)
+
+class CouncilEngine:
+    """Runs a debate as one agent per member.
+
+    In each round every member writes its turn concurrently, from the
+    transcript of the rounds before it, so a debate takes about rounds x
+    the slowest member instead of one long completion. Turns are yielded
+    as they finish; a member that fails only loses its own turn. A final
+    consensus pass summarises the transcript.
     """
-    
-    try:
-        response_text = llm.generate(prompt)
-        
-        # Parse JSON from response (handling potential markdown blocks)
-        import json
-        clean_text = response_text.replace("```json", "").replace("```", "").strip()
-        data = json.loads(clean_text)
-        
-        return DebateResponse(**data)
-        
-    except Exception as e:
-        print(f"Council Debate Error: {e}")
-        # Fallback if AI fails to generate JSON
-        return DebateResponse(
-            debate=[
-                DebateStep(speaker="System", content="Council connection unstable. Proceeding with default protocol.")
-            ],
-            consensus="Proceed with caution."
-        )
+
+    def __init__(self, members: Optional[List[CouncilMember]] = None, rounds: Optional[int] = None,
+                 api_key: Optional[str] = None, models: Optional[Dict[str, str]] = None):
+        self.members = list(members or MEMBERS)
+        self.rounds = max(1, rounds or settings.council_rounds)
+        self.api_key = api_key
+        self.models = settings.council_models if models is None else models
+
+    def model_for(self, member: CouncilMember) -> str:
+        return member.model or self.models.get(member.name) or settings.council_model
+
+    async def _turn(self, member: CouncilMember, context: str, topic: str,
+                    transcript: List[DebateStep], round_number: int) -> Optional[DebateStep]:
+        others = [m for m in self.members if m.name != member.name]
+        prompt = build_turn_prompt(member, others, context, topic, transcript, round_number, self.rounds)
+        try:
+            text = await get_council_llm(self.api_key, self.model_for(member)).agenerate(prompt)
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"Council turn failed for {member.name} (round {round_number}): {e}")
+            return None
+        content = clean_turn(member, text)
+        return DebateStep(speaker=member.name, content=content, round=round_number) if content else None
+
+    async def _consensus(self, context: str, topic: str, transcript: List[DebateStep]) -> str:
+        try:
+            llm = get_council_llm(self.api_key, settings.council_model)
+            consensus = (await llm.agenerate(build_consensus_prompt(context, topic, transcript))).strip()
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"Council consensus failed: {e}")
+            consensus = ""
+        return consensus or fallback_debate().consensus
+
+    async def astream(self, context: str, topic: str) -> AsyncIterator[Union[DebateStep, DebateResponse]]:
+        """Yield each DebateStep as it completes, then the final DebateResponse."""
+        transcript: List[DebateStep] = []
+        for round_number in range(1, self.rounds + 1):
+            # Everyone in the round sees the same transcript of earlier rounds
+            seen = list(transcript)
+            tasks = [asyncio.create_task(self._turn(member, context, topic, seen, round_number))
+                     for member in self.members]
+            try:
+                for next_done in asyncio.as_completed(tasks):
+                    step = await next_done
+                    if step is not None:
+                        transcript.append(step)
+                        yield step
+            finally:
+                for task in tasks:
+                    task.cancel()
+        if not transcript:
+            yield fallback_debate()
+            return
+        yield DebateResponse(debate=transcript, consensus=await self._consensus(context, topic, transcript))
+
+    async def arun(self, context: str, topic: str) -> DebateResponse:
+        result = fallback_debate()
+        async for item in self.astream(context, topic):
+            if isinstance(item, DebateResponse):
+                result = item
+        return result
+
+def generate_council_debate(context: str, topic: str, api_key: Optional[str] = None) -> DebateResponse:
+    return asyncio.run(agenerate_council_debate(context, topic, api_key))
+
+async def agenerate_council_debate(context: str, topic: str, api_key: Optional[str] = None,
+                                   engine: Optional[CouncilEngine] = None) -> DebateResponse:
+    return await (engine or CouncilEngine(api_key=api_key)).arun(context, topic)
+
+async def astream_council_debate(context: str, topic: str, api_key: Optional[str] = None,
+                                 engine: Optional[CouncilEngine] = None
+                                 ) -> AsyncIterator[Union[DebateStep, DebateResponse]]:
+    """Yield each DebateStep as it is produced, then the final DebateResponse."""
+    async for item in (engine or CouncilEngine(api_key=api_key)).astream(context, topic):
+        yield item
@@ -0,0 +1,322 @@
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from loguru import logger
+
+from common.shared import SharedState
+from llm.scheduler import QueueFullError
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+@dataclass
+class JobRecord:
+    id: str
+    kind: str
+    status: str = QUEUED
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    partial: str = ""  # output so far: narrative text, or debate turns one per line
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+    def to_dict(self, offset: int = 0) -> Dict[str, Any]:
+        """API view; `offset` skips partial output the client already has."""
+        data = asdict(self)
+        data["partial"] = self.partial[offset:]
+        data["offset"] = offset
+        data["partial_length"] = len(self.partial)
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "JobRecord":
+        return cls(**{k: data[k] for k in cls.__dataclass_fields__ if k in data})
+
+
+class JobStore:
+    """Job records, the newest `max_records` in memory.
+
+    Older finished records spill to `directory` as one JSON file each and
+    are read back on demand; spilled files expire after `ttl`. Queued and
+    running jobs always stay in memory. With `shared` set, records are also
+    mirrored there (partial output at most every `sync_interval` seconds),
+    so any API worker can answer a poll. The `a*` methods are for the event
+    loop: shared-state writes and spills run off it, in call order.
+    """
+
+    def __init__(self, max_records: int = 200, directory: Optional[str] = None, ttl: float = 24 * 3600,
+                 shared: Optional[SharedState] = None, sync_interval: float = 0.5):
+        self.max_records = max_records
+        self.directory = directory
+        self.ttl = ttl
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self._records: "OrderedDict[str, JobRecord]" = OrderedDict()
+        self._synced: Dict[str, float] = {}
+        self._spilling: Set[str] = set()
+        self._write_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._write_lock: Optional[asyncio.Lock] = None
+        self._spills = 0
+        self.spilled = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def add(self, record: JobRecord):
+        self._records[record.id] = record
+        self.save(record, force=True)
+        self.trim()
+
+    def due(self, record: JobRecord, force: bool = False) -> bool:
+        """Whether `record` should be mirrored now; marks it synced if so."""
+        if self.shared is None:
+            return False
+        now = time.monotonic()
+        if not force and not record.finished and now - self._synced.get(record.id, 0.0) < self.sync_interval:
+            return False
+        self._synced[record.id] = now
+        return True
+
+    def save(self, record: JobRecord, force: bool = False):
+        if self.due(record, force):
+            self.shared.set(f"job:{record.id}", json.dumps(asdict(record)), ttl=self.ttl)
+
+    def _writes(self) -> asyncio.Lock:
+        # Serializes async writes so an older snapshot never lands after a newer one
+        loop = asyncio.get_running_loop()
+        if self._write_loop is not loop:
+            self._write_loop, self._write_lock = loop, asyncio.Lock()
+        return self._write_lock
+
+    async def aadd(self, record: JobRecord):
+        self._records[record.id] = record
+        await self.asave(record, force=True)
+        await self.atrim()
+
+    async def asave(self, record: JobRecord, force: bool = False):
+        if not self.due(record, force):
+            return
+        async with self._writes():
+            # Serialized when the write starts, so it carries the latest state
+            payload = json.dumps(asdict(record))
+            await asyncio.to_thread(self.shared.set, f"job:{record.id}", payload, self.ttl)
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        record = self._records.get(job_id)
+        if record is not None:
+            return record
+        if self.directory and os.path.exists(self._path(job_id)):
+            record = self._read(self._path(job_id))
+            if record is not None:
+                return record
+        if self.shared is not None:
+            raw = self.shared.get(f"job:{job_id}")
+            if raw is not None:
+                return JobRecord.from_dict(json.loads(raw))
+        return None
+
+    def owns(self, job_id: str) -> bool:
+        return job_id in self._records
+
+    def _read(self, path: str) -> Optional[JobRecord]:
+        try:
+            with open(path) as f:
+                record = JobRecord.from_dict(json.load(f))
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable job record {path}: {e}")
+            return None
+        if time.time() - (record.finished_at or record.created_at) > self.ttl:
+            os.remove(path)
+            return None
+        return record
+
+    def _victims(self) -> List[JobRecord]:
+        # Oldest finished records beyond the bound; active jobs always stay
+        excess = len(self._records) - len(self._spilling) - self.max_records
+        if excess <= 0:
+            return []
+        finished = (r for r in self._records.values() if r.finished and r.id not in self._spilling)
+        return list(itertools.islice(finished, excess))
+
+    def _evict(self, record: JobRecord):
+        self._records.pop(record.id, None)
+        self._synced.pop(record.id, None)
+        self._spilling.discard(record.id)
+
+    def trim(self):
+        for victim in self._victims():
+            self._spill(victim)
+            self._evict(victim)
+
+    async def atrim(self):
+        victims = self._victims()
+        self._spilling.update(victim.id for victim in victims)
+        for victim in victims:
+            try:
+                # Written before it leaves memory, so a poll always finds it
+                await asyncio.to_thread(self._spill, victim)
+            finally:
+                self._evict(victim)
+
+    def _spill(self, record: JobRecord):
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".job-", suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(asdict(record), f)
+        os.replace(tmp, self._path(record.id))
+        self.spilled += 1
+        self._spills += 1
+        if self._spills % 100 == 0:
+            self.sweep()
+
+    def sweep(self) -> int:
+        """Delete spilled records older than the TTL."""
+        if not self.directory or not os.path.isdir(self.directory):
+            return 0
+        cutoff = time.time() - self.ttl
+        removed = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".json") and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        return removed
+
+
+JobHandler = Callable[[JobRecord], Awaitable[Dict[str, Any]]]
+
+
+class JobRunner:
+    """Runs submitted jobs on a pool of `workers` asyncio tasks.
+
+    At most `max_queue` jobs wait; beyond that `submit` raises
+    QueueFullError, like the scheduler, instead of queueing unbounded work.
+    A handler reports progress by appending to `record.partial` through
+    `progress()` and returns the job's result.
+    """
+
+    def __init__(self, store: JobStore, workers: int = 4, max_queue: int = 100):
+        self.store = store
+        self.workers = workers
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: list = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._handlers: Dict[str, JobHandler] = {}
+        self._saves: Set[asyncio.Future] = set()
+        self._stopping = False
+        self.completed = 0
+        self.failed = 0
+
+    def _bind_loop(self):
+        # Workers and the queue belong to one event loop; restart them if it changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._stopping = loop, False
+            self._queue = asyncio.Queue()
+            self._running = {}
+            self._workers = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def submit(self, kind: str, handler: JobHandler) -> JobRecord:
+        self._bind_loop()
+        if self._queue.qsize() >= self.max_queue:
+            raise QueueFullError(retry_after=5.0)
+        record = JobRecord(id=uuid.uuid4().hex, kind=kind)
+        await self.store.aadd(record)
+        self._handlers[record.id] = handler
+        self._queue.put_nowait(record)
+        return record
+
+    def progress(self, record: JobRecord, text: str):
+        record.partial += text
+        if self.store.due(record):
+            # Called from inside the handler: mirror it in the background
+            save = asyncio.ensure_future(self.store.asave(record, force=True))
+            self._saves.add(save)
+            save.add_done_callback(self._saves.discard)
+
+    async def cancel(self, job_id: str) -> bool:
+        if not self.store.owns(job_id):
+            return False
+        record = self.store.get(job_id)  # in memory: owned records are never spilled
+        if record.finished:
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        else:
+            await self._finish(record, CANCELLED)  # still queued: the worker skips it
+        return True
+
+    async def _finish(self, record: JobRecord, status: str, result: Optional[Dict[str, Any]] = None,
+                      error: Optional[str] = None):
+        record.status, record.result, record.error = status, result, error
+        record.finished_at = time.time()
+        self._handlers.pop(record.id, None)
+        await self.store.asave(record, force=True)
+        await self.store.atrim()
+
+    async def _work(self):
+        while True:
+            record = await self._queue.get()
+            handler = self._handlers.get(record.id)
+            if record.finished or handler is None:
+                continue
+            record.status, record.started_at = RUNNING, time.time()
+            task = asyncio.create_task(handler(record))
+            self._running[record.id] = task
+            try:
+                await self.store.asave(record, force=True)
+                result = await task
+            except asyncio.CancelledError:
+                task.cancel()  # the worker may have been cancelled while mirroring the record
+                await self._finish(record, CANCELLED)
+                if self._stopping:
+                    raise
+            except Exception as e:
+                logger.warning(f"Job {record.id} ({record.kind}) failed: {e}")
+                self.failed += 1
+                await self._finish(record, FAILED, error=str(e))
+            else:
+                self.completed += 1
+                await self._finish(record, SUCCEEDED, result=result)
+            finally:
+                self._running.pop(record.id, None)
+
+    async def stop(self):
+        """Cancel the workers and any running jobs."""
+        self._stopping = True
+        for task in [*self._running.values(), *self._workers]:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._saves, return_exceptions=True)
+        self._workers, self._loop = [], None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "running": len(self._running),
+            "completed": self.completed,
+            "failed": self.failed,
+            "in_memory": len(self.store),
+            "spilled": self.store.spilled,
+        }
@@ -2,20 +2,93 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from fastapi import FastAPI, HTTPException, Body
+from contextlib import asynccontextmanager
+from functools import partial
+from fastapi import FastAPI, HTTPException, Body, Query
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Callable, Dict, List, Literal, Optional
+import asyncio
+import json
 import os
+import time
 
 from config import settings
-from story.spec import build_act_specification
+from story.spec import act_for, default_world_spec
+from story.footer import FooterParser
+from story.extraction import ActState, arepair_act_state, extract_act, format_footer
+from story.context import build_bounded_context
+from story.memory import StoryMemory, make_embedder
+from story.analytics import save_all as save_analytics
 from prompts import build_prompt
-from llm.provider import OpenRouterLLM
+from llm.provider import LLMProvider, OpenRouterLLM
+from llm.scheduler import (PRIORITY_INTERACTIVE, PRIORITY_NAMES, PRIORITY_PREFETCH, QueueFullError,
+                           ScheduledLLM, get_scheduler, key_id)
+from llm.http import close_async_client
+from llm.cache import with_cache, get_response_cache
+from llm.router import get_router
+from llm.catalog import get_catalog
 from common.state import StateManager
-from list_models import list_models # Reusing logic if possible, or we can inline it
+from common.shared import get_shared_state
+from story.exporter import EXPORT_FORMATS, ExportQueue, StoryExporter, iter_file
+from common.metrics import REGISTRY, SLOW_TRACES, histogram, trace
+from api.sessions import SessionStore, StorySession
+from api.prefetch import BranchPrefetcher
+from api.jobs import JobRecord, JobRunner, JobStore
+from image.factory import get_image_queue
 
-app = FastAPI(title="Narrative Generation API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if settings.model_catalog_refresh > 0:
+        get_catalog().start(settings.model_catalog_refresh)
+    yield
+    get_catalog().stop()
+    await jobs.stop()
+    await run_in_threadpool(exports.shutdown)
+    images = get_image_queue()
+    if images is not None:
+        await images.stop()
+    await run_in_threadpool(save_analytics)
+    # Release the shared keep-alive pool used by async providers
+    await close_async_client()
+
+app = FastAPI(title="Narrative Generation API", lifespan=lifespan)
+
+HTTP_SECONDS = histogram("http_request_seconds", "API request latency, including streamed bodies",
+                         ["method", "route", "status"])
+SLOW_TRACES.capacity = settings.metrics_slow_traces
+
+class MetricsMiddleware:
+    """Times every request (through the last streamed byte) and traces its stages."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with trace(f"{scope['method']} {scope['path']}") as root:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # Route template, not the raw path, to keep label cardinality bounded
+                route = getattr(scope.get("route"), "path", "unmatched")
+                root.set(status=status)
+                HTTP_SECONDS.observe(time.perf_counter() - root.start, method=scope["method"],
+                                     route=route, status=status)
+
+app.add_middleware(MetricsMiddleware)
 
 # Allow CORS for React app
 # Allow CORS for all origins (Simplifies deployment)
@@ -27,6 +100,29 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def make_llm(model: str, api_key: Optional[str] = None, priority: int = PRIORITY_INTERACTIVE,
+             json_mode: bool = False) -> LLMProvider:
+    """Provider for one request: explicit credentials, scheduled, then cached."""
+    llm = OpenRouterLLM(model=model, api_key=api_key, json_mode=json_mode)
+    return with_cache(ScheduledLLM(llm, get_scheduler(), key_id(api_key), priority))
+
+def error_payload(e: Exception) -> dict:
+    if isinstance(e, QueueFullError):
+        return {"detail": str(e), "retry_after": e.retry_after}
+    import traceback
+    traceback.print_exception(e)
+    return {"detail": str(e)}
+
+def api_error(e: Exception) -> HTTPException:
+    if isinstance(e, HTTPException):
+        return e
+    payload = error_payload(e)
+    if isinstance(e, QueueFullError):
+        # Saturated: tell the client when to come back instead of hanging
+        return HTTPException(status_code=503, detail=payload["detail"],
+                             headers={"Retry-After": str(int(e.retry_after + 0.999))})
+    return HTTPException(status_code=500, detail=payload["detail"])
+
 class GenerateRequest(BaseModel):
     api_key: Optional[str] = None
     model: str
@@ -37,85 +133,735 @@ class GenerateRequest(BaseModel):
 
 class GenerateResponse(BaseModel):
     story: str
+    narrative: Optional[str] = None
+    state: Optional[ActState] = None  # None if the footer could not be parsed or repaired
+    image: Optional[Dict[str, Any]] = None  # the illustration's render job (see /images)
+
+async def complete_act(output: str, model: str, api_key: Optional[str] = None,
+                       priority: int = PRIORITY_INTERACTIVE) -> tuple:
+    """Parse an act's state footer, re-asking for only the footer if it is missing or broken.
+
+    Returns (story, narrative, state); a repaired footer is appended to the
+    story so clients that parse the raw text see it too.
+    """
+    narrative, state = extract_act(output)
+    if state is None and settings.extraction_repair:
+        try:
+            state = await arepair_act_state(make_llm(model, api_key, priority, json_mode=True), narrative)
+        except QueueFullError:
+            raise
+        except Exception as e:
+            print(f"Footer repair failed: {e}")
+        if state is not None:
+            output = f"{narrative}\n\n{format_footer(state)}"
+    return output, narrative, state
+
+def start_image(prompt: Optional[str], session_id: Optional[str] = None,
+                priority: int = PRIORITY_INTERACTIVE) -> Optional[dict]:
+    """Queue the illustration for an act's image prompt; None if images are off or saturated."""
+    images = get_image_queue()
+    if images is None or not prompt:
+        return None
+    try:
+        return images.describe(images.submit(prompt, session_id, priority))
+    except QueueFullError:
+        return None  # the act still goes out, just without a picture
+
+def compose_prompt(act_name: str, world_description: str,
+                   story_so_far: Optional[str] = None, choice: Optional[str] = None,
+                   passages: Optional[List[str]] = None) -> tuple:
+    # Per-request world: a new immutable spec, the shared settings stay untouched
+    spec = act_for(default_world_spec(world_description), act_name)
+    
+    # Prepare Context
+    context_data = {"spec": spec}
+    
+    # If continuing a story
+    if story_so_far and choice:
+        context_data["previous_context"] = f"{story_so_far}\n\nUSER CHOICE SELECTED: {choice}"
+        if passages:
+            context_data["relevant_passages"] = passages
+    
+    # Build Prompt
+    prompts = build_prompt()
+    context = prompts.handle(context_data)
+    return spec, context["final_prompt"]
+
+def build_generation_prompt(request: GenerateRequest, consensus: Optional[str] = None) -> tuple:
+    story_so_far = None
+    if request.previous_context and request.choice:
+        # Rolling summary + last acts, bounded to the configured token budget
+        story_so_far = build_bounded_context(
+            request.previous_context,
+            token_budget=settings.context_token_budget,
+            recent_acts=settings.context_recent_acts
+        )
+        if consensus:
+            story_so_far = f"{story_so_far}\n\n[COUNCIL CONSENSUS]: {consensus}"
+    return compose_prompt(request.act_name, request.world_description, story_so_far, request.choice)
+
+async def generate_act(request: GenerateRequest,
+                       on_text: Optional[Callable[[str], None]] = None) -> GenerateResponse:
+    """One act for `request`; with `on_text`, narrative text is streamed to it as it arrives."""
+    spec, prompt = build_generation_prompt(request)
+    
+    # Generate
+    llm = make_llm(request.model, request.api_key)
+    if on_text is not None:
+        # Same path as /generate/stream, with the tokens fed to `on_text`
+        result = None
+        async for event, data in stream_act_events(llm, prompt, spec.name, request.api_key):
+            if event == "token":
+                on_text(data["text"])
+            elif event == "act":
+                result = data
+        return GenerateResponse(**result)
+
+    output = await llm.agenerate(prompt)
+    output, narrative, state = await complete_act(output, request.model, request.api_key)
+    image = start_image(state.image_prompt) if state is not None else None
+    
+    # Save State (Optional) - file I/O stays off the event loop
+    state_manager = StateManager()
+    await run_in_threadpool(state_manager.save_state, spec.name, output)
+    
+    return GenerateResponse(story=output, narrative=narrative, state=state, image=image)
 
 @app.post("/generate", response_model=GenerateResponse)
 async def generate_story(request: GenerateRequest):
     try:
-        # Set API Key if provided, otherwise use existing env/settings
-        if request.api_key:
-            os.environ["OPENROUTER_API_KEY"] = request.api_key
-        
-        # Update Settings
-        settings.world.description = request.world_description
-        
-        # Build Spec
-        spec = build_act_specification(
-            settings.characters,
-            settings.world,
-            act_name=request.act_name
+        return await generate_act(request)
+    except Exception as e:
+        raise api_error(e)
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_act_events(llm, prompt: str, act_name: str, api_key: Optional[str] = None):
+    """Yield (event, data) pairs for one streamed act, then save it.
+
+    The last event, `act`, carries the finished act (GenerateResponse fields)
+    for callers that need the whole result; SSE endpoints do not forward it.
+    """
+    parser = FooterParser()
+    chunks = []
+    state_sent = image_sent = False
+    image = None
+    async for token in llm.astream(prompt):
+        chunks.append(token)
+        text = parser.feed(token)
+        if text:
+            yield "token", {"text": text}
+        if not image_sent and parser.image_prompt:
+            # Rendering starts before the rest of the footer has arrived
+            image_sent = True
+            image = start_image(parser.image_prompt)
+            if image is not None:
+                yield "image", image
+        if parser.closed and parser.state and not state_sent:
+            yield "state", parser.state.model_dump()
+            state_sent = True
+    rest = parser.finish()
+    if rest:
+        yield "token", {"text": rest}
+
+    output = "".join(chunks)
+    if state_sent:
+        narrative, state = extract_act(output)[0], parser.state
+    else:
+        # Missing or broken footer: repair it without regenerating the act
+        output, narrative, state = await complete_act(output, llm.model, api_key)
+        yield "state", state.model_dump() if state else {}
+        if state and not image_sent:
+            image = start_image(state.image_prompt)
+            if image is not None:
+                yield "image", image
+    state_manager = StateManager()
+    await run_in_threadpool(state_manager.save_state, act_name, output)
+    yield "act", {"story": output, "narrative": narrative,
+                  "state": state.model_dump() if state else None, "image": image}
+
+@app.post("/generate/stream")
+async def generate_story_stream(request: GenerateRequest):
+    """Server-Sent Events variant of /generate.
+
+    Emits `token` events with narrative text as it arrives, an `image` event
+    (the render job, see /images) as soon as the footer's image_prompt is
+    complete, a `state` event with the parsed JSON footer (image_prompt,
+    dharma, karma, inventory, choices) once its closing fence is seen, then
+    `done` or `error`.
+    """
+    try:
+        spec, prompt = build_generation_prompt(request)
+        llm = make_llm(request.model, request.api_key)
+    except Exception as e:
+        raise api_error(e)
+
+    async def events():
+        try:
+            async for event, data in stream_act_events(llm, prompt, spec.name, request.api_key):
+                if event != "act":
+                    yield sse_event(event, data)
+            yield sse_event("done", {})
+        except Exception as e:
+            yield sse_event("error", error_payload(e))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Story Sessions: the server keeps the transcript, clients send only a session id
+sessions = SessionStore(
+    max_sessions=settings.session_max,
+    ttl=settings.session_ttl,
+    token_budget=settings.context_token_budget,
+    recent_acts=settings.context_recent_acts,
+    memory_factory=(lambda: StoryMemory(make_embedder(settings.memory_embedding_model),
+                                        settings.memory_chunk_tokens))
+    if settings.memory_enabled else None,
+    shared=get_shared_state(),
+)
+
+prefetcher = BranchPrefetcher(
+    max_concurrency=settings.prefetch_max_concurrency,
+    per_session=settings.prefetch_per_session,
+    keep_alternates=settings.prefetch_keep_alternates
+)
+
+class CreateSessionRequest(BaseModel):
+    api_key: Optional[str] = None
+    model: str
+    act_name: str
+    world_description: str
+
+class ChoiceRequest(BaseModel):
+    choice: Optional[str] = None
+    choice_index: Optional[int] = None
+    consensus: Optional[str] = None
+
+class ForkRequest(BaseModel):
+    node_id: str
+
+async def get_session_or_404(session_id: str) -> StorySession:
+    session = await sessions.aget(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    return session
+
+async def generate_continuation(session: StorySession, choice: Optional[str] = None,
+                                consensus: Optional[str] = None, story_so_far: Optional[str] = None,
+                                priority: int = PRIORITY_INTERACTIVE) -> str:
+    if choice and story_so_far is None:
+        story_so_far = session.context.build()
+    if story_so_far and consensus:
+        story_so_far = f"{story_so_far}\n\n[COUNCIL CONSENSUS]: {consensus}"
+    passages = None
+    if choice and settings.memory_enabled:
+        passages = session.recall(choice, settings.memory_top_k, settings.memory_token_budget)
+    _, prompt = compose_prompt(session.act_name, session.world_description, story_so_far, choice, passages)
+    llm = make_llm(session.model, session.api_key, priority)
+    output = await llm.agenerate(prompt)
+    output, _, _ = await complete_act(output, session.model, session.api_key, priority)
+    return output
+
+async def keep_alternate(session_id: str, act_index: int, choice: str, story: str):
+    """Add a prefetched branch the user did not pick to the session graph, under
+    the session lock (the branch may finish long after the pick), and save it."""
+    session = await sessions.aget(session_id)
+    if session is None:
+        return
+    try:
+        async with sessions.locked(session):
+            session.add_alternate(act_index, choice, story)
+    except Exception as e:
+        print(f"Could not keep alternate branch {choice!r} of session {session_id}: {e}")
+
+async def advance_session(session: StorySession, choice: Optional[str] = None,
+                          consensus: Optional[str] = None) -> dict:
+    act_index = len(session.acts)
+    output = None
+    if choice and not consensus:
+        # Served instantly if this branch was prefetched
+        output = await prefetcher.take(session.id, act_index, choice)
+    prefetched = output is not None
+    prefetcher.release(session.id, on_alternate=partial(keep_alternate, session.id))
+    if output is None:
+        output = await generate_continuation(session, choice, consensus)
+    node = session.apply_act(output, choice)
+    image = start_image(session.image_prompt, session.id)
+
+    state_manager = StateManager()
+    await run_in_threadpool(state_manager.save_state, session.act_name, output,
+                            session_id=session.id, choice=choice,
+                            node_id=node.id, parent_id=node.parent_id)
+
+    if settings.prefetch_enabled and session.choices:
+        # Snapshot the context now; branches may run after the session moves on
+        story_so_far = session.context.build()
+        prefetcher.schedule(
+            session.id, len(session.acts), session.choices,
+            lambda branch: generate_continuation(session, branch, story_so_far=story_so_far,
+                                                 priority=PRIORITY_PREFETCH)
         )
-        
-        # Prepare Context
-        context_data = {"spec": spec}
-        
-        # If continuing a story
-        if request.previous_context and request.choice:
-            context_data["previous_context"] = f"{request.previous_context}\n\nUSER CHOICE SELECTED: {request.choice}"
-        
-        # Build Prompt
-        prompts = build_prompt()
-        context = prompts.handle(context_data)
-        
-        # Generate
-        llm = OpenRouterLLM(model=request.model)
-        output = llm.generate(context["final_prompt"])
-        
-        # Save State (Optional)
-        state_manager = StateManager()
-        state_manager.save_state(spec.name, output)
-        
-        return GenerateResponse(story=output)
-        
+    return {"prefetched": prefetched, "image": image}
+
+@app.post("/sessions")
+async def create_session(request: CreateSessionRequest):
+    session = await sessions.acreate(request.model, request.act_name, request.world_description, request.api_key)
+    try:
+        async with sessions.locked(session):
+            outcome = await advance_session(session)
+    except Exception as e:
+        await sessions.adelete(session.id)
+        prefetcher.forget(session.id)
+        raise api_error(e)
+    return {**session.to_dict(include_acts=False), "image": outcome["image"]}
+
+@app.post("/sessions/{session_id}/choices")
+async def choose(session_id: str, request: ChoiceRequest):
+    session = await get_session_or_404(session_id)
+    try:
+        choice = session.resolve_choice(request.choice, request.choice_index)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    try:
+        # One continuation at a time per session
+        async with sessions.locked(session):
+            outcome = await advance_session(session, choice, request.consensus)
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise api_error(e)
+    return {**session.to_dict(include_acts=False), **outcome}
+
+exports = ExportQueue(StoryExporter(settings.export_dir, settings.export_ttl))
+
+def branch_history(state_manager: StateManager, session_id: str, path: Optional[List[str]] = None):
+    """Saved acts of one branch of a session, root first: the node ids in
+    `path`, or (for a session no longer in memory) the branch ending at its
+    most recently saved act. Entries saved without node ids are all kept."""
+    if path is None:
+        parents, head = {}, None
+        for entry in state_manager.iter_history(session_id=session_id):
+            if entry.get("node_id"):
+                parents[entry["node_id"]] = entry.get("parent_id")
+                head = entry["node_id"]
+        path = []
+        while head is not None and head not in path:
+            path.append(head)
+            head = parents.get(head)
+    on_path = set(path)
+    for entry in state_manager.iter_history(session_id=session_id):
+        if not on_path or entry.get("node_id") in on_path:
+            yield entry
+
+@app.get("/sessions/{session_id}/export")
+async def export_session(session_id: str, format: Literal["md", "html", "json", "epub"] = "md"):
+    """Build the session's current branch as a document and stream it back in chunks.
+
+    Acts are streamed from the story store (so sessions that have expired
+    from memory can still be exported) on the background export writer.
+    """
+    session = await sessions.aget(session_id)
+    path = list(session.path) if session else None
+    state_manager = StateManager()
+    first = await run_in_threadpool(lambda: next(state_manager.iter_history(session_id=session_id), None))
+    if first is None:
+        raise HTTPException(status_code=404, detail="No saved acts for this session")
+    title = session.act_name if session else first.get("act", "Story")
+
+    try:
+        future = exports.submit(title, lambda: branch_history(state_manager, session_id, path), format)
+        path = await asyncio.wrap_future(future)
+    except Exception as e:
+        raise api_error(e)
+    return StreamingResponse(
+        iter_file(path),
+        media_type=EXPORT_FORMATS[format].media_type,
+        headers={"Content-Disposition": f'attachment; filename="{os.path.basename(path)}"'},
+    )
+
+@app.get("/sessions/{session_id}")
+async def get_session(session_id: str):
+    return (await get_session_or_404(session_id)).to_dict()
+
+@app.get("/sessions/{session_id}/graph")
+async def session_graph(session_id: str, cursor: int = 0, limit: int = Query(100, ge=1, le=1000)):
+    """Node summaries of every branch, a page at a time (follow `next_cursor`)."""
+    return (await get_session_or_404(session_id)).graph.page(cursor, limit)
+
+@app.get("/sessions/{session_id}/graph/changes")
+async def session_graph_changes(session_id: str, since: int = 0):
+    """What changed after revision `since`; `reset` means page the graph again."""
+    return (await get_session_or_404(session_id)).graph.changes(since)
+
+@app.get("/sessions/{session_id}/graph/nodes/{node_id}/path")
+async def session_graph_path(session_id: str, node_id: str):
+    graph = (await get_session_or_404(session_id)).graph
+    if node_id not in graph:
+        raise HTTPException(status_code=404, detail="Story node not found")
+    return {"nodes": [{**node.summary(), "content": node.content} for node in graph.path(node_id)]}
+
+@app.delete("/sessions/{session_id}/graph/nodes/{node_id}")
+async def prune_session_graph(session_id: str, node_id: str):
+    session = await get_session_or_404(session_id)
+    async with sessions.locked(session):
+        if node_id not in session.graph:
+            raise HTTPException(status_code=404, detail="Story node not found")
+        if session.head and session.graph.is_ancestor(node_id, session.head):
+            raise HTTPException(status_code=409, detail="Cannot prune the current branch; fork elsewhere first")
+        removed = session.graph.prune(node_id)
+    return {"removed": removed, "revision": session.graph.revision}
+
+@app.post("/sessions/{session_id}/fork")
+async def fork_session(session_id: str, request: ForkRequest):
+    """Continue from an earlier act: the next choice starts a new branch there."""
+    session = await get_session_or_404(session_id)
+    async with sessions.locked(session):
+        if request.node_id not in session.graph:
+            raise HTTPException(status_code=404, detail="Story node not found")
+        # Speculative branches were for the old head
+        prefetcher.forget(session.id)
+        session.checkout(request.node_id, sessions.new_context(), sessions.new_memory())
+    return session.to_dict(include_acts=False)
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    if not await sessions.adelete(session_id):
+        raise HTTPException(status_code=404, detail="Session not found or expired")
+    prefetcher.forget(session_id)
+    return {"deleted": session_id}
+
+@app.get("/prefetch/stats")
+async def prefetch_stats():
+    return {"enabled": settings.prefetch_enabled, **prefetcher.stats()}
 
 @app.get("/models")
-async def get_models():
-    # Return a static list for simplicity, or fetch dynamically
+async def get_models(free: Optional[bool] = None, json_mode: Optional[bool] = None,
+                     min_context: int = Query(0, ge=0)):
+    # Served from the in-memory catalog; the background refresh keeps it current
+    catalog = get_catalog()
+    filters = {"free": free, "json_mode": json_mode, "min_context": min_context}
     return {
-        "models": [
-            "meta-llama/llama-3.2-3b-instruct:free",
-            "mistralai/mistral-7b-instruct:free",
-            "google/gemini-2.0-flash-exp:free"
-        ]
+        "models": catalog.ids(**filters),
+        "details": [m.to_dict() for m in catalog.query(**filters)],
+        "catalog": catalog.stats(),
     }
 
+@app.get("/cache/stats")
+async def cache_stats():
+    from config import settings
+    return {"enabled": settings.llm_cache_enabled, **get_response_cache().stats()}
+
+@app.get("/router/stats")
+async def router_stats():
+    # Per-model success rate, latency percentiles and circuit state
+    return {"models": get_router().snapshot()}
+
+@app.get("/scheduler/stats")
+async def scheduler_stats():
+    # Queue depth, running slots and wait-time percentiles
+    return get_scheduler().stats()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Prometheus text format: per-stage, upstream, queue and request histograms
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/traces/slowest")
+async def slowest_traces():
+    # Span trees of the slowest recent requests (METRICS_SLOW_TRACES, 0 disables)
+    return SLOW_TRACES.slowest()
+
+@app.get("/stats")
+async def story_stats(act: Optional[str] = None, session_id: Optional[str] = None,
+                      node_id: Optional[str] = None):
+    """Choice popularity and dharma/karma distributions, kept up to date as acts are saved.
+
+    Always returns the overall summary; `act`, `session_id` (per-node stats
+    for the MultiverseMap) and `node_id` (a node and its branch) add sections.
+    """
+    analytics = StateManager().analytics
+
+    def collect() -> dict:
+        result = {"summary": analytics.summary()}
+        if act is not None:
+            result["act"] = analytics.act(act)
+        if session_id is not None:
+            result["session"] = analytics.session(session_id)
+        if node_id is not None:
+            result["node"] = analytics.node(node_id)
+        return result
+
+    result = await run_in_threadpool(collect)
+    if node_id is not None and result["node"] is None:
+        raise HTTPException(status_code=404, detail="Node not found")
+    return result
+
+# Illustrations: renders are queued as image prompts arrive and served from the disk cache
+PRIORITIES = {name: priority for priority, name in PRIORITY_NAMES.items()}
+
+class ImageRequest(BaseModel):
+    prompt: str = Field(..., min_length=1, max_length=2000)
+    session_id: Optional[str] = None
+    priority: Literal["interactive", "prefetch", "batch"] = "interactive"
+
+def image_queue_or_503():
+    images = get_image_queue()
+    if images is None:
+        raise HTTPException(status_code=503, detail="Image generation is disabled")
+    return images
+
+@app.post("/images", status_code=202)
+async def submit_image(request: ImageRequest):
+    images = image_queue_or_503()
+    try:
+        job = images.submit(request.prompt, request.session_id, PRIORITIES[request.priority])
+    except Exception as e:
+        raise api_error(e)
+    return images.describe(job)
+
+@app.get("/images/stats")
+async def image_stats():
+    images = get_image_queue()
+    return {"enabled": images is not None, **(images.stats() if images else {})}
+
+@app.get("/images/{image_id}")
+async def get_image(image_id: str):
+    images = image_queue_or_503()
+    job = images.get(image_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return images.describe(job)
+
+def image_file(image_id: str, thumbnail: bool) -> FileResponse:
+    path = image_queue_or_503().path(image_id, thumbnail)
+    if path is None or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Image not found or not rendered yet")
+    # An id always names the same picture, so clients may cache it for good
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+@app.get("/images/{image_id}/file")
+async def image_full(image_id: str):
+    return image_file(image_id, thumbnail=False)
+
+@app.get("/images/{image_id}/thumbnail")
+async def image_thumbnail(image_id: str):
+    return image_file(image_id, thumbnail=True)
+
 @app.get("/health")
 async def health_check():
     return {"status": "ok"}
 
 # Council Debate Endpoint
-from api.council import generate_council_debate, DebateResponse
+from api.council import (CouncilEngine, CouncilMember, agenerate_council_debate, astream_council_debate,
+                         DebateResponse, DebateStep)
 
-class CouncilRequest(BaseModel):
+class CouncilOptions(BaseModel):
+    # Defaults: the three built-in members and settings.council_rounds
+    members: Optional[List[CouncilMember]] = Field(None, min_length=1, max_length=8)
+    rounds: Optional[int] = Field(None, ge=1, le=6)
+
+class CouncilRequest(CouncilOptions):
+    api_key: Optional[str] = None
     world_context: str
     topic: str
 
+def council_engine(request: CouncilOptions, api_key: Optional[str]) -> CouncilEngine:
+    return CouncilEngine(request.members, request.rounds, api_key)
+
 @app.post("/council/debate", response_model=DebateResponse)
 async def debate(request: CouncilRequest):
     try:
-        if not os.getenv("OPENROUTER_API_KEY") and not settings.openrouter_api_key:
+        if not request.api_key and not os.getenv("OPENROUTER_API_KEY") and not settings.openrouter_api_key:
              raise HTTPException(status_code=500, detail="API Key not configured")
 
-        # Use fallback if key missing in env but present in request?
-        # Actually generate_story sets the env var. Here we might need it too.
-        # But this is a separate request. The api_key should be verified.
-        # For simplicity, we assume the environment has the key (which it does via .env).
-        
-        return generate_council_debate(request.world_context, request.topic)
+        return await agenerate_council_debate(request.world_context, request.topic,
+                                              engine=council_engine(request, request.api_key))
     except Exception as e:
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=str(e))
+        raise api_error(e)
+
+# Combined Turn: council debate + next act in one round trip
+class TurnRequest(GenerateRequest, CouncilOptions):
+    topic: Optional[str] = None
+    # parallel: debate and act run concurrently (act ignores the consensus)
+    # pipeline: act is generated after, and conditioned on, the consensus
+    mode: Literal["parallel", "pipeline"] = "parallel"
+
+class TurnResponse(BaseModel):
+    debate: DebateResponse
+    story: str
+
+def council_inputs(request: TurnRequest) -> tuple:
+    topic = request.topic or (f"User chose: {request.choice}" if request.choice else request.act_name)
+    if request.previous_context:
+        topic = f"Current Context: {request.previous_context[-500:]}... \n\nDecision/Topic: {topic}"
+    return request.world_description, topic
+
+@app.post("/turn", response_model=TurnResponse)
+async def play_turn(request: TurnRequest):
+    try:
+        world_context, topic = council_inputs(request)
+        engine = council_engine(request, request.api_key)
+
+        async def act(consensus: Optional[str] = None) -> str:
+            spec, prompt = build_generation_prompt(request, consensus)
+            output = await make_llm(request.model, request.api_key).agenerate(prompt)
+            output, _, _ = await complete_act(output, request.model, request.api_key)
+            await run_in_threadpool(StateManager().save_state, spec.name, output)
+            return output
+
+        if request.mode == "parallel":
+            debate_result, story = await asyncio.gather(
+                agenerate_council_debate(world_context, topic, engine=engine), act()
+            )
+        else:
+            debate_result = await agenerate_council_debate(world_context, topic, engine=engine)
+            story = await act(debate_result.consensus)
+        return TurnResponse(debate=debate_result, story=story)
+    except Exception as e:
+        raise api_error(e)
+
+@app.post("/turn/stream")
+async def play_turn_stream(request: TurnRequest):
+    """SSE variant of /turn.
+
+    Emits `debate_turn` events as each council member's turn completes,
+    `consensus` when the debate ends, and the act's `token`/`state` events.
+    In parallel mode both streams are interleaved as they arrive.
+    """
+    world_context, topic = council_inputs(request)
+    try:
+        llm = make_llm(request.model, request.api_key)
+    except Exception as e:
+        raise api_error(e)
+
+    async def debate_events():
+        async for item in astream_council_debate(world_context, topic, engine=council_engine(request, request.api_key)):
+            if isinstance(item, DebateStep):
+                yield "debate_turn", item.model_dump()
+            else:
+                yield "consensus", item.model_dump()
+
+    async def act_events(consensus: Optional[str] = None):
+        spec, prompt = build_generation_prompt(request, consensus)
+        async for event in stream_act_events(llm, prompt, spec.name, request.api_key):
+            if event[0] != "act":
+                yield event
+
+    async def events():
+        try:
+            if request.mode == "parallel":
+                async for event, data in merge_streams(debate_events(), act_events()):
+                    yield sse_event(event, data)
+            else:
+                consensus = None
+                async for event, data in debate_events():
+                    if event == "consensus":
+                        consensus = data["consensus"]
+                    yield sse_event(event, data)
+                async for event, data in act_events(consensus):
+                    yield sse_event(event, data)
+            yield sse_event("done", {})
+        except Exception as e:
+            yield sse_event("error", error_payload(e))
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+async def merge_streams(*streams):
+    """Interleave several async iterators, yielding items as soon as any produces one."""
+    queue: asyncio.Queue = asyncio.Queue()
+    finished = object()
+
+    async def pump(stream):
+        try:
+            async for item in stream:
+                await queue.put(item)
+        except Exception as e:
+            await queue.put(e)
+        finally:
+            await queue.put(finished)
+
+    tasks = [asyncio.create_task(pump(stream)) for stream in streams]
+    remaining = len(tasks)
+    try:
+        while remaining:
+            item = await queue.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+# Background Jobs: POST returns an id at once, clients poll for partial output and the result
+jobs = JobRunner(
+    JobStore(max_records=settings.job_max_records, directory=settings.job_dir, ttl=settings.job_ttl,
+             shared=get_shared_state() if settings.shared_state_url else None),
+    workers=settings.job_workers,
+    max_queue=settings.job_max_queue,
+)
+
+JOB_KINDS = {"generate": GenerateRequest, "debate": CouncilRequest}
+
+class JobRequest(BaseModel):
+    kind: Literal["generate", "debate"]
+    params: Dict[str, Any]
+
+def job_handler(kind: str, request: BaseModel):
+    async def run_generate(record: JobRecord) -> dict:
+        response = await generate_act(request, on_text=lambda text: jobs.progress(record, text))
+        return response.model_dump()
+
+    async def run_debate(record: JobRecord) -> dict:
+        engine = council_engine(request, request.api_key)
+        result = None
+        async for item in astream_council_debate(request.world_context, request.topic, engine=engine):
+            if isinstance(item, DebateStep):
+                jobs.progress(record, f"{item.speaker}: {item.content}\n")
+            else:
+                result = item
+        return result.model_dump()
+
+    return run_generate if kind == "generate" else run_debate
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    try:
+        params = JOB_KINDS[request.kind].model_validate(request.params)
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+    try:
+        record = await jobs.submit(request.kind, job_handler(request.kind, params))
+    except Exception as e:
+        raise api_error(e)
+    return {"id": record.id, "kind": record.kind, "status": record.status}
+
+@app.get("/jobs/stats")
+async def job_stats():
+    return jobs.stats()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, offset: int = Query(0, ge=0)):
+    # `offset`: characters of partial output the client already has
+    record = await run_in_threadpool(jobs.store.get, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    return record.to_dict(offset)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    record = await run_in_threadpool(jobs.store.get, job_id)
+    if record is None:
+        raise HTTPException(status_code=404, detail="Job not found or expired")
+    if not await jobs.cancel(job_id):
+        detail = "Job already finished" if record.finished else "Job runs on another worker"
+        raise HTTPException(status_code=409, detail=detail)
+    return {"id": job_id, "status": "cancelled"}
@@ -0,0 +1,134 @@
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+PrefetchKey = Tuple[str, int, str]
+AlternateHandler = Callable[[int, str, str], Optional[Awaitable[None]]]
+
+
+def _alternate_callback(act_index: int, choice: str, on_alternate: AlternateHandler, pending: Set[asyncio.Task]):
+    def callback(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is None:
+            result = on_alternate(act_index, choice, task.result())
+            if result is not None:
+                # A coroutine handler (e.g. one that takes the session lock) runs as its own task
+                kept = asyncio.ensure_future(result)
+                pending.add(kept)
+                kept.add_done_callback(pending.discard)
+    return callback
+
+
+class BranchPrefetcher:
+    """Speculatively generates every pending choice of a session in the background.
+
+    Prefetch work is capped globally (`max_concurrency`) and per session
+    (`per_session`) with its own semaphores, so it can never occupy more than
+    that many upstream slots and foreground generations never wait behind it.
+    Results are keyed by (session id, act index, choice); once the user picks
+    one, the others are cancelled or, with `keep_alternates`, kept as
+    alternate branches. A session's semaphore exists only while it has
+    prefetches in flight, so sessions that expire leave nothing behind.
+    """
+
+    def __init__(self, max_concurrency: int = 4, per_session: int = 3, keep_alternates: bool = False):
+        self.max_concurrency = max_concurrency
+        self.per_session = per_session
+        self.keep_alternates = keep_alternates
+        self._tasks: Dict[PrefetchKey, asyncio.Task] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._global: Optional[asyncio.Semaphore] = None
+        self._per_session: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self._keeping: Set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+
+    def _bind_loop(self):
+        # Semaphores belong to one event loop; rebuild them if the loop changed
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._global = asyncio.Semaphore(self.max_concurrency)
+            self._per_session = {}
+            self._in_flight = defaultdict(int)
+            self._tasks = {}
+
+    def _session_semaphore(self, session_id: str) -> asyncio.Semaphore:
+        if session_id not in self._per_session:
+            self._per_session[session_id] = asyncio.Semaphore(self.per_session)
+        return self._per_session[session_id]
+
+    def schedule(self, session_id: str, act_index: int, choices: List[str],
+                 generate: Callable[[str], Awaitable[str]]):
+        """Start background generations for each of `choices`."""
+        self._bind_loop()
+        for choice in choices:
+            key = (session_id, act_index, choice)
+            if key not in self._tasks:
+                self._tasks[key] = asyncio.create_task(self._run(session_id, choice, generate))
+
+    async def _run(self, session_id: str, choice: str, generate: Callable[[str], Awaitable[str]]) -> str:
+        semaphore = self._session_semaphore(session_id)
+        self._in_flight[session_id] += 1
+        try:
+            async with semaphore:
+                async with self._global:
+                    return await generate(choice)
+        finally:
+            self._in_flight[session_id] -= 1
+            if not self._in_flight[session_id]:
+                del self._in_flight[session_id]
+                self._per_session.pop(session_id, None)
+
+    async def take(self, session_id: str, act_index: int, choice: str) -> Optional[str]:
+        """Return the prefetched continuation for `choice`, waiting if it is still running."""
+        self._bind_loop()
+        task = self._tasks.pop((session_id, act_index, choice), None)
+        if task is None:
+            self.misses += 1
+            return None
+        try:
+            result = await task
+        except Exception as e:
+            logger.warning(f"Prefetch for {session_id} failed: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return result
+
+    def release(self, session_id: str, on_alternate: Optional[AlternateHandler] = None) -> int:
+        """Cancel (or keep as alternates) the remaining branches of a session.
+
+        `on_alternate` is called with each finished branch; if it returns an
+        awaitable, that is run in the background.
+        """
+        released = 0
+        for key in [k for k in self._tasks if k[0] == session_id]:
+            task = self._tasks.pop(key)
+            released += 1
+            if self.keep_alternates and on_alternate is not None:
+                _, act_index, choice = key
+                task.add_done_callback(_alternate_callback(act_index, choice, on_alternate, self._keeping))
+            else:
+                task.cancel()
+        return released
+
+    def forget(self, session_id: str):
+        """Drop all prefetch state of a deleted session."""
+        self.release(session_id)
+        self._per_session.pop(session_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        pending = defaultdict(int)
+        for (session_id, _, _), task in self._tasks.items():
+            if not task.done():
+                pending[session_id] += 1
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "tracked": len(self._tasks),
+            "running": sum(pending.values()),
+            "sessions": len(self._per_session),
+        }
@@ -0,0 +1,351 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from common.shared import LocalSharedState, SharedState
+
+from story.context import StoryContextManager, DECISION_PREFIX
+from story.extraction import extract_act
+from story.graph import StoryGraph, StoryNode
+from story.memory import StoryMemory
+
+
+def next_stats(stats: Dict[str, Any], state) -> Dict[str, Any]:
+    """Player stats after an act whose parsed footer is `state` (None if missing)."""
+    if state is None:
+        return {**stats, "choices": [], "image_prompt": None}
+    # Same accumulation rules as the web client's StatusHUD
+    return {
+        "dharma": max(-100, min(100, stats.get("dharma", 0) + state.dharma)),
+        "karma": stats.get("karma", 0) + state.karma,
+        "inventory": list(state.inventory) if "inventory" in state.model_fields_set
+        else list(stats.get("inventory", [])),
+        "choices": list(state.choices),
+        "image_prompt": state.image_prompt,
+    }
+
+
+@dataclass
+class StorySession:
+    """Server-side state of one story: act history, RPG stats and pending choices."""
+    id: str
+    model: str
+    act_name: str
+    world_description: str
+    context: StoryContextManager
+    api_key: Optional[str] = field(default=None, repr=False)
+    acts: List[str] = field(default_factory=list)
+    decisions: List[str] = field(default_factory=list)
+    dharma: int = 0
+    karma: int = 0
+    inventory: List[str] = field(default_factory=list)
+    choices: List[str] = field(default_factory=list)
+    image_prompt: Optional[str] = None
+    alternates: List[Dict[str, Any]] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+    memory: Optional[StoryMemory] = field(default=None, repr=False)
+    # Every act ever generated, branches included; `path` is the current branch
+    graph: StoryGraph = field(default_factory=StoryGraph, repr=False)
+    path: List[str] = field(default_factory=list)
+    # Bumped on every save to the shared state; a worker holding an older
+    # version reloads the session before using it
+    version: int = 0
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+
+    def apply_act(self, text: str, choice: Optional[str] = None):
+        """Record a generated act and fold its JSON footer into the session state."""
+        narrative, state = extract_act(text)
+        stats = next_stats(self.stats(), state)
+        self._restore(stats)
+
+        node = self.graph.add(text, self.head, choice, self.act_name, stats)
+        self.path.append(node.id)
+        self._append(text, narrative, choice)
+        self.updated_at = time.time()
+        return node
+
+    @property
+    def head(self) -> Optional[str]:
+        return self.path[-1] if self.path else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"dharma": self.dharma, "karma": self.karma, "inventory": list(self.inventory),
+                "choices": list(self.choices), "image_prompt": self.image_prompt}
+
+    def _restore(self, stats: Dict[str, Any]):
+        self.dharma = stats.get("dharma", 0)
+        self.karma = stats.get("karma", 0)
+        self.inventory = list(stats.get("inventory", []))
+        self.choices = list(stats.get("choices", []))
+        self.image_prompt = stats.get("image_prompt")
+
+    def _append(self, text: str, narrative: str, choice: Optional[str]):
+        self.acts.append(text)
+        if choice:
+            self.decisions.append(choice)
+            self.context.add_act(f"{DECISION_PREFIX} {choice}\n\n{narrative}")
+        else:
+            self.context.add_act(narrative)
+        if self.memory is not None:
+            self.memory.add_act(narrative, choice)
+
+    def checkout(self, node_id: str, context: StoryContextManager,
+                 memory: Optional[StoryMemory] = None) -> StoryNode:
+        """Move the session to the branch ending at `node_id`.
+
+        Acts, context and memory are rebuilt from that path (O(depth)); stats
+        and pending choices come from the node's snapshot, so the next choice
+        forks a new branch from there.
+        """
+        node = self._replay(self.graph.path(node_id), context, memory)
+        self.updated_at = time.time()
+        return node
+
+    def _replay(self, path: List[StoryNode], context: StoryContextManager,
+                memory: Optional[StoryMemory]) -> Optional[StoryNode]:
+        self.acts, self.decisions, self.path = [], [], []
+        self.context, self.memory = context, memory
+        for node in path:
+            narrative, _ = extract_act(node.content)
+            self.path.append(node.id)
+            self._append(node.content, narrative, node.choice)
+        if not path:
+            return None
+        self._restore(path[-1].state)
+        return path[-1]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything needed to rebuild the session in another worker;
+        acts, context and memory are derived from the graph path. The API
+        key is left out: it never leaves this process."""
+        return {
+            "id": self.id, "model": self.model, "act_name": self.act_name,
+            "world_description": self.world_description,
+            "stats": self.stats(), "alternates": self.alternates,
+            "created_at": self.created_at, "updated_at": self.updated_at,
+            "version": self.version, "graph": self.graph.to_dict(), "path": self.path,
+        }
+
+    def load_snapshot(self, data: Dict[str, Any], context: StoryContextManager,
+                      memory: Optional[StoryMemory] = None):
+        """Replace this session's state in place (its local lock and API key stay)."""
+        self.model, self.act_name = data["model"], data["act_name"]
+        self.world_description = data["world_description"]
+        self.alternates = data.get("alternates", [])
+        self.created_at, self.updated_at = data["created_at"], data["updated_at"]
+        self.version = data["version"]
+        self.graph = StoryGraph.from_dict(data["graph"])
+        self._replay([self.graph.get(node_id) for node_id in data["path"]], context, memory)
+        self._restore(data["stats"])
+
+    def recall(self, choice: str, k: int = 4, token_budget: int = 600) -> List[str]:
+        """Passages from acts that have left the raw context window, relevant
+        to `choice` and to what the player is carrying."""
+        if self.memory is None:
+            return []
+        query = " ".join([choice, *self.inventory])
+        older = len(self.acts) - self.context.recent_acts
+        return self.memory.relevant(query, k, before_act=older, token_budget=token_budget)
+
+    def add_alternate(self, act_index: int, choice: str, story: str):
+        """Keep a prefetched branch the user did not pick, as a sibling in the graph."""
+        self.alternates.append({"act_index": act_index, "choice": choice, "story": story})
+        parent_id = self.path[act_index - 1] if 0 < act_index <= len(self.path) else None
+        if parent_id in self.graph and self.graph.find_child(parent_id, choice) is None:
+            stats = next_stats(self.graph.get(parent_id).state, extract_act(story)[1])
+            self.graph.add(story, parent_id, choice, self.act_name, stats)
+
+    def resolve_choice(self, choice: Optional[str], choice_index: Optional[int]) -> str:
+        if choice_index is not None:
+            if not 0 <= choice_index < len(self.choices):
+                raise ValueError(f"choice_index must be between 0 and {len(self.choices) - 1}")
+            return self.choices[choice_index]
+        if not choice:
+            raise ValueError("Either choice or choice_index is required")
+        return choice
+
+    def to_dict(self, include_acts: bool = True) -> Dict[str, Any]:
+        data = {
+            "id": self.id,
+            "model": self.model,
+            "act_name": self.act_name,
+            "act_count": len(self.acts),
+            "latest_act": self.acts[-1] if self.acts else None,
+            "decisions": self.decisions,
+            "dharma": self.dharma,
+            "karma": self.karma,
+            "inventory": self.inventory,
+            "choices": self.choices,
+            "image_prompt": self.image_prompt,
+            "head": self.head,
+            "graph_revision": self.graph.revision,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if include_acts:
+            data["acts"] = self.acts
+            data["alternates"] = self.alternates
+        return data
+
+
+class SessionStore:
+    """Session registry with idle expiry and LRU eviction.
+
+    Sessions are saved as snapshots in the shared state, so any worker can
+    serve any session: each worker keeps live objects as a local cache and
+    reloads one when the shared version moved on. Mutations go through
+    `locked`, which serialises a session across workers and saves it.
+
+    Request-supplied API keys stay in this worker's memory; another worker
+    serving the session falls back to the server's key. Async code uses
+    the `a*` methods, which keep shared-state I/O off the event loop.
+    """
+
+    def __init__(self, max_sessions: int = 1000, ttl: float = 6 * 3600,
+                 token_budget: int = 3000, recent_acts: int = 2,
+                 memory_factory: Optional[Callable[[], StoryMemory]] = None,
+                 shared: Optional[SharedState] = None):
+        self.shared = shared or LocalSharedState()
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.token_budget = token_budget
+        self.recent_acts = recent_acts
+        self.memory_factory = memory_factory
+        self._sessions: "OrderedDict[str, StorySession]" = OrderedDict()
+        # session id -> (API key, last used), pruned after `ttl` idle seconds
+        self._api_keys: Dict[str, Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def create(self, model: str, act_name: str, world_description: str,
+               api_key: Optional[str] = None) -> StorySession:
+        session = StorySession(
+            id=uuid.uuid4().hex,
+            model=model,
+            act_name=act_name,
+            world_description=world_description,
+            api_key=api_key,
+            context=self.new_context(),
+            memory=self.new_memory(),
+        )
+        self.save(session)
+        with self._lock:
+            if api_key:
+                self._api_keys[session.id] = (api_key, time.time())
+            self._sessions[session.id] = session
+            evicted = self._evict()
+        self._forget(evicted)
+        return session
+
+    async def acreate(self, model: str, act_name: str, world_description: str,
+                      api_key: Optional[str] = None) -> StorySession:
+        return await self.shared.arun(self.create, model, act_name, world_description, api_key)
+
+    async def aget(self, session_id: str) -> Optional[StorySession]:
+        return await self.shared.arun(self.get, session_id)
+
+    async def adelete(self, session_id: str) -> bool:
+        return await self.shared.arun(self.delete, session_id)
+
+    def save(self, session: StorySession):
+        session.version += 1
+        ttl = max(self.ttl - (time.time() - session.updated_at), 1.0)
+        self.shared.set(f"session:{session.id}", json.dumps(session.snapshot()), ttl=ttl)
+        self.shared.set(f"session-version:{session.id}", str(session.version), ttl=ttl)
+
+    def _load(self, session_id: str, session: Optional[StorySession] = None) -> Optional[StorySession]:
+        raw = self.shared.get(f"session:{session_id}")
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        if session is None:
+            with self._lock:
+                api_key = self._api_keys.get(session_id, (None,))[0]
+            session = StorySession(id=session_id, model=data["model"], act_name=data["act_name"],
+                                   world_description=data["world_description"], api_key=api_key,
+                                   context=self.new_context())
+        session.load_snapshot(data, self.new_context(), self.new_memory())
+        return session
+
+    @asynccontextmanager
+    async def locked(self, session: StorySession, timeout: Optional[float] = None) -> AsyncIterator[StorySession]:
+        """Exclusive access to `session` across all workers; saved on success.
+        On failure the local copy is marked stale so the next `get` reloads it."""
+        async with session.lock:
+            async with self.shared.lock(f"session:{session.id}", ttl=600, timeout=timeout):
+                await self.aget(session.id)  # catch up with saves from other workers
+                try:
+                    yield session
+                except BaseException:
+                    session.version = -1
+                    raise
+                await self.shared.arun(self.save, session)
+
+    def new_context(self) -> StoryContextManager:
+        return StoryContextManager(self.token_budget, self.recent_acts)
+
+    def new_memory(self) -> Optional[StoryMemory]:
+        return self.memory_factory() if self.memory_factory else None
+
+    def get(self, session_id: str) -> Optional[StorySession]:
+        version = self.shared.get(f"session-version:{session_id}")
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if version is None or (session is not None and self._expired(session)):
+                # Expired, or deleted by another worker
+                self._sessions.pop(session_id, None)
+                self._api_keys.pop(session_id, None)
+                return None
+            if session_id in self._api_keys:
+                self._api_keys[session_id] = (self._api_keys[session_id][0], time.time())
+            if session is not None and session.version == int(version):
+                self._sessions.move_to_end(session_id)
+                return session
+        session = self._load(session_id, session)
+        if session is not None:
+            with self._lock:
+                self._sessions[session_id] = session
+                evicted = self._evict()
+            self._forget(evicted)
+        return session
+
+    def delete(self, session_id: str) -> bool:
+        existed = self.shared.delete(f"session-version:{session_id}")
+        self.shared.delete(f"session:{session_id}")
+        with self._lock:
+            self._api_keys.pop(session_id, None)
+            return self._sessions.pop(session_id, None) is not None or existed
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._sessions)
+
+    def _expired(self, session: StorySession) -> bool:
+        return time.time() - session.updated_at > self.ttl
+
+    def _evict(self) -> List[str]:
+        """Drop expired and least recently used sessions; returns their ids."""
+        evicted = [sid for sid, s in self._sessions.items() if self._expired(s)]
+        for session_id in evicted:
+            del self._sessions[session_id]
+        now = time.time()
+        for session_id in [sid for sid, (_, used) in self._api_keys.items() if now - used > self.ttl]:
+            del self._api_keys[session_id]
+        while len(self._sessions) > self.max_sessions:
+            evicted.append(self._sessions.popitem(last=False)[0])
+        return evicted
+
+    def _forget(self, session_ids: List[str]):
+        # With the in-process shared state this store is the only holder of a
+        # session, so eviction ends it, as max_sessions promises. A remote
+        # store keeps it for the other workers (and its own TTL)
+        if self.shared.remote:
+            return
+        for session_id in session_ids:
+            self.delete(session_id)
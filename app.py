@@ -1,12 +1,8 @@
 import streamlit as st
 import os
 from config import settings
-from story.spec import build_act_specification
-from prompts import build_prompt
-from llm.factory import get_llm
-from common.constants import LLMStrategyType
-from common.state import StateManager
-from story.exporter import StoryExporter
+# The generation pipeline is imported when a story is requested, so the
+# page renders before those modules load
 
 # Page Config
 st.set_page_config(
@@ -19,12 +15,17 @@ st.set_page_config(
 st.sidebar.title("Configuration")
 
 api_key = st.sidebar.text_input("OpenRouter API Key", value=os.getenv("OPENROUTER_API_KEY", ""), type="password", help="Enter your OpenRouter API Key to generate stories.")
-if api_key:
-    os.environ["OPENROUTER_API_KEY"] = api_key
+
+# Free models from the cached catalog (the built-in defaults until the
+# first fetch); the refresh thread survives Streamlit reruns
+from llm.catalog import get_catalog
+catalog = get_catalog()
+if settings.model_catalog_refresh > 0:
+    catalog.start(settings.model_catalog_refresh)
 
 model_name = st.sidebar.selectbox(
     "Select Model",
-    ["meta-llama/llama-3.2-3b-instruct:free", "mistralai/mistral-7b-instruct:free", "google/gemini-2.0-flash-exp:free"],
+    catalog.ids(free=True),
     index=0
 )
 
@@ -37,37 +38,71 @@ act_name = st.sidebar.text_input("Act Name", value="Ethics in World of intellige
 st.title("🤖 Narrative Generation System")
 st.markdown("Generate sci-fi stories set in a world governed by AI.")
 
+def show_story(output: str):
+    st.subheader(act_name.upper())
+    st.write(output)
+    st.success(f"Story generated and saved!")
+    
+    # Download Button
+    st.download_button(
+        label="Download Markdown",
+        data=output,
+        file_name=f"{act_name.replace(' ', '_').lower()}.md",
+        mime="text/markdown"
+    )
+
+def follow_job(job_id: str):
+    # Polls the API job; a rerun (or a reconnect) resumes it from its id instead of regenerating
+    from api.client import JobClient
+    placeholder = st.empty()
+    streamed = []
+
+    def on_text(text):
+        streamed.append(text)
+        placeholder.markdown("".join(streamed))
+
+    try:
+        with st.spinner("Generating narrative... (this may take a minute)"):
+            result = JobClient(settings.api_url).wait(job_id, on_text=on_text)
+    except Exception as e:
+        st.session_state.pop("job_id", None)
+        st.error(f"An error occurred: {str(e)}")
+        return
+    placeholder.empty()
+    show_story(result["story"])
+
 if st.button("Generate Story", type="primary"):
     if not api_key:
         st.error("Please enter an OpenRouter API Key in the sidebar.")
+    elif settings.api_url:
+        from api.client import JobClient
+        try:
+            st.session_state["job_id"] = JobClient(settings.api_url).submit("generate", {
+                "api_key": api_key, "model": model_name,
+                "act_name": act_name, "world_description": world_desc,
+            })
+        except Exception as e:
+            st.error(f"An error occurred: {str(e)}")
     else:
         with st.spinner("Generating narrative... (this may take a minute)"):
             try:
-                # Update settings temporarily (in a real app, we'd use a better config injection)
-                settings.world.description = world_desc
-                
-                # Update provider model
-                # We need to hack the provider a bit since get_llm initializes with env var
-                # For now, we assume the user set the key in session state or env
-                
-                spec = build_act_specification(
-                    settings.characters,
-                    settings.world,
-                    act_name=act_name
-                )
+                from story.spec import act_for, default_world_spec
+                from prompts import build_prompt
+                from llm.provider import OpenRouterLLM
+                from common.state import StateManager
+                from story.exporter import StoryExporter
+
+                # Sidebar edits make a new world spec; the shared settings stay untouched
+                spec = act_for(default_world_spec(world_desc), act_name)
                 
                 prompts = build_prompt()
                 context = prompts.handle({"spec": spec})
                 
                 # Initialize LLM with selected model
-                from llm.provider import OpenRouterLLM
-                llm = OpenRouterLLM(model=model_name)
+                llm = OpenRouterLLM(model=model_name, api_key=api_key)
                 
                 output = llm.generate(context["final_prompt"])
                 
-                st.subheader(act_name.upper())
-                st.write(output)
-                
                 # Save & Export
                 state_manager = StateManager()
                 state_manager.save_state(spec.name, output)
@@ -75,19 +110,14 @@ if st.button("Generate Story", type="primary"):
                 exporter = StoryExporter()
                 path = exporter.export_to_markdown(spec.name, output)
                 
-                st.success(f"Story generated and saved!")
-                
-                # Download Button
-                st.download_button(
-                    label="Download Markdown",
-                    data=output,
-                    file_name=f"{act_name.replace(' ', '_').lower()}.md",
-                    mime="text/markdown"
-                )
+                show_story(output)
                 
             except Exception as e:
                 st.error(f"An error occurred: {str(e)}")
 
+if settings.api_url and st.session_state.get("job_id"):
+    follow_job(st.session_state["job_id"])
+
 # Footer
 st.markdown("---")
 st.markdown("Powered by OpenRouter & Streamlit")
@@ -0,0 +1,61 @@
+"""Compare two benchmark result files and flag regressions.
+
+    python benchmarks/compare.py benchmarks/results/<old>.json benchmarks/results/<new>.json
+
+Exits non-zero when any matching scenario's p99 grows, or its throughput
+drops, by more than `--threshold` (default 20%).
+"""
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+
+def load(path: str) -> Dict[Tuple[str, int], Dict[str, Any]]:
+    with open(path) as f:
+        report = json.load(f)
+    return {(row["scenario"], row["concurrency"]): row for row in report["results"]}
+
+
+def change(old: Optional[float], new: Optional[float]) -> Optional[float]:
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def compare(old: Dict, new: Dict, threshold: float) -> Tuple[List[str], List[str]]:
+    lines, regressions = [], []
+    for key in sorted(set(old) & set(new)):
+        before, after = old[key], new[key]
+        p99 = change(before["p99"], after["p99"])
+        throughput = change(before["throughput"], after["throughput"])
+        label = f"{key[0]} c={key[1]}"
+        lines.append(f"{label:<24} throughput {fmt(throughput):>8}   p99 {fmt(p99):>8}")
+        if p99 is not None and p99 > threshold:
+            regressions.append(f"{label}: p99 {before['p99']:.3f}s -> {after['p99']:.3f}s")
+        if throughput is not None and throughput < -threshold:
+            regressions.append(f"{label}: throughput {before['throughput']} -> {after['throughput']} req/s")
+    return lines, regressions
+
+
+def fmt(value: Optional[float]) -> str:
+    return "n/a" if value is None else f"{value:+.1%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    lines, regressions = compare(load(args.old), load(args.new), args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print("\nRegressions:")
+        print("\n".join(f"  {r}" for r in regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
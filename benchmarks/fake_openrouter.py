@@ -0,0 +1,224 @@
+"""Local stand-in for the OpenRouter chat completions API.
+
+Serves `/api/v1/chat/completions` (plain and `stream: true`) and
+`/api/v1/models` with configurable latency, streaming speed, 429 bursts and
+malformed JSON footers, so the generation pipeline can be load-tested
+without network access or API spend.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+ACT_TEXT = (
+    "The war-drones of the Kaurava Syndicate circled Hastinapura Prime as Krishna-AI "
+    "weighed the cost of every possible future. Arjuna-Logic hesitated at the gate, "
+    "his targeting array locked on kin. "
+) * 8
+
+# The model list never changes, so clients revalidating with it get a 304
+MODELS_ETAG = '"fake-models-1"'
+
+FOOTER = {
+    "image_prompt": "A neon battlefield at dusk, drones over a chrome citadel",
+    "dharma": 10,
+    "karma": 5,
+    "inventory": ["Data-Astra", "Royal Signet"],
+    "choices": [
+        "Choice 1: Arjuna lowers his bow.",
+        "Choice 2: Arjuna asks Krishna-AI for counsel.",
+        "Choice 3: Arjuna storms the gate.",
+    ],
+}
+
+DEBATE = {
+    "debate": [
+        {"speaker": "Krishna-AI", "content": "Balance demands restraint."},
+        {"speaker": "Duryodhana-Net", "content": "Efficiency demands conquest."},
+        {"speaker": "Arjuna-Logic", "content": "Duty demands we choose carefully."},
+    ],
+    "consensus": "The council advises restraint.",
+}
+
+
+@dataclass
+class FakeConfig:
+    latency_median: float = 0.05     # seconds before the first byte
+    latency_sigma: float = 0.5       # lognormal spread of that latency
+    tokens_per_second: float = 400.0 # streaming speed
+    rate_limit_every: int = 0        # every Nth request starts a 429 burst (0 = never)
+    rate_limit_burst: int = 3        # length of each burst
+    retry_after: float = 1.0
+    malformed_rate: float = 0.0      # probability of a broken JSON footer
+    seed: Optional[int] = 1234
+
+
+def build_completion(prompt: str, rng: random.Random, config: FakeConfig) -> str:
+    if "Cyber-Consensus" in prompt:  # the council's closing summary
+        return DEBATE["consensus"]
+    if "**Debate so far:**" in prompt:  # one council member's turn
+        for step in DEBATE["debate"]:
+            if prompt.lstrip().startswith(f"You are {step['speaker']},"):
+                return step["content"]
+        return DEBATE["debate"][0]["content"]
+    footer = json.dumps(FOOTER, indent=2)
+    if rng.random() < config.malformed_rate:
+        footer = footer.replace('"choices"', "choices", 1)  # invalid JSON
+    return f"{ACT_TEXT}\n\n```json\n{footer}\n```"
+
+
+class FakeOpenRouter:
+    """Threaded HTTP stub; use as a context manager or call start()/stop()."""
+
+    def __init__(self, config: Optional[FakeConfig] = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeConfig()
+        self.rng = random.Random(self.config.seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rate_limited = 0
+        self._burst_left = 0
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def start(self) -> "FakeOpenRouter":
+        self._thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _admit(self) -> bool:
+        """Count the request and decide whether it falls in a 429 burst."""
+        with self.lock:
+            self.requests += 1
+            every = self.config.rate_limit_every
+            if every and self.requests % every == 0:
+                self._burst_left = self.config.rate_limit_burst
+            if self._burst_left > 0:
+                self._burst_left -= 1
+                self.rate_limited += 1
+                return False
+            return True
+
+    def _latency(self) -> float:
+        with self.lock:
+            return self.config.latency_median * self.rng.lognormvariate(0, self.config.latency_sigma)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status: int, payload, headers=None):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    if self.headers.get("If-None-Match") == MODELS_ETAG:
+                        self.send_response(304)
+                        self.send_header("ETag", MODELS_ETAG)
+                        self.end_headers()
+                        return
+                    self._json(200, {"data": [
+                        {"id": "fake/fast:free", "context_length": 8192, "pricing": {"prompt": "0", "completion": "0"},
+                         "supported_parameters": ["response_format"]},
+                        {"id": "fake/slow", "context_length": 32768, "pricing": {"prompt": "0.000001", "completion": "0.000002"}},
+                    ]}, {"ETag": MODELS_ETAG})
+                else:
+                    self._json(404, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.endswith("/chat/completions"):
+                    self._json(404, {"error": "not found"})
+                    return
+                if not stub._admit():
+                    self._json(429, {"error": "rate limited"},
+                               {"Retry-After": str(stub.config.retry_after)})
+                    return
+
+                time.sleep(stub._latency())
+                prompt = request["messages"][-1]["content"]
+                with stub.lock:
+                    text = build_completion(prompt, stub.rng, stub.config)
+                if request.get("stream"):
+                    self._stream(request["model"], text)
+                else:
+                    self._json(200, {
+                        "model": request["model"],
+                        "choices": [{"message": {"role": "assistant", "content": text}}],
+                        "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(text) // 4},
+                    })
+
+            def _stream(self, model: str, text: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                words = text.split(" ")
+                delay = 1 / stub.config.tokens_per_second if stub.config.tokens_per_second else 0
+                self.wfile.write(b": OPENROUTER PROCESSING\n\n")
+                for i, word in enumerate(words):
+                    delta = word if i == len(words) - 1 else word + " "
+                    chunk = {"model": model, "choices": [{"delta": {"content": delta}}]}
+                    self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                    self.wfile.flush()
+                    if delay:
+                        time.sleep(delay)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the fake OpenRouter server")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=FakeConfig.latency_median)
+    parser.add_argument("--rate-limit-every", type=int, default=0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    args = parser.parse_args()
+    config = FakeConfig(latency_median=args.latency, rate_limit_every=args.rate_limit_every,
+                        malformed_rate=args.malformed_rate)
+    with FakeOpenRouter(config, port=args.port) as stub:
+        print(f"Fake OpenRouter listening on {stub.base_url}")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
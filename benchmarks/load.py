@@ -0,0 +1,260 @@
+"""Load scenarios for the generation pipeline against the fake OpenRouter server.
+
+Drives `/generate` and `/council/debate` in-process (httpx over ASGI) and
+`run.py batch` as a subprocess at increasing concurrency, then writes
+throughput, p50/p99 latency and peak memory to
+`benchmarks/results/<git-sha>.json`.
+
+    python benchmarks/load.py                 # full run
+    python benchmarks/load.py --quick         # small smoke run
+    python benchmarks/compare.py A.json B.json
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_openrouter import FakeConfig, FakeOpenRouter
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+API_KEY = "bench-key"
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def summarize(name: str, concurrency: int, latencies: List[float], errors: Dict[str, int],
+              elapsed: float, peak_kb: float, mem_source: str) -> Dict[str, Any]:
+    return {
+        "scenario": name,
+        "concurrency": concurrency,
+        "requests": len(latencies) + sum(errors.values()),
+        "ok": len(latencies),
+        "errors": errors,
+        "elapsed": round(elapsed, 4),
+        "throughput": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "p50": percentile(latencies, 50),
+        "p99": percentile(latencies, 99),
+        "peak_mem_kb": round(peak_kb, 1),
+        "mem_source": mem_source,
+    }
+
+
+def git_sha() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def reset_pipeline(base_url: str):
+    """Point the app at `base_url` with fresh router/scheduler state per scenario."""
+    import image.factory
+    import llm.factory
+    import llm.router
+    import llm.scheduler
+    from config import settings
+
+    os.environ["OPENROUTER_API_KEY"] = API_KEY
+    settings.openrouter_base_url = base_url
+    settings.image_provider = "stub"  # illustrations stay local
+    image.factory.reset_image_queue()
+    llm.factory._shared_llms.clear()
+    llm.router._router = None
+    # Upstream throttling is what we measure, not the local token bucket
+    llm.scheduler._scheduler = llm.scheduler.RequestScheduler(
+        max_concurrency=settings.scheduler_max_concurrency, max_queue=10_000, rate=1e6, burst=1e6)
+
+
+def generate_payload(i: int) -> Dict[str, Any]:
+    return {"model": "fake/fast:free", "act_name": f"Act {i}",
+            "world_description": "Kurukshetra 3000, under benchmark."}
+
+
+def council_payload(i: int) -> Dict[str, Any]:
+    return {"world_context": "The Kaurava Syndicate masses at the border.",
+            "topic": f"Should Arjuna strike first? (#{i})"}
+
+
+async def _drive(path: str, payload: Callable[[int], Dict[str, Any]], concurrency: int, requests: int):
+    import httpx
+    from api.main import app
+    from llm.http import close_async_client
+
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    queue: "asyncio.Queue[int]" = asyncio.Queue()
+    for i in range(requests):
+        queue.put_nowait(i)
+
+    async def worker(client: "httpx.AsyncClient"):
+        while not queue.empty():
+            i = queue.get_nowait()
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=payload(i))
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            if status == "200":
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        await client.post(path, json=payload(-1))  # warm-up, not measured
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    await close_async_client()
+    return latencies, errors, elapsed
+
+
+def run_http_scenario(name: str, path: str, payload: Callable[[int], Dict[str, Any]],
+                      base_url: str, concurrency: int, requests: int) -> Dict[str, Any]:
+    import api.main  # noqa: F401 -- import outside the traced window
+    reset_pipeline(base_url)
+    tracemalloc.start()
+    try:
+        latencies, errors, elapsed = asyncio.run(_drive(path, payload, concurrency, requests))
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return summarize(name, concurrency, latencies, errors, elapsed, peak / 1024, "tracemalloc")
+
+
+def run_batch_scenario(base_url: str, concurrency: int, requests: int, workdir: str) -> Dict[str, Any]:
+    """Run `run.py batch` in a subprocess; latencies come from its results file."""
+    manifest = os.path.join(workdir, f"batch-{concurrency}.jsonl")
+    output = f"{manifest}.results.jsonl"
+    with open(manifest, "w") as f:
+        for i in range(requests):
+            f.write(json.dumps({"act_name": f"Act {i}", "model": "fake/fast:free"}) + "\n")
+    for stale in (output, f"{manifest}.checkpoint"):
+        if os.path.exists(stale):
+            os.remove(stale)
+
+    env = dict(os.environ, OPENROUTER_BASE_URL=base_url, OPENROUTER_API_KEY=API_KEY)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "run.py"), "batch", manifest, "--concurrency", str(concurrency)],
+        cwd=workdir, env=env, capture_output=True, text=True,
+    )
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    if os.path.exists(output):
+        with open(output) as f:
+            latencies = [json.loads(line)["latency"] for line in f if line.strip()]
+    errors = {}
+    failed = requests - len(latencies)
+    if failed:
+        errors["failed" if proc.returncode == 0 else f"exit {proc.returncode}"] = failed
+    # ru_maxrss is the largest child so far, in KB on Linux
+    peak_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return summarize("run.py batch", concurrency, latencies, errors, elapsed, peak_kb, "ru_maxrss")
+
+
+def run_suite(levels: List[int], requests_per_worker: int, config: FakeConfig,
+              scenarios: Optional[List[str]] = None, verbose: bool = False) -> Dict[str, Any]:
+    scenarios = scenarios or ["generate", "council", "batch"]
+    results = []
+    with FakeOpenRouter(config) as stub, tempfile.TemporaryDirectory() as workdir:
+        cwd = os.getcwd()
+        os.chdir(workdir)  # /generate saves story state in the working directory
+        try:
+            for concurrency in levels:
+                requests = concurrency * requests_per_worker
+                # Providers print every retry; keep the report readable
+                quiet = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+                with quiet:
+                    if "generate" in scenarios:
+                        results.append(run_http_scenario("/generate", "/generate", generate_payload,
+                                                         stub.base_url, concurrency, requests))
+                    if "council" in scenarios:
+                        results.append(run_http_scenario("/council/debate", "/council/debate", council_payload,
+                                                         stub.base_url, concurrency, requests))
+                    if "batch" in scenarios:
+                        results.append(run_batch_scenario(stub.base_url, concurrency, requests, workdir))
+                for row in results[-len(scenarios):]:
+                    print(format_row(row))
+        finally:
+            os.chdir(cwd)
+        upstream = {"requests": stub.requests, "rate_limited": stub.rate_limited}
+
+    return {
+        "commit": git_sha(),
+        "timestamp": time.time(),
+        "python": sys.version.split()[0],
+        "fake_server": vars(config),
+        "upstream": upstream,
+        "results": results,
+    }
+
+
+def format_row(row: Dict[str, Any]) -> str:
+    p50 = f"{row['p50'] * 1000:.0f}ms" if row["p50"] is not None else "-"
+    p99 = f"{row['p99'] * 1000:.0f}ms" if row["p99"] is not None else "-"
+    return (f"{row['scenario']:<16} c={row['concurrency']:<3} ok={row['ok']:<4} "
+            f"err={sum(row['errors'].values()):<3} {row['throughput']:>8.2f} req/s "
+            f"p50={p50:>7} p99={p99:>7} mem={row['peak_mem_kb'] / 1024:.1f}MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the generation pipeline against a fake OpenRouter")
+    parser.add_argument("--levels", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests-per-worker", type=int, default=4)
+    parser.add_argument("--scenarios", default="generate,council,batch")
+    parser.add_argument("--latency", type=float, default=FakeConfig.latency_median, help="Median upstream latency (s)")
+    parser.add_argument("--tokens-per-second", type=float, default=FakeConfig.tokens_per_second)
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Start a 429 burst every N upstream requests")
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=FakeConfig.seed)
+    parser.add_argument("--quick", action="store_true", help="Tiny run for smoke testing")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/<git-sha>.json)")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+    if not args.verbose:
+        from loguru import logger
+        logger.remove()
+        logger.add(sys.stderr, level="WARNING")
+
+    levels = [1, 2] if args.quick else [int(x) for x in args.levels.split(",")]
+    config = FakeConfig(
+        latency_median=0.01 if args.quick else args.latency,
+        tokens_per_second=args.tokens_per_second,
+        rate_limit_every=args.rate_limit_every,
+        malformed_rate=args.malformed_rate,
+        seed=args.seed,
+    )
+    report = run_suite(levels, 2 if args.quick else args.requests_per_worker, config,
+                       args.scenarios.split(","), args.verbose)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"{report['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
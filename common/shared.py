@@ -0,0 +1,529 @@
+import asyncio
+import heapq
+import queue
+import select
+import socket
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from loguru import logger
+
+
+class SharedStateError(Exception):
+    """The shared state backend failed or rejected a command."""
+
+
+class Subscription(ABC):
+    @abstractmethod
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Next message on the channel, or None after `timeout` seconds."""
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SharedLock:
+    """Named lock shared by every worker using the same state backend.
+
+    The lock expires after `ttl` seconds so a crashed holder cannot wedge
+    other workers. Usable with `with` (blocking) and `async with` (polls
+    without blocking the event loop).
+    """
+
+    def __init__(self, state: "SharedState", name: str, ttl: float = 60.0,
+                 timeout: Optional[float] = None, poll: float = 0.02):
+        self.state = state
+        self.key = f"lock:{name}"
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll = poll
+        self.token = uuid.uuid4().hex
+
+    def try_acquire(self) -> bool:
+        return self.state.set(self.key, self.token, ttl=self.ttl, nx=True)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self.try_acquire():
+            if not blocking or (deadline is not None and time.monotonic() >= deadline):
+                return False
+            time.sleep(self.poll)
+        return True
+
+    def release(self):
+        # Only delete our own lock: it may have expired and been taken since
+        self.state.delete_if(self.key, self.token)
+
+    def __enter__(self):
+        if not self.acquire():
+            raise TimeoutError(f"Timed out waiting for {self.key}")
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not await self.state.arun(self.try_acquire):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for {self.key}")
+            await asyncio.sleep(self.poll)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.state.arun(self.release)
+
+
+class SharedState(ABC):
+    """State shared by every API worker: string KV with expiry, lists,
+    pub/sub channels and locks.
+
+    `LocalSharedState` keeps it in this process (one worker, tests);
+    `RedisSharedState` speaks the Redis protocol so several workers or
+    containers can share one server.
+    """
+
+    # Whether calls do network I/O; async callers then run them in a thread
+    remote = False
+
+    async def arun(self, fn, *args):
+        """Call `fn(*args)` from async code without blocking the event loop on network I/O."""
+        if self.remote:
+            return await asyncio.to_thread(fn, *args)
+        return fn(*args)
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        """Store `value`; with `nx` only if the key is absent. Returns whether it was set."""
+
+    @abstractmethod
+    def delete(self, key: str) -> bool:
+        pass
+
+    @abstractmethod
+    def delete_if(self, key: str, value: str) -> bool:
+        """Atomically delete `key` only while it still holds `value`."""
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        pass
+
+    @abstractmethod
+    def rpush(self, key: str, *values: str) -> int:
+        """Append to a list; returns its new length."""
+
+    @abstractmethod
+    def lrange(self, key: str, start: int, stop: int) -> List[str]:
+        """Items `start`..`stop` inclusive (negative indexes count from the end)."""
+
+    @abstractmethod
+    def llen(self, key: str) -> int:
+        pass
+
+    @abstractmethod
+    def publish(self, channel: str, message: str) -> int:
+        """Send to current subscribers; returns how many received it."""
+
+    @abstractmethod
+    def subscribe(self, channel: str) -> Subscription:
+        pass
+
+    def lock(self, name: str, ttl: float = 60.0, timeout: Optional[float] = None) -> SharedLock:
+        return SharedLock(self, name, ttl, timeout)
+
+    def close(self):
+        pass
+
+
+class _LocalSubscription(Subscription):
+    def __init__(self, state: "LocalSharedState", channel: str):
+        self.state = state
+        self.channel = channel
+        self.queue: "queue.Queue[str]" = queue.Queue()
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.state._unsubscribe(self)
+
+
+class LocalSharedState(SharedState):
+    """In-process backend: dicts behind one lock, expiring keys lazily."""
+
+    def __init__(self):
+        self._data: Dict[str, Any] = {}
+        self._expires: Dict[str, float] = {}
+        self._expiry_heap: List[Tuple[float, str]] = []
+        self._subscribers: Dict[str, List[_LocalSubscription]] = {}
+        self._lock = threading.Lock()
+
+    def _purge(self):
+        now = time.time()
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            deadline, key = heapq.heappop(self._expiry_heap)
+            if self._expires.get(key) == deadline:
+                del self._expires[key]
+                self._data.pop(key, None)
+
+    def _put(self, key: str, value: Any, ttl: Optional[float]):
+        self._data[key] = value
+        if ttl is None:
+            self._expires.pop(key, None)
+        else:
+            deadline = time.time() + ttl
+            self._expires[key] = deadline
+            heapq.heappush(self._expiry_heap, (deadline, key))
+
+    def _typed(self, key: str, kind: type):
+        value = self._data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise SharedStateError(f"WRONGTYPE {key} holds a {type(value).__name__}")
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._purge()
+            return self._typed(key, str)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        with self._lock:
+            self._purge()
+            if nx and key in self._data:
+                return False
+            self._put(key, value, ttl)
+            return True
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            self._purge()
+            self._expires.pop(key, None)
+            return self._data.pop(key, None) is not None
+
+    def delete_if(self, key: str, value: str) -> bool:
+        with self._lock:
+            self._purge()
+            if self._data.get(key) != value:
+                return False
+            self._expires.pop(key, None)
+            del self._data[key]
+            return True
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            self._purge()
+            value = int(self._typed(key, str) or 0) + amount
+            self._data[key] = str(value)
+            return value
+
+    def rpush(self, key: str, *values: str) -> int:
+        with self._lock:
+            self._purge()
+            items = self._typed(key, list)
+            if items is None:
+                items = self._data[key] = []
+            items.extend(values)
+            return len(items)
+
+    def lrange(self, key: str, start: int, stop: int) -> List[str]:
+        with self._lock:
+            self._purge()
+            items = self._typed(key, list) or []
+            size = len(items)
+            start = max(start + size if start < 0 else start, 0)
+            stop = stop + size if stop < 0 else min(stop, size - 1)
+            return list(items[start:stop + 1])
+
+    def llen(self, key: str) -> int:
+        with self._lock:
+            self._purge()
+            return len(self._typed(key, list) or [])
+
+    def publish(self, channel: str, message: str) -> int:
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for subscription in subscribers:
+            subscription.queue.put(message)
+        return len(subscribers)
+
+    def subscribe(self, channel: str) -> Subscription:
+        subscription = _LocalSubscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(subscription)
+        return subscription
+
+    def _unsubscribe(self, subscription: _LocalSubscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel, [])
+            if subscription in subscribers:
+                subscribers.remove(subscription)
+
+
+def encode_command(*args: Any) -> bytes:
+    parts = [f"*{len(args)}\r\n".encode()]
+    for arg in args:
+        data = arg if isinstance(arg, bytes) else str(arg).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+def read_reply(reader) -> Any:
+    """Parse one RESP2 reply from a buffered binary file."""
+    line = reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed by server")
+    kind, body = line[:1], line[1:-2]
+    if kind == b"+":
+        return body.decode()
+    if kind == b"-":
+        raise SharedStateError(body.decode())
+    if kind == b":":
+        return int(body)
+    if kind == b"$":
+        length = int(body)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        return data[:-2].decode()
+    if kind == b"*":
+        length = int(body)
+        return None if length < 0 else [read_reply(reader) for _ in range(length)]
+    raise SharedStateError(f"Unexpected reply: {line!r}")
+
+
+class _SocketReader:
+    """Buffered reads from a socket. Unlike `socket.makefile`, a timeout
+    does not leave it unusable, and `buffered` tells whether a reply can
+    be parsed without waiting on the socket."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.buffer = bytearray()
+
+    @property
+    def buffered(self) -> bool:
+        return bool(self.buffer)
+
+    def _fill(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError("Connection closed by server")
+        self.buffer += data
+
+    def readline(self) -> bytes:
+        while (end := self.buffer.find(b"\n")) == -1:
+            self._fill()
+        line = bytes(self.buffer[:end + 1])
+        del self.buffer[:end + 1]
+        return line
+
+    def read(self, size: int) -> bytes:
+        while len(self.buffer) < size:
+            self._fill()
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+
+class _Connection:
+    def __init__(self, host: str, port: int, timeout: float):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = _SocketReader(self.sock)
+
+    def readable(self, timeout: Optional[float]) -> bool:
+        if self.reader.buffered:
+            return True
+        return bool(select.select([self.sock], [], [], timeout)[0])
+
+    def stale(self) -> bool:
+        # An idle connection with something to read was closed (or is out of step)
+        try:
+            return self.readable(0)
+        except (OSError, ValueError):
+            return True
+
+    def send(self, *args: Any):
+        self.sock.sendall(encode_command(*args))
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class _RedisSubscription(Subscription):
+    def __init__(self, state: "RedisSharedState", channel: str):
+        self.conn = state._connect()
+        self.conn.send("SUBSCRIBE", channel)
+        read_reply(self.conn.reader)  # ["subscribe", channel, 1]
+
+    def get(self, timeout: Optional[float] = None) -> Optional[str]:
+        # Wait for data with select: a read that times out mid-reply would lose our place
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            if not self.conn.readable(remaining):
+                return None
+            reply = read_reply(self.conn.reader)
+            if isinstance(reply, list) and reply and reply[0] == "message":
+                return reply[2]
+
+    def close(self):
+        self.conn.close()
+
+
+# Compare-and-delete in one step, so a lock that expired and was taken
+# by another worker is never released by its previous holder
+DELETE_IF_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) else return 0 end"
+)
+
+
+class RedisSharedState(SharedState):
+    """Redis protocol (RESP2) client: one connection per thread, reconnecting
+    on a dropped connection. No dependency beyond the standard library."""
+
+    remote = True
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, timeout: float = 5.0):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def from_url(cls, url: str) -> "RedisSharedState":
+        parsed = urlparse(url)
+        db = int(parsed.path.lstrip("/") or 0)
+        return cls(parsed.hostname or "localhost", parsed.port or 6379, db, parsed.password)
+
+    def _connect(self) -> _Connection:
+        conn = _Connection(self.host, self.port, self.timeout)
+        if self.password:
+            conn.send("AUTH", self.password)
+            read_reply(conn.reader)
+        if self.db:
+            conn.send("SELECT", self.db)
+            read_reply(conn.reader)
+        return conn
+
+    def _drop(self, conn: Optional[_Connection]):
+        if conn is not None:
+            conn.close()
+        self._local.conn = None
+
+    def execute(self, *args: Any) -> Any:
+        """Send one command and read its reply.
+
+        Only connecting and sending are retried (once): after the command
+        is written the server may have applied it, and INCRBY or RPUSH must
+        not run twice, so a failed read is raised instead.
+        """
+        for attempt in range(2):
+            conn = getattr(self._local, "conn", None)
+            try:
+                if conn is not None and conn.stale():
+                    self._drop(conn)
+                    conn = None
+                if conn is None:
+                    conn = self._local.conn = self._connect()
+                conn.send(*args)
+                break
+            except (ConnectionError, OSError) as e:
+                self._drop(conn)
+                if attempt:
+                    raise SharedStateError(f"Shared state unavailable at {self.host}:{self.port}: {e}") from e
+        try:
+            return read_reply(conn.reader)
+        except (ConnectionError, OSError) as e:
+            self._drop(conn)
+            raise SharedStateError(f"Shared state at {self.host}:{self.port} failed mid-command: {e}") from e
+
+    def get(self, key: str) -> Optional[str]:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: str, ttl: Optional[float] = None, nx: bool = False) -> bool:
+        args = ["SET", key, value]
+        if ttl is not None:
+            args += ["PX", max(int(ttl * 1000), 1)]
+        if nx:
+            args.append("NX")
+        return self.execute(*args) == "OK"
+
+    def delete(self, key: str) -> bool:
+        return self.execute("DEL", key) > 0
+
+    def delete_if(self, key: str, value: str) -> bool:
+        return self.execute("EVAL", DELETE_IF_SCRIPT, 1, key, value) > 0
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return self.execute("INCRBY", key, amount)
+
+    def rpush(self, key: str, *values: str) -> int:
+        return self.execute("RPUSH", key, *values)
+
+    def lrange(self, key: str, start: int, stop: int) -> List[str]:
+        return self.execute("LRANGE", key, start, stop)
+
+    def llen(self, key: str) -> int:
+        return self.execute("LLEN", key)
+
+    def publish(self, channel: str, message: str) -> int:
+        return self.execute("PUBLISH", channel, message)
+
+    def subscribe(self, channel: str) -> Subscription:
+        return _RedisSubscription(self, channel)
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def create_shared_state(url: Optional[str] = None) -> SharedState:
+    """`redis://[:password@]host:port/db` for a shared server, unset for in-process."""
+    if not url or url.startswith("memory://"):
+        return LocalSharedState()
+    if url.startswith("redis://"):
+        return RedisSharedState.from_url(url)
+    raise ValueError(f"Unsupported shared state URL: {url}")
+
+
+_shared: Optional[SharedState] = None
+_shared_lock = threading.Lock()
+
+
+def get_shared_state() -> SharedState:
+    """Process-wide shared state configured from settings."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            from config import settings
+            _shared = create_shared_state(settings.shared_state_url)
+            if settings.shared_state_url:
+                logger.info(f"Using shared state at {settings.shared_state_url.split('@')[-1]}")
+        return _shared
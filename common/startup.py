@@ -0,0 +1,51 @@
+import builtins
+import sys
+import time
+from typing import Dict, List, Tuple
+
+
+class ImportProfiler:
+    """Times first imports while active (like `python -X importtime`, but
+    switchable at runtime): cumulative time per module and the part spent
+    in the module itself rather than in the imports it triggered."""
+
+    def __init__(self):
+        self.timings: Dict[str, Tuple[float, float]] = {}  # module -> (self, cumulative)
+        self.order: List[str] = []
+        self._stack: List[float] = []
+        self._original = builtins.__import__
+        self.started = self.finished = 0.0
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if name not in self.timings:
+                self.order.append(name)
+                self.timings[name] = (elapsed - children, elapsed)
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        builtins.__import__ = self._import
+        return self
+
+    def __exit__(self, *exc):
+        builtins.__import__ = self._original
+        self.finished = time.perf_counter()
+
+    def report(self, top: int = 15) -> str:
+        total = (self.finished or time.perf_counter()) - self.started
+        lines = [f"Startup: {total * 1000:.1f} ms, {len(self.timings)} modules imported",
+                 f"{'cumulative ms':>14} {'self ms':>9}  module"]
+        ranked = sorted(self.timings.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        for name, (own, cumulative) in ranked:
+            lines.append(f"{cumulative * 1000:14.1f} {own * 1000:9.1f}  {name}")
+        return "\n".join(lines)
@@ -1,40 +1,69 @@
-import json
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, Optional, Iterator
 from datetime import datetime
 from loguru import logger
 
+from common.metrics import span
+from common.store import StoryStore, get_store, store_path
+
 class StateManager:
-    def __init__(self, state_file: str = "story_state.json"):
+    """Records generated acts in the configured story store.
+
+    `state_file` names the legacy JSON file; the store lives next to it
+    (`story_state.jsonl` or `story_state.sqlite3`) and imports the legacy
+    history the first time it is opened.
+    """
+
+    def __init__(self, state_file: str = "story_state.json", backend: Optional[str] = None,
+                 analytics: Optional[bool] = None):
+        from config import settings
+        if backend is None:
+            backend = settings.state_backend
         self.state_file = state_file
+        self.backend = backend
+        self.store: StoryStore = get_store(state_file, backend)
+        self.analytics_enabled = settings.analytics_enabled if analytics is None else analytics
 
-    def save_state(self, act_name: str, content: str):
-        state = self.load_state()
-        
+    @property
+    def analytics(self):
+        """Choice/dharma/karma aggregates over this store (see story.analytics)."""
+        from config import settings
+        from story.analytics import get_analytics  # numpy: only loaded once acts are written or queried
+        base = os.path.splitext(store_path(self.state_file, self.backend))[0]
+        return get_analytics(self.store, f"{base}.stats.npz", settings.analytics_snapshot_every)
+
+    def save_state(self, act_name: str, content: str, **extra: Any):
         entry = {
             "timestamp": datetime.now().isoformat(),
             "act": act_name,
-            "content": content
+            "content": content,
+            **extra
         }
         
-        if "history" not in state:
-            state["history"] = []
-            
-        state["history"].append(entry)
-        
-        try:
-            with open(self.state_file, "w") as f:
-                json.dump(state, f, indent=4)
-            logger.info(f"State saved to {self.state_file}")
-        except Exception as e:
-            logger.error(f"Failed to save state: {e}")
+        with span("save_state", bytes=len(content)):
+            try:
+                self.store.append(entry)
+                logger.info(f"State saved to {self.state_file}")
+            except Exception as e:
+                logger.error(f"Failed to save state: {e}")
+                return
+        if self.analytics_enabled:
+            # Parse the new act's footer into the stats columns now, not per query
+            with span("analytics"):
+                try:
+                    self.analytics.sync()
+                except Exception as e:
+                    logger.error(f"Failed to update analytics: {e}")
+
+    def iter_history(self, act: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        return self.store.iter_entries(act=act, since=since, until=until, session_id=session_id)
 
     def load_state(self) -> Dict[str, Any]:
-        if not os.path.exists(self.state_file):
-            return {}
+        # Materializes the whole history; prefer iter_history for filtered reads
         try:
-            with open(self.state_file, "r") as f:
-                return json.load(f)
+            history = list(self.store.iter_entries())
         except Exception as e:
             logger.error(f"Failed to load state: {e}")
             return {}
+        return {"history": history} if history else {}
@@ -0,0 +1,371 @@
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from itertools import islice
+from typing import Any, Dict, Iterator, List, Optional
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive flock on `path`, held across worker processes (no-op without fcntl)."""
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class StoryStore(ABC):
+    """Append-only storage for generated story entries.
+
+    Entries are dicts with at least `timestamp` (ISO string), `act` and
+    `content`; any extra keys (e.g. `session_id`) are stored alongside.
+    """
+
+    @abstractmethod
+    def append(self, entry: Dict[str, Any]) -> None:
+        pass
+
+    @abstractmethod
+    def iter_entries(self, act: Optional[str] = None, since: Optional[str] = None,
+                     until: Optional[str] = None, session_id: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield matching entries in insertion order, reading them lazily."""
+
+    @abstractmethod
+    def count(self) -> int:
+        pass
+
+    def iter_from(self, start: int) -> Iterator[Dict[str, Any]]:
+        """Yield entries from position `start` (0-based, insertion order) on."""
+        return islice(self.iter_entries(), start, None)
+
+    def close(self):
+        pass
+
+
+def _matches(meta: Dict[str, Any], act, since, until, session_id) -> bool:
+    if act is not None and meta.get("act") != act:
+        return False
+    if session_id is not None and meta.get("session_id") != session_id:
+        return False
+    timestamp = meta.get("timestamp") or ""
+    if since is not None and timestamp < since:
+        return False
+    if until is not None and timestamp >= until:
+        return False
+    return True
+
+
+class JsonlStoryStore(StoryStore):
+    """JSON-lines log plus a sidecar offset index.
+
+    Each entry is appended as one line with a single O_APPEND write, so a
+    crash can at worst leave a truncated last line, which is skipped. The
+    index (`<path>.idx`) maps entries to byte offsets with their act,
+    timestamp and session id, so filtered reads only seek to the matching
+    lines. Writers serialize on a thread lock plus an flock on `<path>.lock`,
+    which also covers other worker processes sharing the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.lock_path = path + ".lock"
+        self._lock = threading.RLock()
+        self._index: List[Dict[str, Any]] = []
+        self._index_pos = 0
+        with self._locked():
+            self._sync_index()
+
+    @contextmanager
+    def _locked(self):
+        with self._lock, file_lock(self.lock_path):
+            yield
+
+    def _sync_index(self):
+        # Pick up index lines written by other processes since our last read
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                f.seek(self._index_pos)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self._index.append(json.loads(line))
+                    self._index_pos += len(line)
+            if os.path.getsize(self.index_path) > self._index_pos:
+                # Drop a torn index line so the next append starts cleanly
+                os.truncate(self.index_path, self._index_pos)
+
+        # Recover entries that reached the log but not the index (crash between writes)
+        indexed_end = self._indexed_end()
+        log_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if log_size <= indexed_end:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(indexed_end)
+            offset = indexed_end
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping corrupt entry at offset {offset} in {self.path}")
+                else:
+                    self._write_index(self._meta(entry, offset, len(line)))
+                offset += len(line)
+
+    def _indexed_end(self) -> int:
+        if not self._index:
+            return 0
+        return self._index[-1]["offset"] + self._index[-1]["length"]
+
+    @staticmethod
+    def _meta(entry: Dict[str, Any], offset: int, length: int) -> Dict[str, Any]:
+        return {
+            "offset": offset,
+            "length": length,
+            "timestamp": entry.get("timestamp"),
+            "act": entry.get("act"),
+            "session_id": entry.get("session_id"),
+        }
+
+    def _write_index(self, meta: Dict[str, Any]):
+        line = (json.dumps(meta) + "\n").encode()
+        fd = os.open(self.index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+        self._index.append(meta)
+        self._index_pos += len(line)
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        line = (json.dumps(entry) + "\n").encode()
+        with self._locked():
+            self._sync_index()
+            indexed_end = self._indexed_end()
+            if os.path.exists(self.path) and os.path.getsize(self.path) > indexed_end:
+                # A torn or corrupt tail from a crashed writer is discarded
+                os.truncate(self.path, indexed_end)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                offset = os.lseek(fd, 0, os.SEEK_END)
+                os.write(fd, line)
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            self._write_index(self._meta(entry, offset, len(line)))
+
+    def iter_entries(self, act=None, since=None, until=None, session_id=None):
+        with self._locked():
+            self._sync_index()
+            matches = [m for m in self._index if _matches(m, act, since, until, session_id)]
+        if not matches:
+            return
+        with open(self.path, "rb") as f:
+            for meta in matches:
+                f.seek(meta["offset"])
+                yield json.loads(f.read(meta["length"]))
+
+    def iter_from(self, start: int):
+        # The offset index makes this a seek, not a scan of the earlier entries
+        with self._locked():
+            self._sync_index()
+            metas = self._index[start:]
+        if not metas:
+            return
+        with open(self.path, "rb") as f:
+            for meta in metas:
+                f.seek(meta["offset"])
+                yield json.loads(f.read(meta["length"]))
+
+    def count(self) -> int:
+        with self._locked():
+            self._sync_index()
+            return len(self._index)
+
+
+class SqliteStoryStore(StoryStore):
+    """SQLite store in WAL mode: readers never block the single writer.
+
+    Reads page through the table by id, so only `page_size` rows are in
+    memory at once and no statement stays open between pages.
+    """
+
+    page_size = 500
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, act TEXT, "
+            "session_id TEXT, data TEXT NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_act ON entries (act, timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_timestamp ON entries (timestamp)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_session ON entries (session_id)")
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO entries (timestamp, act, session_id, data) VALUES (?, ?, ?, ?)",
+                (entry.get("timestamp"), entry.get("act"), entry.get("session_id"), json.dumps(entry)),
+            )
+
+    def iter_entries(self, act=None, since=None, until=None, session_id=None):
+        clauses, params = [], []
+        for column, op, value in (("act", "=", act), ("session_id", "=", session_id),
+                                  ("timestamp", ">=", since), ("timestamp", "<", until)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        yield from self._paged(clauses, params)
+
+    def iter_from(self, start: int):
+        with self._lock:
+            row = self._conn.execute("SELECT id FROM entries ORDER BY id LIMIT 1 OFFSET ?", (start,)).fetchone()
+        if row is not None:
+            yield from self._paged([], [], after=row[0] - 1)
+
+    def _paged(self, clauses: List[str], params: List[Any], after: int = 0):
+        query = "SELECT id, data FROM entries WHERE " + " AND ".join(["id > ?", *clauses]) + " ORDER BY id LIMIT ?"
+        while True:
+            with self._lock:
+                rows = self._conn.execute(query, [after, *params, self.page_size]).fetchall()
+            for _, data in rows:
+                yield json.loads(data)
+            if len(rows) < self.page_size:
+                return
+            after = rows[-1][0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SharedStoryStore(StoryStore):
+    """Entries as a list in the shared state (see common.shared), for API
+    workers that do not share a filesystem. `path` only names the list,
+    so workers must be configured with the same state file path."""
+
+    page_size = 500
+
+    def __init__(self, path: str, shared=None):
+        if shared is None:
+            from common.shared import get_shared_state
+            shared = get_shared_state()
+        self.shared = shared
+        self.key = f"story:{path}"
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        self.shared.rpush(self.key, json.dumps(entry))
+
+    def iter_entries(self, act=None, since=None, until=None, session_id=None):
+        for entry in self.iter_from(0):
+            if _matches(entry, act, since, until, session_id):
+                yield entry
+
+    def iter_from(self, start: int):
+        # Read a page at a time so large histories are never held at once
+        while True:
+            page = self.shared.lrange(self.key, start, start + self.page_size - 1)
+            for raw in page:
+                yield json.loads(raw)
+            if len(page) < self.page_size:
+                return
+            start += self.page_size
+
+    def count(self) -> int:
+        return self.shared.llen(self.key)
+
+
+STORE_BACKENDS = {
+    "jsonl": (JsonlStoryStore, ".jsonl"),
+    "sqlite": (SqliteStoryStore, ".sqlite3"),
+    "shared": (SharedStoryStore, ".shared"),
+}
+
+_stores: Dict[str, StoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def store_path(state_file: str, backend: str) -> str:
+    base, _ = os.path.splitext(state_file)
+    return base + STORE_BACKENDS[backend][1]
+
+
+def get_store(state_file: str, backend: str = "jsonl") -> StoryStore:
+    """Return the process-wide store for `state_file`, migrating legacy JSON once."""
+    if backend not in STORE_BACKENDS:
+        raise ValueError(f"Unknown state backend: {backend}")
+    path = os.path.abspath(store_path(state_file, backend))
+    with _stores_lock:
+        store = _stores.get(path)
+        if store is None:
+            store_cls, _ = STORE_BACKENDS[backend]
+            store = store_cls(path)
+            if state_file.endswith(".json") and os.path.exists(state_file):
+                migrate_once(state_file, store, path)
+            _stores[path] = store
+        return store
+
+
+def migrate_once(json_path: str, store: StoryStore, path: str) -> int:
+    """Run `migrate_json_state` unless `<path>.migrated` says it already finished.
+
+    An flock on `<path>.migrate.lock` makes workers starting together wait
+    for the first one instead of each copying the history. A migration cut
+    short resumes where it stopped, since the store holds nothing else until
+    the marker is written.
+    """
+    marker = path + ".migrated"
+    if os.path.exists(marker):
+        return 0
+    with file_lock(path + ".migrate.lock"):
+        if os.path.exists(marker):
+            return 0
+        migrated = migrate_json_state(json_path, store, skip=store.count())
+        if migrated is not None:
+            with open(marker, "w") as f:
+                f.write(os.path.abspath(json_path) + "\n")
+        return migrated or 0
+
+
+def migrate_json_state(json_path: str, store: StoryStore, skip: int = 0) -> Optional[int]:
+    """Copy the history of a legacy `story_state.json` into `store`, after
+    the first `skip` entries (already copied). The legacy file is left in
+    place. Returns how many were copied, or None if the file is unreadable."""
+    try:
+        with open(json_path, "r") as f:
+            history = json.load(f).get("history", [])
+    except Exception as e:
+        logger.error(f"Failed to read legacy state {json_path}: {e}")
+        return None
+    for entry in history[skip:]:
+        store.append(entry)
+    copied = max(len(history) - skip, 0)
+    logger.info(f"Migrated {copied} entries from {json_path}")
+    return copied
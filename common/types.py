@@ -1,18 +1,57 @@
-from dataclasses import dataclass, field
-from typing import List, Dict, Any, Optional
+from dataclasses import dataclass, field, replace
+from typing import List, Dict, Any, Optional, Tuple
 
-@dataclass
+@dataclass(frozen=True)
 class Character:
     name: str
     role: str
     description: str
 
+@dataclass(frozen=True)
+class WorldSpec:
+    """Immutable, hashable world + cast. Per-request overrides make a new spec
+    (`with_description`), so shared config is never mutated and compiled
+    prompt blocks can be cached by spec."""
+    description: str
+    governance: Tuple[str, ...] = ()
+    conflicts: Tuple[str, ...] = ()
+    advisor_role: str = ""
+    factions: Tuple[str, ...] = ()
+    advisor: str = ""
+    themes: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_config(cls, world, characters) -> "WorldSpec":
+        return cls(
+            description=world.description,
+            governance=tuple(world.governance),
+            conflicts=tuple(world.conflicts),
+            advisor_role=world.advisor_role,
+            factions=tuple(characters.factions),
+            advisor=characters.advisor,
+            themes=tuple(characters.themes),
+        )
+
+    def with_description(self, description: Optional[str]) -> "WorldSpec":
+        if not description or description == self.description:
+            return self
+        return replace(self, description=description)
+
+    def world_context(self) -> Dict[str, Any]:
+        return {
+            "description": self.description,
+            "governance": list(self.governance),
+            "conflicts": list(self.conflicts),
+            "advisor_role": self.advisor_role,
+        }
+
 @dataclass
 class Act:
     name: str
     description: str
     characters: List[Character] = field(default_factory=list)
     world_context: Dict[str, Any] = field(default_factory=dict)
+    world: Optional[WorldSpec] = None
     
 @dataclass
 class Scene:
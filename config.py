@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -43,7 +43,126 @@ class Settings(BaseSettings):
     ))
     
     openrouter_api_key: Optional[str] = Field(default=None, validation_alias="OPENROUTER_API_KEY")
+    openrouter_base_url: str = "https://openrouter.ai/api/v1"
+    # OpenRouter model list cached on disk, revalidated (ETag) once older than
+    # the TTL and refreshed in the background every N seconds; 0 disables refresh
+    model_catalog_path: Optional[str] = ".cache/model_catalog.json"
+    model_catalog_ttl: float = 6 * 3600
+    model_catalog_refresh: float = 3600
+    # Session exports (/sessions/{id}/export) are written here and deleted once
+    # they have not been re-exported for export_ttl seconds
+    export_dir: str = "exports"
+    export_ttl: float = 24 * 3600
+
+    # Span trees kept for the slowest requests (/traces/slowest); 0 disables
+    metrics_slow_traces: int = 20
+
+    # Re-ask for just the JSON footer when an act's footer is missing or broken
+    extraction_repair: bool = True
+    
+    # State shared by all API workers (sessions, cache, rate limits):
+    # "redis://[:password@]host:port/db"; unset keeps it in this process
+    shared_state_url: Optional[str] = None
+    
+    # Story store backend: "jsonl" (append-only log + offset index), "sqlite" (WAL)
+    # or "shared" (a list in the shared state, for workers on several hosts)
+    state_backend: str = "jsonl"
+    
+    # Choice/dharma/karma stats (/stats), updated as acts are saved; the columns
+    # are snapshotted next to the store every N new acts
+    analytics_enabled: bool = True
+    analytics_snapshot_every: int = 1000
+    
+    # Response cache for identical generations (model + prompt + params)
+    llm_cache_enabled: bool = False
+    llm_cache_max_entries: int = 256
+    llm_cache_ttl: Optional[float] = 3600
+    llm_cache_dir: Optional[str] = None
+    llm_cache_max_bytes: int = 50 * 1024 * 1024
+    
+    # Story context sent back to the model: rolling summary + last N raw acts
+    context_token_budget: int = 3000
+    context_recent_acts: int = 2
+    
+    # Semantic memory: passages from older acts retrieved by relevance to the choice.
+    # memory_embedding_model names a local sentence-transformers model; unset (or
+    # not installed) uses the built-in hashed TF-IDF embedder
+    memory_enabled: bool = True
+    memory_top_k: int = 4
+    memory_chunk_tokens: int = 120
+    memory_token_budget: int = 600
+    memory_embedding_model: Optional[str] = None
+    
+    # Council debates: each member speaks once per round, all members of a round
+    # concurrently. council_models maps a member name to its own model; others
+    # (and the consensus pass) use council_model
+    council_model: str = "google/gemma-3-27b-it:free"
+    council_rounds: int = 2
+    council_models: Dict[str, str] = Field(default_factory=dict)
+    
+    # Background jobs (/jobs): worker pool, queue bound and records kept in memory;
+    # older finished records spill to job_dir and expire after job_ttl seconds
+    job_workers: int = 4
+    job_max_queue: int = 100
+    job_max_records: int = 200
+    job_dir: str = ".jobs"
+    job_ttl: float = 24 * 3600
+    # Base URL of the API that app.py and `run.py jobs` submit jobs to
+    api_url: Optional[str] = None
+    
+    # Server-side story sessions (idle expiry in seconds)
+    session_max: int = 1000
+    session_ttl: float = 6 * 3600
+    
+    # Speculative generation of every pending choice once an act is delivered
+    prefetch_enabled: bool = False
+    prefetch_max_concurrency: int = 4
+    prefetch_per_session: int = 3
+    prefetch_keep_alternates: bool = False
+    
+    # Act illustrations: rendered in the background as soon as the footer's
+    # image_prompt streams in. image_provider: "none" (off), "stub" (local
+    # placeholders) or "pollinations" (opt-in: sends each image_prompt to
+    # image_base_url); prompts within image_dedup_distance SimHash bits of a
+    # cached one reuse its image
+    image_provider: str = "none"
+    image_base_url: str = "https://image.pollinations.ai"
+    image_model: Optional[str] = None
+    image_dir: str = ".images"
+    image_width: int = 1200
+    image_height: int = 600
+    image_thumbnail_width: int = 240
+    image_max_concurrency: int = 2
+    image_per_session: int = 1
+    image_max_queue: int = 100
+    image_dedup_distance: int = 3
+    
+    # Health-aware model routing (circuit breaker + optional hedging)
+    router_adaptive: bool = True
+    router_failure_threshold: int = 3
+    router_cooldown: float = 30.0
+    router_max_wait: float = 10.0
+    router_hedge_after: Optional[float] = None
+    
+    # Upstream admission control: concurrency, queue bound and per key/model rate
+    scheduler_max_concurrency: int = 8
+    scheduler_max_queue: int = 64
+    scheduler_rate: float = 2.0
+    scheduler_burst: float = 5.0
     
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8", extra="ignore")
 
-settings = Settings()
+_settings: Optional[Settings] = None
+
+def get_settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
+
+def __getattr__(name: str):
+    # `from config import settings` builds Settings (env + .env parsing) on
+    # first use instead of at import, so importing config stays cheap
+    if name == "settings":
+        return get_settings()
+    raise AttributeError(f"module 'config' has no attribute '{name}'")
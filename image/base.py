@@ -0,0 +1,82 @@
+from abc import ABC, abstractmethod
+import asyncio
+import hashlib
+import io
+import struct
+import zlib
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+def encode_png(pixels: np.ndarray) -> bytes:
+    """Encode an (height, width, 3) uint8 array as a PNG (no filtering)."""
+    height, width, _ = pixels.shape
+    rows = np.hstack([np.zeros((height, 1), dtype=np.uint8), pixels.reshape(height, width * 3)])
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header)
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6)) + chunk(b"IEND", b""))
+
+def media_type(data: bytes) -> str:
+    if data.startswith(b"\x89PNG"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+class ImageProvider(ABC):
+    @abstractmethod
+    def generate(self, prompt: str, width: int, height: int) -> bytes:
+        pass
+
+    def cache_params(self) -> Dict[str, Any]:
+        # Everything besides the prompt and size that determines the image
+        return {"provider": type(self).__name__, "model": getattr(self, "model", None)}
+
+    async def agenerate(self, prompt: str, width: int, height: int) -> bytes:
+        # Providers without a native async transport run in a worker thread
+        return await asyncio.to_thread(self.generate, prompt, width, height)
+
+    def thumbnail(self, prompt: str, data: bytes, width: int, height: int) -> Optional[bytes]:
+        """A downscaled copy of `data`; needs Pillow (optional), else None and
+        the full image is served in its place."""
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        image = Image.open(io.BytesIO(data))
+        image.thumbnail((width, height))
+        out = io.BytesIO()
+        image.save(out, format=image.format or "PNG")
+        return out.getvalue()
+
+class StubImageProvider(ImageProvider):
+    """Local placeholder renders: a gradient coloured by the prompt's hash.
+
+    Deterministic and offline, for tests and development; `delay` simulates
+    render time.
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+
+    def generate(self, prompt: str, width: int, height: int) -> bytes:
+        digest = hashlib.sha256(prompt.encode()).digest()
+        start, end = np.frombuffer(digest[:3], np.uint8), np.frombuffer(digest[3:6], np.uint8)
+        ramp = np.linspace(0.0, 1.0, width, dtype=np.float32)[:, None]
+        row = (start * (1 - ramp) + end * ramp).astype(np.uint8)
+        return encode_png(np.broadcast_to(row, (height, width, 3)))
+
+    async def agenerate(self, prompt: str, width: int, height: int) -> bytes:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self.generate(prompt, width, height)
+
+    def thumbnail(self, prompt: str, data: bytes, width: int, height: int) -> Optional[bytes]:
+        # The render is a pure function of the prompt, so draw it again at the smaller size
+        return self.generate(prompt, width, height)
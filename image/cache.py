@@ -0,0 +1,179 @@
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, Optional, Set, Tuple
+
+from image.base import media_type
+
+WORD_RE = re.compile(r"\w+")
+EXTENSIONS = {"image/png": ".png", "image/jpeg": ".jpg", "image/webp": ".webp"}
+BANDS = 4  # 64-bit SimHash split into 4 x 16-bit bands
+# Filler the model varies freely between otherwise identical prompts
+STOPWORDS = frozenset("a an the of in on at with and or over under into onto to by from its their is are".split())
+
+
+def normalize(prompt: str) -> str:
+    return " ".join(WORD_RE.findall(prompt.lower()))
+
+
+def simhash(prompt: str) -> int:
+    """64-bit SimHash over the prompt's content words and word pairs.
+
+    Prompts that differ only in case, punctuation or filler words hash the
+    same or a few bits apart; unrelated prompts differ in about half of the 64.
+    """
+    words = [word for word in normalize(prompt).split() if word not in STOPWORDS]
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    weights = [0] * 64
+    for feature in features:
+        value = int.from_bytes(hashlib.blake2b(feature.encode(), digest_size=8).digest(), "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def _bands(value: int) -> Iterator[Tuple[int, int]]:
+    for band in range(BANDS):
+        yield band, value >> (16 * band) & 0xFFFF
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    prompt: str
+    params: str           # provider params + size, JSON; dedup only within the same params
+    simhash: int
+    sha: Optional[str] = None        # content address of the image; None while rendering
+    thumb_sha: Optional[str] = None
+    media_type: Optional[str] = None
+    created_at: float = 0.0
+
+
+class ImageCache:
+    """Content-addressed image store with near-duplicate prompt lookup.
+
+    Image bytes live under `blobs/` named by their SHA-256, so identical
+    renders are stored once; `index.jsonl` maps prompt keys to them. A new
+    prompt whose SimHash is within `max_distance` bits of a cached (or
+    currently rendering) prompt with the same params reuses that entry;
+    candidates come from 16-bit bands, so at most 3 differing bits are
+    always found without scanning every entry.
+    """
+
+    def __init__(self, directory: str, max_distance: int = 3):
+        self.directory = directory
+        self.max_distance = max_distance
+        self.index_path = os.path.join(directory, "index.jsonl")
+        self._lock = threading.Lock()
+        self._entries: Dict[str, CacheEntry] = {}
+        self._bands: Dict[Tuple[str, int, int], Set[str]] = {}
+        self.exact_hits = 0
+        self.near_hits = 0
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path) as f:
+            for line in f:
+                try:
+                    entry = CacheEntry(**json.loads(line))
+                except (ValueError, TypeError):
+                    continue  # torn last line
+                if entry.sha and os.path.exists(self.blob_path(entry.sha, entry.media_type)):
+                    self._register(entry)
+
+    def _register(self, entry: CacheEntry):
+        self._entries[entry.key] = entry
+        for band, value in _bands(entry.simhash):
+            self._bands.setdefault((entry.params, band, value), set()).add(entry.key)
+
+    def _unregister(self, entry: CacheEntry):
+        self._entries.pop(entry.key, None)
+        for band, value in _bands(entry.simhash):
+            self._bands.get((entry.params, band, value), set()).discard(entry.key)
+
+    @staticmethod
+    def key_for(prompt: str, params: str) -> str:
+        return hashlib.sha256(f"{params}\n{normalize(prompt)}".encode()).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self._entries.get(key)
+
+    def reserve(self, prompt: str, params: Dict[str, Any]) -> Tuple[CacheEntry, bool]:
+        """The entry for `prompt`, and whether it already existed (exact or near-duplicate).
+
+        A new entry is pending (no image yet) until `put`, or `discard` on failure.
+        """
+        params_key = json.dumps(params, sort_keys=True)
+        key = self.key_for(prompt, params_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.exact_hits += 1
+                return entry, True
+            fingerprint = simhash(prompt)
+            candidates = set()
+            for band, value in _bands(fingerprint):
+                candidates |= self._bands.get((params_key, band, value), set())
+            best = min(candidates, default=None,
+                       key=lambda k: bin(self._entries[k].simhash ^ fingerprint).count("1"))
+            if best is not None and bin(self._entries[best].simhash ^ fingerprint).count("1") <= self.max_distance:
+                self.near_hits += 1
+                return self._entries[best], True
+            entry = CacheEntry(key=key, prompt=prompt, params=params_key, simhash=fingerprint,
+                               created_at=time.time())
+            self._register(entry)
+            return entry, False
+
+    def discard(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.sha is None:
+                self._unregister(entry)
+
+    def blob_path(self, sha: str, kind: Optional[str]) -> str:
+        return os.path.join(self.directory, "blobs", sha[:2], sha + EXTENSIONS.get(kind, ".bin"))
+
+    def _write_blob(self, data: bytes) -> str:
+        sha = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(sha, media_type(data))
+        if not os.path.exists(path):  # identical bytes are stored once
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".blob-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return sha
+
+    def put(self, key: str, data: bytes, thumbnail: Optional[bytes] = None) -> CacheEntry:
+        """Store a pending entry's image (and thumbnail) and record it in the index."""
+        sha = self._write_blob(data)
+        thumb_sha = self._write_blob(thumbnail) if thumbnail else None
+        with self._lock:
+            entry = self._entries[key]
+            entry.sha, entry.thumb_sha, entry.media_type = sha, thumb_sha, media_type(data)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.index_path, "a") as f:
+                f.write(json.dumps(asdict(entry)) + "\n")
+        return entry
+
+    def path(self, key: str, thumbnail: bool = False) -> Optional[str]:
+        """File of a finished entry; the full image stands in for a missing thumbnail."""
+        entry = self._entries.get(key)
+        if entry is None or entry.sha is None:
+            return None
+        if thumbnail and entry.thumb_sha:
+            return self.blob_path(entry.thumb_sha, entry.media_type)
+        return self.blob_path(entry.sha, entry.media_type)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self._entries), "exact_hits": self.exact_hits, "near_hits": self.near_hits}
@@ -0,0 +1,49 @@
+import importlib
+import threading
+from typing import Dict, Optional, Tuple
+
+from image.base import ImageProvider
+from image.cache import ImageCache
+from image.queue import ImageQueue
+
+# Imported on first use, like the LLM providers
+PROVIDERS: Dict[str, Tuple[str, str]] = {
+    "pollinations": ("image.pollinations", "PollinationsImageProvider"),
+    "stub": ("image.base", "StubImageProvider"),
+}
+
+def get_image_provider(name: str) -> ImageProvider:
+    try:
+        module, cls = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown image provider: {name}") from None
+    return getattr(importlib.import_module(module), cls)()
+
+_queue: Optional[ImageQueue] = None
+_lock = threading.Lock()
+
+def get_image_queue() -> Optional[ImageQueue]:
+    """Process-wide render queue configured from settings; None when images are disabled."""
+    global _queue
+    from config import settings
+    if settings.image_provider == "none":
+        return None
+    with _lock:
+        if _queue is None:
+            _queue = ImageQueue(
+                get_image_provider(settings.image_provider),
+                ImageCache(settings.image_dir, settings.image_dedup_distance),
+                width=settings.image_width,
+                height=settings.image_height,
+                thumbnail_width=settings.image_thumbnail_width,
+                max_concurrency=settings.image_max_concurrency,
+                per_session=settings.image_per_session,
+                max_queue=settings.image_max_queue,
+            )
+        return _queue
+
+def reset_image_queue():
+    """Forget the queue so the next call rebuilds it from (changed) settings."""
+    global _queue
+    with _lock:
+        _queue = None
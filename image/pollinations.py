@@ -0,0 +1,44 @@
+import zlib
+from typing import Any, Dict, Optional
+from urllib.parse import quote
+
+import httpx
+
+from image.base import ImageProvider
+from llm.http import get_async_client
+
+class PollinationsImageProvider(ImageProvider):
+    """Renders through image.pollinations.ai (the service the web client used directly).
+
+    The seed is derived from the prompt, so a prompt always renders the same
+    picture and thumbnails can be requested at a smaller size.
+    """
+
+    def __init__(self, base_url: Optional[str] = None, model: Optional[str] = None, timeout: float = 120.0):
+        if base_url is None:
+            from config import settings
+            base_url, model = settings.image_base_url, model or settings.image_model
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+
+    def _url(self, prompt: str) -> str:
+        return f"{self.base_url}/prompt/{quote(prompt, safe='')}"
+
+    def _params(self, prompt: str, width: int, height: int) -> Dict[str, Any]:
+        params = {"width": width, "height": height, "nologo": "true", "seed": zlib.crc32(prompt.encode())}
+        if self.model:
+            params["model"] = self.model
+        return params
+
+    def generate(self, prompt: str, width: int, height: int) -> bytes:
+        response = httpx.get(self._url(prompt), params=self._params(prompt, width, height),
+                             timeout=self.timeout, follow_redirects=True)
+        response.raise_for_status()
+        return response.content
+
+    async def agenerate(self, prompt: str, width: int, height: int) -> bytes:
+        response = await get_async_client().get(self._url(prompt), params=self._params(prompt, width, height),
+                                                timeout=self.timeout, follow_redirects=True)
+        response.raise_for_status()
+        return response.content
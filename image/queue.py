@@ -0,0 +1,219 @@
+import asyncio
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from loguru import logger
+
+from image.base import ImageProvider
+from image.cache import ImageCache
+from llm.scheduler import PRIORITY_INTERACTIVE, PRIORITY_NAMES, QueueFullError
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+@dataclass
+class ImageJob:
+    id: str               # the cache key: near-duplicate prompts share one job
+    prompt: str
+    session_id: Optional[str] = None
+    priority: int = PRIORITY_INTERACTIVE
+    status: str = QUEUED
+    error: Optional[str] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (DONE, FAILED)
+
+
+class ImageQueue:
+    """Background renders of act image prompts, deduplicated through an ImageCache.
+
+    At most `max_concurrency` renders run at once and at most `per_session`
+    of them for any one session. Waiting jobs are ordered by priority, then
+    by how many images their session already has in flight, so a session
+    with a long backlog cannot starve another's first image.
+    """
+
+    def __init__(self, provider: ImageProvider, cache: ImageCache, width: int = 1200, height: int = 600,
+                 thumbnail_width: int = 240, max_concurrency: int = 2, per_session: int = 1,
+                 max_queue: int = 100, max_records: int = 1000):
+        self.provider = provider
+        self.cache = cache
+        self.width, self.height = width, height
+        self.thumbnail_size = (thumbnail_width, max(1, thumbnail_width * height // width))
+        self.max_concurrency = max_concurrency
+        self.per_session = per_session
+        self.max_queue = max_queue
+        self._jobs: Dict[str, ImageJob] = {}
+        self._finished: Deque[str] = deque()
+        self.max_records = max_records
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heap: List[Tuple[int, int, int, str]] = []
+        self._seq = itertools.count()
+        self._session_turns: Dict[Optional[str], int] = defaultdict(int)  # queued + running per session
+        self._session_running: Dict[Optional[str], int] = defaultdict(int)
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.rejected = 0
+        self.rendered = 0
+        self.failed = 0
+
+    def _bind_loop(self):
+        # Render tasks belong to one event loop; drop work left on a previous one
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            for job in self._jobs.values():
+                if not job.finished:
+                    self.cache.discard(job.id)
+            self._jobs = {key: job for key, job in self._jobs.items() if job.finished}
+            self._heap, self._tasks = [], {}
+            self._session_running, self._session_turns = defaultdict(int), defaultdict(int)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for job in self._jobs.values() if job.status == QUEUED)
+
+    def _params(self) -> Dict[str, Any]:
+        return {**self.provider.cache_params(), "width": self.width, "height": self.height}
+
+    def submit(self, prompt: str, session_id: Optional[str] = None,
+               priority: int = PRIORITY_INTERACTIVE) -> ImageJob:
+        """Queue a render of `prompt`, or return the job already covering it (or a near-duplicate)."""
+        self._bind_loop()
+        prompt = prompt.strip()
+        entry, existing = self.cache.reserve(prompt, self._params())
+        job = self._jobs.get(entry.key)
+        if job is not None and job.status != FAILED:
+            if job.status == QUEUED and priority < job.priority:
+                # Someone needs it sooner: requeue at the higher priority (the old heap entry goes stale)
+                job.priority = priority
+                self._push(job)
+                self._dispatch()
+            return job
+        if existing and entry.sha is not None:
+            return self._remember(ImageJob(id=entry.key, prompt=entry.prompt, session_id=session_id,
+                                           priority=priority, status=DONE, created_at=entry.created_at,
+                                           finished_at=entry.created_at))
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            self.cache.discard(entry.key)
+            raise QueueFullError(retry_after=5.0)
+        job = ImageJob(id=entry.key, prompt=prompt, session_id=session_id, priority=priority,
+                       created_at=time.time())
+        self._jobs[job.id] = job
+        self._session_turns[session_id] += 1
+        self._push(job)
+        self._dispatch()
+        return job
+
+    def _push(self, job: ImageJob):
+        heapq.heappush(self._heap, (job.priority, self._session_turns[job.session_id], next(self._seq), job.id))
+
+    def _dispatch(self):
+        deferred = []
+        while self._heap and len(self._tasks) < self.max_concurrency:
+            item = heapq.heappop(self._heap)
+            job = self._jobs.get(item[3])
+            if job is None or job.status != QUEUED or job.priority != item[0] or job.id in self._tasks:
+                continue  # stale: started, finished or requeued at another priority
+            if self._session_running[job.session_id] >= self.per_session:
+                deferred.append(item)  # this session is at its cap; keep its place
+                continue
+            job.status = RUNNING
+            self._session_running[job.session_id] += 1
+            self._tasks[job.id] = asyncio.create_task(self._render(job))
+        for item in deferred:
+            heapq.heappush(self._heap, item)
+
+    async def _render(self, job: ImageJob):
+        try:
+            data = await self.provider.agenerate(job.prompt, self.width, self.height)
+            thumbnail = await asyncio.to_thread(self.provider.thumbnail, job.prompt, data, *self.thumbnail_size)
+            await asyncio.to_thread(self.cache.put, job.id, data, thumbnail)
+            job.status = DONE
+            self.rendered += 1
+        except asyncio.CancelledError:
+            self.cache.discard(job.id)
+            raise
+        except Exception as e:
+            logger.warning(f"Image {job.id} failed: {e}")
+            self.cache.discard(job.id)
+            job.status, job.error = FAILED, str(e)
+            self.failed += 1
+        finally:
+            job.finished_at = time.time()
+            self._tasks.pop(job.id, None)
+            for counts in (self._session_running, self._session_turns):
+                counts[job.session_id] -= 1
+                if counts[job.session_id] <= 0:
+                    del counts[job.session_id]
+            if job.finished:
+                self._remember(job)
+            self._dispatch()
+
+    def _remember(self, job: ImageJob) -> ImageJob:
+        # Finished jobs are kept for status lookups, oldest dropped first
+        self._jobs[job.id] = job
+        self._finished.append(job.id)
+        while len(self._finished) > self.max_records:
+            old = self._finished.popleft()
+            if old in self._jobs and self._jobs[old].finished and old not in self._finished:
+                del self._jobs[old]
+        return job
+
+    def get(self, image_id: str) -> Optional[ImageJob]:
+        job = self._jobs.get(image_id)
+        if job is not None:
+            return job
+        entry = self.cache.get(image_id)
+        if entry is None or entry.sha is None:
+            return None
+        # Rendered before a restart, or dropped from the job records
+        return ImageJob(id=entry.key, prompt=entry.prompt, status=DONE, created_at=entry.created_at,
+                        finished_at=entry.created_at)
+
+    def path(self, image_id: str, thumbnail: bool = False) -> Optional[str]:
+        return self.cache.path(image_id, thumbnail)
+
+    def describe(self, job: ImageJob) -> Dict[str, Any]:
+        done = job.status == DONE
+        return {
+            "id": job.id,
+            "status": job.status,
+            "prompt": job.prompt,
+            "session_id": job.session_id,
+            "priority": PRIORITY_NAMES.get(job.priority, str(job.priority)),
+            "error": job.error,
+            "url": f"/images/{job.id}/file" if done else None,
+            "thumbnail_url": f"/images/{job.id}/thumbnail" if done else None,
+        }
+
+    async def stop(self):
+        """Cancel running renders; queued ones are dropped."""
+        self._heap = []
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "provider": type(self.provider).__name__,
+            "running": len(self._tasks),
+            "queue_depth": self.queue_depth,
+            "max_concurrency": self.max_concurrency,
+            "per_session": self.per_session,
+            "max_queue": self.max_queue,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "cache": self.cache.stats(),
+        }
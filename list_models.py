@@ -1,25 +1,22 @@
-import requests
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from config import settings
 
 def list_models():
-    key = os.getenv("OPENROUTER_API_KEY")
+    key = settings.openrouter_api_key
     if not key:
         print("No API key found")
         return
 
-    response = requests.get("https://openrouter.ai/api/v1/models")
-    if response.status_code == 200:
-        models = response.json()["data"]
-        # Filter for free or low cost models
-        print("Available models:")
-        for m in models:
-            if "free" in m["id"] or "gemini" in m["id"] or "mistral" in m["id"]:
-                 print(f"- {m['id']}")
-    else:
-        print(f"Error fetching models: {response.text}")
+    from llm.catalog import get_catalog  # deferred: only this command needs it
+    catalog = get_catalog()
+    catalog.refresh()  # revalidates the disk copy only once it is stale
+    if not len(catalog):
+        print("Error fetching models")
+        return
+    # Free models, largest context first within the same price
+    print("Available models:")
+    for m in catalog.query(free=True):
+        json_flag = ", json" if m.json_mode else ""
+        print(f"- {m.id} ({m.context_length} ctx{json_flag})")
 
 if __name__ == "__main__":
     list_models()
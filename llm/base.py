@@ -0,0 +1,28 @@
+from abc import ABC, abstractmethod
+import asyncio
+from typing import Dict, Any, AsyncIterator
+
+class LLMProvider(ABC):
+    @abstractmethod
+    def generate(self, prompt: str) -> str:
+        pass
+
+    def cache_params(self) -> Dict[str, Any]:
+        # Everything besides the prompt that determines the output
+        return {"provider": type(self).__name__, "model": getattr(self, "model", None)}
+
+    async def agenerate(self, prompt: str) -> str:
+        # Providers without a native async transport run in a worker thread
+        # so they never block the event loop
+        return await asyncio.to_thread(self.generate, prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        # Non-streaming providers deliver the whole act as a single chunk
+        yield await self.agenerate(prompt)
+
+class MockLLM(LLMProvider):
+    def generate(self, prompt: str) -> str:
+        return "This is a mock response from the LLM for testing purposes."
+
+    async def agenerate(self, prompt: str) -> str:
+        return self.generate(prompt)
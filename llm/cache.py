@@ -0,0 +1,272 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Optional
+
+from loguru import logger
+
+from common.shared import SharedState, get_shared_state
+from llm.base import LLMProvider
+
+
+def cache_key(params: Dict[str, Any], prompt: str) -> str:
+    """Content address of a generation: model + sampling params + prompt."""
+    payload = json.dumps({"params": params, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Tiered response cache: in-memory LRU, then (optionally) the shared
+    state and disk.
+
+    All tiers honour `ttl` (seconds, None = forever). The shared tier lets
+    every API worker reuse a generation any of them made. The disk tier
+    stores one file per key and evicts the oldest files once `disk_max_bytes`
+    is exceeded, so it survives restarts and Streamlit reruns.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: Optional[float] = None,
+                 disk_dir: Optional[str] = None, disk_max_bytes: int = 50 * 1024 * 1024,
+                 shared: Optional[SharedState] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self.shared = shared
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.shared_hits = 0
+        self.evictions = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+
+    def _expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created, value = item
+                if not self._expired(created):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+
+        item = self._shared_get(key)
+        if item is not None:
+            with self._lock:
+                self.hits += 1
+                self.shared_hits += 1
+                self._remember(key, *item)
+            return item[1]
+
+        item = self._disk_get(key)
+        with self._lock:
+            if item is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, *item)
+        return item[1]
+
+    def set(self, key: str, value: str):
+        created = time.time()
+        with self._lock:
+            self._remember(key, created, value)
+        self._shared_set(key, created, value)
+        self._disk_set(key, created, value)
+
+    def _shared_get(self, key: str) -> Optional[tuple]:
+        if self.shared is None:
+            return None
+        try:
+            raw = self.shared.get(f"llm-cache:{key}")
+        except Exception as e:
+            logger.error(f"Shared cache read failed: {e}")
+            return None
+        if raw is None:
+            return None
+        data = json.loads(raw)
+        return data["created"], data["value"]
+
+    def _shared_set(self, key: str, created: float, value: str):
+        if self.shared is None:
+            return
+        try:
+            self.shared.set(f"llm-cache:{key}", json.dumps({"created": created, "value": value}), ttl=self.ttl)
+        except Exception as e:
+            logger.error(f"Shared cache write failed: {e}")
+
+    def _remember(self, key: str, created: float, value: str):
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _disk_get(self, key: str) -> Optional[tuple]:
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self._expired(data["created"]):
+            path.unlink(missing_ok=True)
+            return None
+        return data["created"], data["value"]
+
+    def _disk_set(self, key: str, created: float, value: str):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"created": created, "value": value}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.error(f"Failed to write cache entry: {e}")
+            return
+        self._disk_evict()
+
+    def _disk_evict(self):
+        entries = []
+        total = 0
+        for path in self.disk_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+        entries.sort()
+        while total > self.disk_max_bytes and entries:
+            _, size, path = entries.pop(0)
+            path.unlink(missing_ok=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.disk_dir:
+            for path in self.disk_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "shared_hits": self.shared_hits,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_enabled": self.disk_dir is not None,
+                "shared_enabled": self.shared is not None,
+            }
+
+
+class CachedLLM(LLMProvider):
+    """Wraps any provider and serves repeated generations from a ResponseCache."""
+
+    def __init__(self, llm: LLMProvider, cache: ResponseCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name):
+        # Expose the wrapped provider's attributes (model, api_key, ...)
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def cache_params(self) -> Dict[str, Any]:
+        return self.llm.cache_params()
+
+    def _key(self, prompt: str) -> str:
+        return cache_key(self.llm.cache_params(), prompt)
+
+    def generate(self, prompt: str) -> str:
+        key = self._key(prompt)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        output = self.llm.generate(prompt)
+        if output:
+            self.cache.set(key, output)
+        return output
+
+    async def agenerate(self, prompt: str) -> str:
+        key = self._key(prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            return cached
+        output = await self.llm.agenerate(prompt)
+        if output:
+            await asyncio.to_thread(self.cache.set, key, output)
+        return output
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        key = self._key(prompt)
+        cached = await asyncio.to_thread(self.cache.get, key)
+        if cached is not None:
+            yield cached
+            return
+        chunks = []
+        async for token in self.llm.astream(prompt):
+            chunks.append(token)
+            yield token
+        output = "".join(chunks)
+        if output:
+            await asyncio.to_thread(self.cache.set, key, output)
+
+
+_response_cache: Optional[ResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Process-wide cache configured from settings."""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            from config import settings
+            _response_cache = ResponseCache(
+                max_entries=settings.llm_cache_max_entries,
+                ttl=settings.llm_cache_ttl,
+                disk_dir=settings.llm_cache_dir,
+                disk_max_bytes=settings.llm_cache_max_bytes,
+                # In a single process the memory tier already is the shared one
+                shared=get_shared_state() if settings.shared_state_url else None,
+            )
+        return _response_cache
+
+
+def with_cache(llm: LLMProvider, enabled: Optional[bool] = None) -> LLMProvider:
+    """Wrap `llm` in the shared cache when enabled (defaults to settings)."""
+    if enabled is None:
+        from config import settings
+        enabled = settings.llm_cache_enabled
+    if not enabled:
+        return llm
+    return CachedLLM(llm, get_response_cache())
@@ -0,0 +1,276 @@
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional
+
+import httpx
+
+# Used until the catalog has been fetched once (offline, first start)
+DEFAULT_MODELS = [
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "mistralai/mistral-7b-instruct:free",
+    "google/gemini-2.0-flash-exp:free",
+]
+
+
+@dataclass(frozen=True)
+class ModelInfo:
+    id: str
+    name: str = ""
+    context_length: int = 0
+    prompt_price: float = 0.0  # USD per token
+    completion_price: float = 0.0
+    json_mode: bool = False
+
+    @property
+    def free(self) -> bool:
+        return self.prompt_price == 0 and self.completion_price == 0
+
+    @classmethod
+    def from_api(cls, data: Dict[str, Any]) -> "ModelInfo":
+        pricing = data.get("pricing") or {}
+        params = data.get("supported_parameters") or []
+        return cls(
+            id=data["id"],
+            name=data.get("name") or data["id"],
+            context_length=int(data.get("context_length") or 0),
+            prompt_price=float(pricing.get("prompt") or 0),
+            completion_price=float(pricing.get("completion") or 0),
+            json_mode="response_format" in params or "structured_outputs" in params,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"id": self.id, "name": self.name, "context_length": self.context_length,
+                "prompt_price": self.prompt_price, "completion_price": self.completion_price,
+                "free": self.free, "json_mode": self.json_mode}
+
+
+class _Index:
+    """Immutable lookup structures; a refresh builds a new one and swaps it in."""
+
+    def __init__(self, models: Iterable[ModelInfo]):
+        self.by_id = {m.id: m for m in models}
+        # Cheapest first, larger context breaking ties
+        self.by_price = sorted(self.by_id.values(),
+                               key=lambda m: (m.prompt_price + m.completion_price, -m.context_length, m.id))
+        self.by_context = sorted(self.by_id.values(), key=lambda m: m.context_length)
+        self.context_keys = [m.context_length for m in self.by_context]
+        self.free = frozenset(m.id for m in self.by_id.values() if m.free)
+        self.json_mode = frozenset(m.id for m in self.by_id.values() if m.json_mode)
+
+
+class ModelCatalog:
+    """OpenRouter's model list, fetched once and kept on disk.
+
+    The disk copy is revalidated with `If-None-Match` once it is older than
+    `ttl` (a 304 costs no body), and `start()` refreshes it on a background
+    thread, so requests only ever read the in-memory indexes. Lookups before
+    the first successful fetch report unknown models, and callers fall back
+    to their defaults.
+    """
+
+    def __init__(self, url: str, cache_path: Optional[str] = None, ttl: float = 6 * 3600,
+                 client: Optional[httpx.Client] = None, timeout: float = 10.0):
+        self.url = url
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.client = client
+        self.timeout = timeout
+        self.etag: Optional[str] = None
+        self.fetched_at = 0.0
+        self._index = _Index(())
+        self._raw: List[Dict[str, Any]] = []
+        self._loaded = False
+        self._refresh_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._ensure_loaded().by_id)
+
+    @property
+    def fresh(self) -> bool:
+        return bool(self._ensure_loaded().by_id) and time.time() - self.fetched_at < self.ttl
+
+    def _ensure_loaded(self) -> _Index:
+        if not self._loaded:
+            self._loaded = True
+            self._load_disk()
+        return self._index
+
+    def _install(self, raw: List[Dict[str, Any]]):
+        models = []
+        for data in raw:
+            try:
+                models.append(ModelInfo.from_api(data))
+            except (KeyError, TypeError, ValueError):
+                continue
+        self._raw = raw
+        self._index = _Index(models)
+
+    def _load_disk(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable model catalog cache {self.cache_path}: {e}")
+            return
+        self.etag = data.get("etag")
+        self.fetched_at = data.get("fetched_at", 0.0)
+        self._install(data.get("models", []))
+
+    def _save_disk(self):
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".catalog-", suffix=".json")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"etag": self.etag, "fetched_at": self.fetched_at, "models": self._raw}, f)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"Failed to write model catalog cache: {e}")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def refresh(self, force: bool = False) -> bool:
+        """Revalidate if stale (or `force`); returns True if the list changed."""
+        self._ensure_loaded()
+        with self._refresh_lock:
+            if self.fresh and not force:
+                return False
+            headers = {"If-None-Match": self.etag} if self.etag and self._index.by_id else {}
+            try:
+                if self.client is not None:
+                    response = self.client.get(self.url, headers=headers, timeout=self.timeout)
+                else:
+                    response = httpx.get(self.url, headers=headers, timeout=self.timeout)
+            except httpx.HTTPError as e:
+                print(f"Model catalog refresh failed: {e}")
+                return False
+
+            if response.status_code == 304:
+                # Unchanged: only the revalidation time moves
+                self.fetched_at = time.time()
+                self._save_disk()
+                return False
+            if response.status_code != 200:
+                print(f"Model catalog refresh failed: HTTP {response.status_code}")
+                return False
+            raw = response.json().get("data", [])
+            self.etag = response.headers.get("ETag")
+            self.fetched_at = time.time()
+            self._install(raw)
+            self._save_disk()
+            return True
+
+    def start(self, interval: float = 3600.0):
+        """Refresh now and then every `interval` seconds on a daemon thread."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while True:
+                self.refresh()
+                if self._stop.wait(interval):
+                    return
+
+        self._thread = threading.Thread(target=loop, name="model-catalog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self, model_id: str) -> Optional[ModelInfo]:
+        return self._ensure_loaded().by_id.get(model_id)
+
+    def query(self, min_context: int = 0, free: Optional[bool] = None, json_mode: Optional[bool] = None,
+              max_price: Optional[float] = None, limit: Optional[int] = None) -> List[ModelInfo]:
+        """Matching models, cheapest first (larger context breaks ties)."""
+        index = self._ensure_loaded()
+        large_enough = None
+        if min_context:
+            start = bisect.bisect_left(index.context_keys, min_context)
+            large_enough = {m.id for m in index.by_context[start:]}
+        matches = []
+        for model in index.by_price:
+            if large_enough is not None and model.id not in large_enough:
+                continue
+            if free is not None and (model.id in index.free) != free:
+                continue
+            if json_mode is not None and (model.id in index.json_mode) != json_mode:
+                continue
+            if max_price is not None and model.prompt_price + model.completion_price > max_price:
+                continue
+            matches.append(model)
+            if limit is not None and len(matches) >= limit:
+                break
+        return matches
+
+    def ids(self, **filters: Any) -> List[str]:
+        """Model ids for pickers; the defaults until the first fetch."""
+        if not self._ensure_loaded().by_id:
+            return list(DEFAULT_MODELS)
+        return [m.id for m in self.query(**filters)]
+
+    def fits(self, model_id: str, tokens: int) -> bool:
+        """Whether `tokens` fit the model's context window (unknown models are given the benefit of the doubt)."""
+        model = self.get(model_id)
+        return model is None or not model.context_length or model.context_length >= tokens
+
+    def supports_json(self, model_id: str) -> Optional[bool]:
+        model = self.get(model_id)
+        return None if model is None else model.json_mode
+
+    def select(self, preferred: List[str], tokens: int = 0, json_mode: bool = False,
+               limit: int = 4) -> List[str]:
+        """Candidate models for a request needing `tokens` of context.
+
+        Preferred models come first, minus any the catalog knows are gone or
+        too small; free catalog models that fit (JSON-capable first when
+        asked) fill up the list. With no catalog yet, `preferred` is returned.
+        """
+        index = self._ensure_loaded()
+        if not index.by_id:
+            return list(preferred)
+        chosen = [m for m in dict.fromkeys(preferred) if m in index.by_id and self.fits(m, tokens)]
+        extras = self.query(min_context=tokens, free=True)
+        if json_mode:
+            extras.sort(key=lambda m: not m.json_mode)
+        for model in extras:
+            if len(chosen) >= limit:
+                break
+            if model.id not in chosen:
+                chosen.append(model.id)
+        return chosen or list(preferred)
+
+    def stats(self) -> Dict[str, Any]:
+        index = self._ensure_loaded()
+        return {"models": len(index.by_id), "free": len(index.free), "json_mode": len(index.json_mode),
+                "fetched_at": self.fetched_at, "fresh": self.fresh, "etag": self.etag}
+
+
+_catalog: Optional[ModelCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> ModelCatalog:
+    """Process-wide catalog configured from settings."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            from config import settings
+            _catalog = ModelCatalog(
+                f"{settings.openrouter_base_url.rstrip('/')}/models",
+                cache_path=settings.model_catalog_path,
+                ttl=settings.model_catalog_ttl,
+            )
+        return _catalog
@@ -1,13 +1,51 @@
+import importlib
+import threading
 from common.constants import LLMStrategyType
-from llm.provider import LLMProvider, OpenRouterLLM, MockLLM
+from typing import Dict, Optional, Tuple
+from llm.base import LLMProvider
+from llm.cache import with_cache
+from llm.scheduler import PRIORITY_INTERACTIVE, ScheduledLLM, get_scheduler, key_id
 
-def get_llm(strategy: LLMStrategyType) -> LLMProvider:
+# Providers are imported on first use: the OpenRouter client pulls in
+# httpx, requests and the router, which the mock strategy never needs
+PROVIDERS: Dict[LLMStrategyType, Tuple[str, str]] = {
+    LLMStrategyType.OPENROUTER: ("llm.provider", "OpenRouterLLM"),
+    LLMStrategyType.MOCK: ("llm.base", "MockLLM"),
+}
+
+def provider_class(strategy: LLMStrategyType) -> type:
     if isinstance(strategy, str):
         strategy = LLMStrategyType(strategy)
-        
-    if strategy == LLMStrategyType.OPENROUTER:
-        return OpenRouterLLM()
-    elif strategy == LLMStrategyType.MOCK:
-        return MockLLM()
-    else:
-        raise ValueError(f"Unknown LLM strategy: {strategy}")
+    try:
+        module, name = PROVIDERS[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown LLM strategy: {strategy}") from None
+    return getattr(importlib.import_module(module), name)
+
+def get_llm(strategy: LLMStrategyType, cache: Optional[bool] = None) -> LLMProvider:
+    """Build a provider; `cache` overrides settings.llm_cache_enabled."""
+    return with_cache(provider_class(strategy)(), cache)
+
+# Bounded LRU of providers built with the server key; a client's own key is
+# never kept here, so it lives only as long as the request that brought it
+MAX_SHARED_LLMS = 32
+_shared_llms: Dict[Tuple[str, int, bool], LLMProvider] = {}
+_shared_lock = threading.Lock()
+
+def get_shared_llm(model: str, api_key: Optional[str] = None,
+                   priority: int = PRIORITY_INTERACTIVE, json_mode: bool = False) -> LLMProvider:
+    """Scheduled, cache-wrapped OpenRouter provider; reused per model when built with the server key."""
+    from llm.provider import OpenRouterLLM
+    if api_key:
+        llm = OpenRouterLLM(model=model, api_key=api_key, json_mode=json_mode)
+        return with_cache(ScheduledLLM(llm, get_scheduler(), key_id(api_key), priority))
+    key = (model, priority, json_mode)
+    with _shared_lock:
+        llm = _shared_llms.pop(key, None)
+        if llm is None:
+            llm = with_cache(ScheduledLLM(OpenRouterLLM(model=model, json_mode=json_mode),
+                                          get_scheduler(), key_id(None), priority))
+            while len(_shared_llms) >= MAX_SHARED_LLMS:
+                _shared_llms.pop(next(iter(_shared_llms)))
+        _shared_llms[key] = llm  # most recently used last
+        return llm
@@ -0,0 +1,40 @@
+import asyncio
+from typing import Optional
+
+import httpx
+
+# One pooled client per process keeps TLS sessions to OpenRouter alive between requests
+POOL_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+DEFAULT_TIMEOUT = httpx.Timeout(45.0, connect=10.0)
+
+_async_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive client, creating it on first use.
+
+    The pool is bound to the running event loop, so a new one is made if the
+    loop changes (e.g. between `asyncio.run` calls in scripts and tests).
+    """
+    global _async_client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client.is_closed or _client_loop is not loop:
+        _async_client = httpx.AsyncClient(limits=POOL_LIMITS, timeout=DEFAULT_TIMEOUT)
+        _client_loop = loop
+    return _async_client
+
+
+def set_async_client(client: Optional[httpx.AsyncClient]):
+    """Install a preconfigured client (custom transport, proxies, tests)."""
+    global _async_client, _client_loop
+    _async_client = client
+    _client_loop = asyncio.get_running_loop() if client is not None else None
+
+
+async def close_async_client():
+    global _async_client, _client_loop
+    if _async_client is not None and not _async_client.is_closed:
+        await _async_client.aclose()
+    _async_client = None
+    _client_loop = None
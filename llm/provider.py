@@ -1,97 +1,363 @@
-from abc import ABC, abstractmethod
+import asyncio
+import json
 import os
-import requests
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List, AsyncIterator
 from common.constants import LLMStrategyType
-
-class LLMProvider(ABC):
-    @abstractmethod
-    def generate(self, prompt: str) -> str:
-        pass
+# The lightweight pieces live in llm.base so the mock path never loads httpx/requests
+from llm.base import LLMProvider, MockLLM
 
 from config import settings
+import httpx
+from llm.http import get_async_client
+from llm.router import ModelRouter, get_router, parse_retry_after
+from llm.catalog import get_catalog
+from story.context import estimate_tokens
+from common.metrics import BYTE_BUCKETS, counter, detached_span, histogram, span
 
 import time
 
+
+# Fallback models to try if the primary one fails
+FALLBACK_MODELS = [
+    "mistralai/mistral-7b-instruct:free",
+    "meta-llama/llama-3.2-3b-instruct:free",
+    "openrouter/auto"
+]
+
+RATE_LIMITED = object()
+
+# Context kept free for the generated act when checking that a prompt fits a model
+COMPLETION_RESERVE = 2048
+
+LLM_ATTEMPTS = counter("llm_attempts_total", "Upstream LLM attempts by model and HTTP status", ["model", "status"])
+LLM_ATTEMPT_SECONDS = histogram("llm_attempt_seconds", "Upstream LLM attempt latency", ["model", "status"])
+LLM_TTFB_SECONDS = histogram("llm_ttfb_seconds", "Time to the first streamed token", ["model"])
+LLM_RESPONSE_BYTES = histogram("llm_response_bytes", "Upstream response body size", ["model"], BYTE_BUCKETS)
+LLM_TOKENS = counter("llm_tokens_total", "Tokens reported by the upstream", ["model", "kind"])
+LLM_RETRIES = counter("llm_retries_total", "Repeat attempts on the same model", ["model"])
+LLM_FALLBACKS = counter("llm_fallbacks_total", "Requests that moved on to another model", ["model"])
+
+# Models that rejected `response_format`; they get plain prompts from then on
+JSON_MODE_UNSUPPORTED = set()
+
 class OpenRouterLLM(LLMProvider):
-    def __init__(self, model: str = "google/gemma-3-27b-it:free"):
-        self.api_key = os.getenv("OPENROUTER_API_KEY") or settings.openrouter_api_key
+    """OpenRouter chat completions with health-aware model routing.
+
+    Candidate models (the requested one plus FALLBACK_MODELS) are ordered by
+    the shared ModelRouter. A 429 trips that model's circuit for Retry-After
+    seconds and moves straight on to the next model; other errors are
+    retried up to `retries` times. With `hedge_after` set, `agenerate` also
+    starts the next-best model if the first has not answered in time and
+    returns whichever finishes first. `json_mode` asks for a JSON object via
+    `response_format` on models that accept it.
+    """
+
+    def __init__(self, model: str = "google/gemma-3-27b-it:free", retries: int = 2, backoff: float = 2.0,
+                 router: Optional[ModelRouter] = None, hedge_after: Optional[float] = None,
+                 max_wait: Optional[float] = None, api_key: Optional[str] = None, json_mode: bool = False):
+        # Per-request credentials win over the process-wide key
+        self.api_key = api_key or os.getenv("OPENROUTER_API_KEY") or settings.openrouter_api_key
         self.model = model
+        self.json_mode = json_mode
+        self.retries = retries
+        self.backoff = backoff
+        self.router = router or get_router()
+        self.hedge_after = hedge_after if hedge_after is not None else settings.router_hedge_after
+        self.max_wait = max_wait if max_wait is not None else settings.router_max_wait
+        # Overridable (OPENROUTER_BASE_URL) so benchmarks can point at a local stub
+        self.url = f"{settings.openrouter_base_url.rstrip('/')}/chat/completions"
         if not self.api_key:
             raise ValueError("OPENROUTER_API_KEY is not set in environment or config")
-            
-    def generate(self, prompt: str) -> str:
-        headers = {
+
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        data = {
-            "model": self.model,
+
+    def _payload(self, model: str, prompt: str, stream: bool = False) -> Dict[str, Any]:
+        payload = {
+            "model": model,
             "messages": [{"role": "user", "content": prompt}]
         }
-        
-        # Fallback models to try if the primary one fails
-        fallback_models = [
-            "mistralai/mistral-7b-instruct:free",
-            "meta-llama/llama-3.2-3b-instruct:free",
-            "openrouter/auto"
-        ]
-        
-        # Helper to try a specific model
-        def try_generate(params, retries=2):
-            for attempt in range(retries + 1):
+        if stream:
+            payload["stream"] = True
+        if self.json_mode and model not in JSON_MODE_UNSUPPORTED and get_catalog().supports_json(model) is not False:
+            payload["response_format"] = {"type": "json_object"}
+        return payload
+
+    def cache_params(self) -> Dict[str, Any]:
+        params = super().cache_params()
+        if self.json_mode:
+            params["json_mode"] = True
+        return params
+
+    def _json_mode_rejected(self, model: str, status: int, body: str) -> bool:
+        # Not a model failure: remember it and let the retry go out without it
+        if self.json_mode and status == 400 and "response_format" in body:
+            print(f"{model} does not support JSON mode; retrying without it.")
+            JSON_MODE_UNSUPPORTED.add(model)
+            return True
+        return False
+
+    def _candidate_models(self, prompt: str = "") -> List[str]:
+        # Primary model first, then fallbacks (skipping the primary if listed).
+        # The catalog drops models that are gone or too small for the prompt
+        # and tops up with free ones that fit, instead of learning it from a 400
+        preferred = [self.model] + [m for m in FALLBACK_MODELS if m != self.model]
+        tokens = estimate_tokens(prompt) + COMPLETION_RESERVE if prompt else 0
+        return get_catalog().select(preferred, tokens, self.json_mode)
+
+    def _error_wait(self) -> float:
+        return self.backoff / 2
+
+    def _routed_models(self, prompt: str = "") -> List[str]:
+        candidates = self._candidate_models(prompt)
+        models = self.router.order(candidates)
+        if models:
+            return models
+        # Every circuit is open: wait for the first one if that is short enough
+        wait_time = self.router.wait_time(candidates)
+        if wait_time > self.max_wait:
+            raise RuntimeError(f"All models are rate limited. Retry in {wait_time:.0f}s.")
+        return []
+
+    def _record(self, model: str, status: int, headers, latency: float):
+        LLM_ATTEMPTS.inc(model=model, status=status)
+        LLM_ATTEMPT_SECONDS.observe(latency, model=model, status=status)
+        if status == 200:
+            self.router.record_success(model, latency)
+        elif status == 429:
+            print(f"Rate limit ({model}).")
+            self.router.record_rate_limit(model, parse_retry_after(headers.get("Retry-After")))
+        else:
+            self.router.record_failure(model)
+
+    def _failed(self, model: str, attempt_span, error: Exception):
+        print(f"Exception for {model}: {error}")
+        LLM_ATTEMPTS.inc(model=model, status="error")
+        attempt_span.set(status="error", error=type(error).__name__)
+        self.router.record_failure(model)
+
+    def _content(self, model: str, response, attempt_span) -> str:
+        data = response.json()
+        usage = data.get("usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.inc(usage[kind], model=model, kind=kind.split("_")[0])
+        LLM_RESPONSE_BYTES.observe(len(response.content), model=model)
+        attempt_span.set(bytes=len(response.content), tokens=usage.get("completion_tokens"))
+        return data["choices"][0]["message"]["content"]
+
+    def _attempt(self, model: str, prompt: str, attempt: int = 0):
+        with span("llm_attempt", model=model, attempt=attempt) as attempt_span:
+            start = time.monotonic()
+            try:
+                import requests  # only the sync path needs it; deferred to keep startup fast
+                response = requests.post(
+                    self.url,
+                    headers=self._headers(),
+                    json=self._payload(model, prompt),
+                    timeout=45
+                )
+            except Exception as e:
+                self._failed(model, attempt_span, e)
+                return None
+            attempt_span.set(status=response.status_code)
+            if self._json_mode_rejected(model, response.status_code, response.text):
+                return None
+            self._record(model, response.status_code, response.headers, time.monotonic() - start)
+            if response.status_code == 429:
+                return RATE_LIMITED
+            if response.status_code != 200:
+                print(f"Error {response.status_code} for {model}: {response.text}")
+                return None
+            return self._content(model, response, attempt_span)
+
+    def generate(self, prompt: str) -> str:
+        models = self._routed_models(prompt)
+        if not models:
+            time.sleep(self.router.wait_time(self._candidate_models(prompt)))
+            models = self._routed_models(prompt)
+
+        for hop, model in enumerate(models):
+            print(f"Generating with model: {model}")
+            if hop:
+                LLM_FALLBACKS.inc(model=model)
+            for attempt in range(self.retries + 1):
+                if not self.router.begin(model):
+                    break
+                if attempt:
+                    LLM_RETRIES.inc(model=model)
+                try:
+                    result = self._attempt(model, prompt, attempt)
+                finally:
+                    self.router.release(model)
+                if isinstance(result, str) and result:
+                    return result
+                if result is RATE_LIMITED:
+                    break # Signal to try next model
+                if attempt < self.retries:
+                    time.sleep(self._error_wait())
+
+        raise RuntimeError(f"All models failed. Please try again later.")
+
+    async def _aattempt(self, model: str, prompt: str, attempt: int = 0):
+        # Same policy as `_attempt`, on the shared keep-alive pool
+        client = get_async_client()
+        with span("llm_attempt", model=model, attempt=attempt) as attempt_span:
+            start = time.monotonic()
+            try:
+                response = await client.post(self.url, headers=self._headers(), json=self._payload(model, prompt))
+            except Exception as e:
+                self._failed(model, attempt_span, e)
+                return None
+            attempt_span.set(status=response.status_code)
+            if self._json_mode_rejected(model, response.status_code, response.text):
+                return None
+            self._record(model, response.status_code, response.headers, time.monotonic() - start)
+            if response.status_code == 429:
+                return RATE_LIMITED
+            if response.status_code != 200:
+                print(f"Error {response.status_code} for {model}: {response.text}")
+                return None
+            return self._content(model, response, attempt_span)
+
+    async def _agenerate_with(self, models: List[str], prompt: str) -> str:
+        for hop, model in enumerate(models):
+            print(f"Generating with model: {model}")
+            if hop:
+                LLM_FALLBACKS.inc(model=model)
+            for attempt in range(self.retries + 1):
+                if not self.router.begin(model):
+                    break
+                if attempt:
+                    LLM_RETRIES.inc(model=model)
+                try:
+                    result = await self._aattempt(model, prompt, attempt)
+                finally:
+                    # Also on cancellation, e.g. the losing side of a hedge
+                    self.router.release(model)
+                if isinstance(result, str) and result:
+                    return result
+                if result is RATE_LIMITED:
+                    break
+                if attempt < self.retries:
+                    await asyncio.sleep(self._error_wait())
+
+        raise RuntimeError(f"All models failed. Please try again later.")
+
+    async def agenerate(self, prompt: str) -> str:
+        models = self._routed_models(prompt)
+        if not models:
+            await asyncio.sleep(self.router.wait_time(self._candidate_models(prompt)))
+            models = self._routed_models(prompt)
+        if self.hedge_after is None or len(models) < 2:
+            return await self._agenerate_with(models, prompt)
+        return await self._hedged(models, prompt)
+
+    async def _hedged(self, models: List[str], prompt: str) -> str:
+        primary = asyncio.create_task(self._agenerate_with(models[:1] + models[2:], prompt))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+
+        print(f"No answer from {models[0]} after {self.hedge_after}s. Hedging with {models[1]}")
+        hedge = asyncio.create_task(self._agenerate_with(models[1:2], prompt))
+        pending = {primary, hedge}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        # Fallbacks only apply until the first token is sent;
+        # after that a broken stream is surfaced to the caller
+        client = get_async_client()
+        headers = self._headers()
+        models = self._routed_models(prompt)
+        if not models:
+            await asyncio.sleep(self.router.wait_time(self._candidate_models(prompt)))
+            models = self._routed_models(prompt)
+
+        for hop, model in enumerate(models):
+            print(f"Streaming with model: {model}")
+            if hop:
+                LLM_FALLBACKS.inc(model=model)
+            params = self._payload(model, prompt, stream=True)
+            for attempt in range(self.retries + 1):
+                if not self.router.begin(model):
+                    break
+                if attempt:
+                    LLM_RETRIES.inc(model=model)
+                attempt_span = detached_span("llm_stream", model=model, attempt=attempt)
+                start = time.monotonic()
+                started = False
+                received = 0
                 try:
-                    response = requests.post(
-                        "https://openrouter.ai/api/v1/chat/completions",
-                        headers=headers,
-                        json=params,
-                        timeout=45
-                    )
-                    
-                    if response.status_code == 429:
-                        if attempt < retries:
-                            wait_time = (attempt + 1) * 2
-                            print(f"Rate limit ({params['model']}). Retrying in {wait_time}s...")
-                            time.sleep(wait_time)
+                    async with client.stream("POST", self.url, headers=headers, json=params) as response:
+                        attempt_span.set(status=response.status_code)
+                        if response.status_code == 200:
+                            async for line in response.aiter_lines():
+                                received += len(line) + 1
+                                token = parse_sse_line(line)
+                                if token is None:
+                                    break
+                                if token:
+                                    if not started:
+                                        LLM_TTFB_SECONDS.observe(time.monotonic() - start, model=model)
+                                        attempt_span.set(ttfb_ms=round((time.monotonic() - start) * 1000, 3))
+                                    started = True
+                                    yield token
+                            self._record(model, 200, response.headers, time.monotonic() - start)
+                            LLM_RESPONSE_BYTES.observe(received, model=model)
+                            attempt_span.set(bytes=received)
+                            return
+                        body = (await response.aread()).decode(errors="replace")
+                        if self._json_mode_rejected(model, response.status_code, body):
+                            params = self._payload(model, prompt, stream=True)
                             continue
-                        else:
-                            print(f"Rate limit exhausted for {params['model']}.")
-                            return None # Signal to try next model
-
-                    if response.status_code != 200:
-                        print(f"Error {response.status_code} for {params['model']}: {response.text}")
-                        if attempt < retries:
-                             time.sleep(1)
-                             continue
-                        return None
-                        
-                    return response.json()["choices"][0]["message"]["content"]
-                    
-                except Exception as e:
-                    print(f"Exception for {params['model']}: {e}")
-                    if attempt < retries:
-                        time.sleep(1)
-                    else:
-                        return None
-            return None
-
-        # 1. Try Primary Model
-        print(f"Generating with primary model: {self.model}")
-        result = try_generate({**data, "model": self.model})
-        if result:
-            return result
-            
-        # 2. Try Fallbacks
-        for fallback in fallback_models:
-            if fallback == self.model: continue # Skip if it was the primary
-            
-            print(f"Primary failed. Switching to fallback: {fallback}")
-            result = try_generate({**data, "model": fallback})
-            if result:
-                return result
-        
+                        print(f"Error {response.status_code} for {model}: {body}")
+                        self._record(model, response.status_code, response.headers, time.monotonic() - start)
+                        if response.status_code == 429:
+                            break
+                except httpx.TransportError as e:
+                    LLM_ATTEMPTS.inc(model=model, status="error")
+                    attempt_span.set(status="error", error=type(e).__name__)
+                    self.router.record_failure(model)
+                    if started:
+                        raise
+                    print(f"Exception for {model}: {e}")
+                finally:
+                    # Also when the consumer abandons the stream mid-way
+                    self.router.release(model)
+                    attempt_span.finish()
+                if attempt < self.retries:
+                    await asyncio.sleep(self._error_wait())
+
         raise RuntimeError(f"All models failed. Please try again later.")
 
-class MockLLM(LLMProvider):
-    def generate(self, prompt: str) -> str:
-        return "This is a mock response from the LLM for testing purposes."
+def parse_sse_line(line: str) -> Optional[str]:
+    """Extract the content delta from one OpenAI-style SSE line.
+
+    Returns "" for keep-alives/comments and None once the stream is done.
+    """
+    if not line.startswith("data:"):
+        return ""
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return None
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        return ""
+    choices = chunk.get("choices") or [{}]
+    return (choices[0].get("delta") or {}).get("content") or ""
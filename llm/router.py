@@ -0,0 +1,228 @@
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Any, Deque, Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+def parse_retry_after(value: Optional[str], now: Optional[float] = None) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(when - (now if now is not None else time.time()), 0.0)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+class ModelHealth:
+    """Rolling health of one model plus its circuit-breaker state.
+
+    The circuit opens after `failure_threshold` consecutive failures or any
+    429, stays open for `cooldown` seconds (or the Retry-After the upstream
+    asked for), then lets a single half-open probe through; success closes it.
+    """
+
+    def __init__(self, model: str, window: int = 50, failure_threshold: int = 3, cooldown: float = 30.0):
+        self.model = model
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.outcomes: Deque[bool] = deque(maxlen=window)
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.rate_limits: Deque[float] = deque(maxlen=window)
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.probe_in_flight = False
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        if not self.outcomes:
+            return None
+        return sum(self.outcomes) / len(self.outcomes)
+
+    @property
+    def p50(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 50)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return _percentile(list(self.latencies), 95)
+
+    def recent_rate_limits(self, now: float, horizon: float = 60.0) -> int:
+        return sum(1 for t in self.rate_limits if now - t <= horizon)
+
+    def available(self, now: float) -> bool:
+        if self.state == CLOSED:
+            return True
+        if now < self.open_until:
+            return False
+        # Cooldown over: allow exactly one probe at a time
+        return not self.probe_in_flight
+
+    def begin(self, now: float) -> bool:
+        if not self.available(now):
+            return False
+        if self.state != CLOSED:
+            self.state = HALF_OPEN
+            self.probe_in_flight = True
+        return True
+
+    def record_success(self, latency: float):
+        self.outcomes.append(True)
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.probe_in_flight = False
+
+    def record_failure(self, now: float):
+        self.outcomes.append(False)
+        self.consecutive_failures += 1
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open(now, self.cooldown)
+        self.probe_in_flight = False
+
+    def record_rate_limit(self, now: float, retry_after: Optional[float]):
+        self.outcomes.append(False)
+        self.rate_limits.append(now)
+        self._open(now, retry_after if retry_after is not None else self.cooldown)
+        self.probe_in_flight = False
+
+    def release(self):
+        # The attempt ended without an outcome (cancelled, abandoned, or not
+        # the model's fault): free the probe slot, the state stays as it was
+        self.probe_in_flight = False
+
+    def _open(self, now: float, duration: float):
+        self.state = OPEN
+        self.open_until = max(self.open_until, now + duration)
+
+    def wait_time(self, now: float) -> float:
+        return 0.0 if self.available(now) else max(self.open_until - now, 0.0)
+
+    def score(self) -> Optional[float]:
+        # Expected seconds per successful answer; lower is better
+        if self.p50 is None:
+            return None
+        return self.p50 / max(self.success_rate or 0.0, 0.1)
+
+    def snapshot(self, now: float) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "success_rate": self.success_rate,
+            "p50": self.p50,
+            "p95": self.p95,
+            "recent_429s": self.recent_rate_limits(now),
+            "retry_in": round(self.wait_time(now), 3),
+            "samples": len(self.outcomes),
+        }
+
+
+class ModelRouter:
+    """Orders candidate models by observed health instead of a fixed list.
+
+    With `adaptive` on, healthy models are tried fastest-first (by p50 over
+    success rate); models without samples keep their configured position.
+    Models whose circuit is open are skipped until their cooldown ends.
+    """
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, cooldown: float = 30.0,
+                 adaptive: bool = True, clock=time.monotonic):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.adaptive = adaptive
+        self.clock = clock
+        self._models: Dict[str, ModelHealth] = {}
+        self._lock = threading.Lock()
+
+    def health(self, model: str) -> ModelHealth:
+        with self._lock:
+            if model not in self._models:
+                self._models[model] = ModelHealth(model, self.window, self.failure_threshold, self.cooldown)
+            return self._models[model]
+
+    def order(self, candidates: List[str]) -> List[str]:
+        now = self.clock()
+        healthy = [m for m in candidates if self.health(m).available(now)]
+        if not self.adaptive:
+            return healthy
+        with self._lock:
+            scores = [self._models[m].score() for m in healthy]
+        known = sorted(s for s in scores if s is not None)
+        # Unmeasured models rank like a median model so they still get tried
+        neutral = known[len(known) // 2] if known else 0.0
+        ranked = sorted(zip(healthy, scores), key=lambda item: neutral if item[1] is None else item[1])
+        return [m for m, _ in ranked]
+
+    def wait_time(self, candidates: List[str]) -> float:
+        """Seconds until the first of `candidates` can be tried again."""
+        now = self.clock()
+        return min((self.health(m).wait_time(now) for m in candidates), default=0.0)
+
+    def begin(self, model: str) -> bool:
+        health = self.health(model)
+        with self._lock:
+            return health.begin(self.clock())
+
+    def release(self, model: str):
+        """Call when an attempt started with `begin` is over, whatever happened;
+        a half-open model otherwise keeps waiting for a probe that never reports."""
+        health = self.health(model)
+        with self._lock:
+            health.release()
+
+    def record_success(self, model: str, latency: float):
+        health = self.health(model)
+        with self._lock:
+            health.record_success(latency)
+
+    def record_failure(self, model: str):
+        health = self.health(model)
+        with self._lock:
+            health.record_failure(self.clock())
+
+    def record_rate_limit(self, model: str, retry_after: Optional[float] = None):
+        health = self.health(model)
+        with self._lock:
+            health.record_rate_limit(self.clock(), retry_after)
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        now = self.clock()
+        with self._lock:
+            return {model: health.snapshot(now) for model, health in self._models.items()}
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """Process-wide router shared by every OpenRouter provider."""
+    global _router
+    with _router_lock:
+        if _router is None:
+            from config import settings
+            _router = ModelRouter(
+                failure_threshold=settings.router_failure_threshold,
+                cooldown=settings.router_cooldown,
+                adaptive=settings.router_adaptive,
+            )
+        return _router
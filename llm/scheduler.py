@@ -0,0 +1,270 @@
+import asyncio
+import hashlib
+import heapq
+import itertools
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from common.metrics import detached_span, histogram
+from common.shared import SharedState, get_shared_state
+from llm.base import LLMProvider
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_PREFETCH = 1
+PRIORITY_BATCH = 2
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_PREFETCH: "prefetch", PRIORITY_BATCH: "batch"}
+
+QUEUE_WAIT_SECONDS = histogram("scheduler_wait_seconds", "Time from enqueue to upstream slot", ["priority"])
+
+
+class QueueFullError(Exception):
+    """Raised instead of queueing when the scheduler is saturated."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Generation queue is full. Retry in {retry_after:.0f}s.")
+        self.retry_after = retry_after
+
+
+def key_id(api_key: Optional[str]) -> str:
+    """Stable, non-reversible label for an API key (never store the key itself)."""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode()).hexdigest()[:12]
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """Take one token, returning how long the caller must wait for it."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def full(self, now: float) -> bool:
+        """Refilled to capacity: indistinguishable from a fresh bucket."""
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+def shared_bucket_wait(shared: SharedState, name: str, rate: float, capacity: float) -> float:
+    """`TokenBucket.reserve` on a bucket kept in the shared state, so the
+    rate applies to all workers together. Uses wall-clock time, which
+    (unlike monotonic clocks) is comparable across processes."""
+    key = f"bucket:{name}"
+    with shared.lock(key, ttl=5.0, timeout=5.0):
+        now = time.time()
+        bucket = TokenBucket(rate, capacity, now)
+        raw = shared.get(key)
+        if raw is not None:
+            tokens, updated = raw.split(":")
+            bucket.tokens, bucket.updated = float(tokens), float(updated)
+        wait = bucket.reserve(now)
+        # An idle bucket refills completely; let it expire then
+        shared.set(key, f"{bucket.tokens}:{bucket.updated}", ttl=capacity / rate + wait + 1.0)
+    return wait
+
+
+class RequestScheduler:
+    """Admission control in front of upstream LLM calls.
+
+    At most `max_concurrency` calls run at once; the rest wait in a bounded
+    priority queue (interactive before prefetch before batch). Within a
+    priority, keys are served by start-time fair queuing, so one API key
+    flooding the queue cannot starve the others. Each (key, model) pair also
+    has a token bucket (`rate` per second, `burst` deep) so bursts are
+    smoothed here instead of turning into upstream 429s; a call waits for its
+    token before it queues, so it never holds a slot while rate limited. With `shared`, the
+    buckets live in the shared state and limit all workers combined.
+    """
+
+    def __init__(self, max_concurrency: int = 8, max_queue: int = 64, rate: float = 2.0,
+                 burst: float = 5.0, clock=time.monotonic, shared: Optional[SharedState] = None):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.shared = shared
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._heap: List[Tuple[int, float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._virtual_time = 0.0
+        self._key_finish: Dict[str, float] = {}
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._bucket_sweep_at = 64
+        self._waits: Deque[float] = deque(maxlen=500)
+        self._queued_by_priority: Dict[int, int] = defaultdict(int)
+        self.rejected = 0
+        self.completed = 0
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._heap = []
+            self._running = 0
+            self._queued_by_priority = defaultdict(int)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(1 for *_, fut in self._heap if not fut.done())
+
+    def retry_hint(self) -> float:
+        # Rough time for the current backlog to drain
+        waits = sorted(self._waits)
+        typical = waits[len(waits) // 2] if waits else 1.0
+        return max(1.0, typical * (self.queue_depth / max(self.max_concurrency, 1) + 1))
+
+    def _advance(self, virtual_time: float):
+        if virtual_time > self._virtual_time:
+            self._virtual_time = virtual_time
+            # Keys whose tags are already passed start from the virtual time anyway
+            self._key_finish = {k: f for k, f in self._key_finish.items() if f > virtual_time}
+
+    def _dispatch(self):
+        while self._heap and self._running < self.max_concurrency:
+            priority, finish, _, future = heapq.heappop(self._heap)
+            self._queued_by_priority[priority] -= 1
+            if future.done():  # cancelled while waiting
+                continue
+            self._advance(finish)
+            self._running += 1
+            future.set_result(None)
+
+    def _bucket_wait(self, key: str, model: str) -> float:
+        now = self.clock()
+        bucket = self._buckets.get((key, model))
+        if bucket is None:
+            if len(self._buckets) >= self._bucket_sweep_at:
+                # Callers bring their own keys: drop refilled buckets, amortised over new ones
+                self._buckets = {k: b for k, b in self._buckets.items() if not b.full(now)}
+                self._bucket_sweep_at = max(64, 2 * len(self._buckets))
+            bucket = self._buckets[(key, model)] = TokenBucket(self.rate, self.burst, now)
+        return bucket.reserve(now)
+
+    @asynccontextmanager
+    async def slot(self, key: str = "default", model: str = "", priority: int = PRIORITY_INTERACTIVE):
+        """Hold one upstream slot for the duration of the block."""
+        self._bind_loop()
+        if self._running >= self.max_concurrency and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError(self.retry_hint())
+
+        enqueued = self.clock()
+        queue_span = detached_span("queue", priority=PRIORITY_NAMES.get(priority, str(priority)))
+        try:
+            # Rate limit first: a key waiting for tokens must not hold a slot others could use
+            if self.shared is None:
+                wait = self._bucket_wait(key, model)
+            else:
+                wait = await asyncio.to_thread(shared_bucket_wait, self.shared, f"{key}:{model}",
+                                               self.rate, self.burst)
+            if wait > 0:
+                await asyncio.sleep(wait)
+        except BaseException:
+            queue_span.finish()
+            raise
+
+        start = max(self._virtual_time, self._key_finish.get(key, 0.0))
+        self._key_finish[key] = start + 1
+        future = self._loop.create_future()
+        heapq.heappush(self._heap, (priority, start, next(self._seq), future))
+        self._queued_by_priority[priority] += 1
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            queue_span.finish()
+            if future.done() and not future.cancelled():
+                # Granted just as we were cancelled: hand the slot on
+                self._running -= 1
+                self._dispatch()
+            raise
+
+        try:
+            self._waits.append(self.clock() - enqueued)
+            QUEUE_WAIT_SECONDS.observe(self._waits[-1], priority=PRIORITY_NAMES.get(priority, str(priority)))
+            queue_span.finish()
+            yield
+        finally:
+            self._running -= 1
+            self.completed += 1
+            self._dispatch()
+            if not self._running and not self._heap:
+                # Idle: nobody is owed a turn, so every key's tag is forgotten
+                self._advance(max(self._key_finish.values(), default=0.0))
+
+    def stats(self) -> Dict[str, Any]:
+        waits = sorted(self._waits)
+        return {
+            "running": self._running,
+            "queue_depth": self.queue_depth,
+            "queued": {PRIORITY_NAMES.get(p, str(p)): n for p, n in self._queued_by_priority.items() if n > 0},
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "wait_p50": waits[len(waits) // 2] if waits else 0.0,
+            "wait_p95": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "rejected": self.rejected,
+            "completed": self.completed,
+        }
+
+
+class ScheduledLLM(LLMProvider):
+    """Routes a provider's async calls through a RequestScheduler."""
+
+    def __init__(self, llm: LLMProvider, scheduler: RequestScheduler, key: str = "default",
+                 priority: int = PRIORITY_INTERACTIVE):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.key = key
+        self.priority = priority
+
+    def __getattr__(self, name):
+        if name == "llm":
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    def cache_params(self) -> Dict[str, Any]:
+        return self.llm.cache_params()
+
+    def generate(self, prompt: str) -> str:
+        # Synchronous callers (CLI, Streamlit) run outside the event loop
+        return self.llm.generate(prompt)
+
+    async def agenerate(self, prompt: str) -> str:
+        async with self.scheduler.slot(self.key, getattr(self.llm, "model", ""), self.priority):
+            return await self.llm.agenerate(prompt)
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        async with self.scheduler.slot(self.key, getattr(self.llm, "model", ""), self.priority):
+            async for token in self.llm.astream(prompt):
+                yield token
+
+
+_scheduler: Optional[RequestScheduler] = None
+
+
+def get_scheduler() -> RequestScheduler:
+    """Process-wide scheduler configured from settings."""
+    global _scheduler
+    if _scheduler is None:
+        from config import settings
+        _scheduler = RequestScheduler(
+            max_concurrency=settings.scheduler_max_concurrency,
+            max_queue=settings.scheduler_max_queue,
+            rate=settings.scheduler_rate,
+            burst=settings.scheduler_burst,
+            shared=get_shared_state() if settings.shared_state_url else None,
+        )
+    return _scheduler
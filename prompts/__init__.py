@@ -1,69 +1,103 @@
-from typing import Dict, Any
+from functools import lru_cache
+from string import Template
+from textwrap import dedent
+from typing import Dict, Any, Tuple
+from story.context import estimate_tokens
+from common.metrics import timed
+from common.types import Character
+
+# Templates are dedented once at import. The world/cast/format block only
+# depends on the world, so it is rendered once per world and placed first:
+# every act for that world then shares a byte-identical prefix, which
+# providers with prompt caching can reuse.
+STATIC_TEMPLATE = Template(dedent("""
+    **The World:**
+    $world
+    Governance: $governance
+
+    **The Characters/Factions:**
+    $characters
+
+    **Instructions:**
+    Write a compelling narrative that explores the conflict between efficiency and ethics.
+    The story should be set in this futuristic world.
+
+    **IMPORTANT: FORMATTING**
+    At the end of your story, you MUST provide:
+    1. An image generation prompt that describes the key scene of this chapter visually.
+    2. A "State Update" for the player's RPG stats:
+        - **dharma**: An integer from -100 (Adharma/Chaos) to +100 (Dharma/Order). Based on the user's last choice.
+        - **karma**: An integer representing accumulated consequences (starts at 0).
+        - **inventory**: A list of items/abilities the player currently has (e.g. "Data-Astra", "Royal Signet").
+    3. 3 distinct choices for the reader to decide what happens next.
+
+    These must be formatted as a JSON block at the very end of your response.
+
+    Example format:
+    ```json
+    {
+        "image_prompt": "A cybernetic warrior standing on a neon-lit rooftop...",
+        "dharma": 10,
+        "karma": 5,
+        "inventory": ["Plasma Katana", "Council Access Code"],
+        "choices": [
+            "Choice 1: Rachel decides to shutdown the AI.",
+            "Choice 2: Rachel tries to negotiate with the Council.",
+            "Choice 3: Rachel flees the city to finding the resistance."
+        ]
+    }
+    ```
+    """))
+
+CONTEXT_TEMPLATE = Template(dedent("""
+    **PREVIOUS STORY CONTEXT:**
+    $previous_context
+
+    **INSTRUCTION:**
+    Continue the story from the above context.
+    """))
+
+MEMORY_TEMPLATE = Template(dedent("""
+    **RELEVANT EARLIER PASSAGES:**
+    $passages
+    """))
+
+ACT_TEMPLATE = Template(dedent("""
+    Write a story act titled "$name".
+    """))
+
+@lru_cache(maxsize=256)
+def static_prefix(world: str, governance: Tuple[str, ...], characters: Tuple[Character, ...]) -> str:
+    return STATIC_TEMPLATE.substitute(
+        world=world,
+        governance=", ".join(governance),
+        characters="\n".join(f"- {c.name}: {c.description}" for c in characters),
+    )
 
 class PromptBuilder:
+    @timed("prompt_build")
     def handle(self, context: Dict[str, Any]) -> Dict[str, Any]:
         spec = context["spec"]
-        
-        world_desc = spec.world_context.get("description", "")
-        governance = ", ".join(spec.world_context.get("governance", []))
-        
-        characters_str = "\n".join([f"- {c.name}: {c.description}" for c in spec.characters])
-        
+        prefix = static_prefix(
+            spec.world_context.get("description", ""),
+            tuple(spec.world_context.get("governance", ())),
+            tuple(spec.characters),
+        )
+
+        suffix = ""
+        passages = context.get("relevant_passages")
+        if passages:
+            # Retrieved per choice, so it belongs after the shared prefix
+            suffix += MEMORY_TEMPLATE.substitute(passages="\n\n".join(passages))
         previous_context = context.get("previous_context", "")
-        context_instruction = ""
         if previous_context:
-            context_instruction = f"""
-            **PREVIOUS STORY CONTEXT:**
-            {previous_context}
-            
-            **INSTRUCTION:**
-            Continue the story from the above context.
-            """
-
-        prompt = f"""
-        Write a story act titled "{spec.name}".
-        
-        **The World:**
-        {world_desc}
-        Governance: {governance}
-        
-        **The Characters/Factions:**
-        {characters_str}
-        
-        {context_instruction}
-        
-        **Instructions:**
-        Write a compelling narrative that explores the conflict between efficiency and ethics.
-        The story should be set in this futuristic world.
+            suffix += CONTEXT_TEMPLATE.substitute(previous_context=previous_context)
+        suffix += ACT_TEMPLATE.substitute(name=spec.name)
 
-        **IMPORTANT: FORMATTING**
-        At the end of your story, you MUST provide:
-        1. An image generation prompt that describes the key scene of this chapter visually.
-        2. A "State Update" for the player's RPG stats:
-            - **dharma**: An integer from -100 (Adharma/Chaos) to +100 (Dharma/Order). Based on the user's last choice.
-            - **karma**: An integer representing accumulated consequences (starts at 0).
-            - **inventory**: A list of items/abilities the player currently has (e.g. "Data-Astra", "Royal Signet").
-        3. 3 distinct choices for the reader to decide what happens next.
-        
-        These must be formatted as a JSON block at the very end of your response.
-        
-        Example format:
-        ```json
-        {{
-            "image_prompt": "A cybernetic warrior standing on a neon-lit rooftop...",
-            "dharma": 10,
-            "karma": 5,
-            "inventory": ["Plasma Katana", "Council Access Code"],
-            "choices": [
-                "Choice 1: Rachel decides to shutdown the AI.",
-                "Choice 2: Rachel tries to negotiate with the Council.",
-                "Choice 3: Rachel flees the city to finding the resistance."
-            ]
-        }}
-        ```
-        """
-        
+        prompt = prefix + suffix
+        context["prompt_prefix"] = prefix
         context["final_prompt"] = prompt
+        context["prompt_tokens"] = estimate_tokens(prompt)
         return context
 
 def build_prompt() -> PromptBuilder:
@@ -1,39 +1,78 @@
 import argparse
-from loguru import logger
-from config import settings
-from story.spec import build_act_specification
-from prompts import build_prompt
-from llm.factory import get_llm
-from dotenv import load_dotenv
+import json
+import sys
+from contextlib import nullcontext
 from common.constants import LLMStrategyType
-load_dotenv()
 
-from common.state import StateManager
-from story.exporter import StoryExporter
+# Everything else is imported inside main(), after argument parsing, so
+# `--help` and argument errors are instant and `--profile-startup` can
+# time the imports a real run needs.
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--llm", default=LLMStrategyType.OPENROUTER.value,
+                        choices=[s.value for s in LLMStrategyType])
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=None,
+                        help="Serve identical prompts from the response cache (default: LLM_CACHE_ENABLED)")
+    subparsers = parser.add_subparsers(dest="command")
+    batch = subparsers.add_parser("batch", help="Generate every job of a JSONL/YAML manifest")
+    batch.add_argument("manifest", help="Jobs file (.jsonl, .yaml or .yml)")
+    batch.add_argument("--output", help="Results JSONL (default: <manifest>.results.jsonl)")
+    batch.add_argument("--checkpoint", help="Completed job ids (default: <manifest>.checkpoint)")
+    batch.add_argument("--concurrency", type=int, default=4)
+    batch.add_argument("--executor", choices=["thread", "process"], default="thread")
+    jobs = subparsers.add_parser("jobs", help="Submit, follow or cancel a background job on the API (API_URL)")
+    jobs.add_argument("action", choices=["submit", "wait", "cancel"])
+    jobs.add_argument("target", help="Job kind to submit (generate, debate), else a job id")
+    jobs.add_argument("--params", default="{}", help="Request fields as a JSON object")
+    jobs.add_argument("--no-wait", action="store_true", help="Print the job id and return")
+    jobs.add_argument("--json", action="store_true", help="Print the final result as JSON instead of following")
+    jobs.add_argument("--api-url", help="API base URL (default: API_URL)")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Print an import-time breakdown of startup to stderr")
+    return parser.parse_args(argv)
 
 def main():
     """
     Main entry point for the Narrative Generation System.
     Parses command line arguments, builds the act specification,
     Generates the prompt, and queries the LLM to generate the story.
+    `run.py batch <manifest>` pre-generates many acts instead.
     """
-    logger.info("Starting Narrative Generation System")
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--llm", default=LLMStrategyType.OPENROUTER.value,
-                        choices=[s.value for s in LLMStrategyType])
-    args = parser.parse_args()
+    args = parse_args()
+    if args.command == "jobs":
+        # Only talks to the API; none of the generation pipeline is needed
+        run_jobs(args)
+        return
+    profiler = None
+    if args.profile_startup:
+        from common.startup import ImportProfiler
+        profiler = ImportProfiler()
 
+    with profiler or nullcontext():
+        # .env is read by Settings itself (config.py), so python-dotenv is not needed here
+        from loguru import logger
+        from story.spec import act_for, default_world_spec
+        from prompts import build_prompt
+        from llm.factory import get_llm
+        from common.state import StateManager
+        from story.exporter import StoryExporter
+        if args.command == "batch":
+            from story.batch import BatchRunner
+    if profiler:
+        print(profiler.report(), file=sys.stderr)
+
+    logger.info("Starting Narrative Generation System")
     logger.info(f"Using LLM strategy: {args.llm}")
+    if args.command == "batch":
+        run_batch(args)
+        return
     
-    spec = build_act_specification(
-        settings.characters,
-        settings.world,
-        act_name="Ethics in World of intelligent systems"
-    )
+    spec = act_for(default_world_spec(), "Ethics in World of intelligent systems")
 
     prompts = build_prompt()
     context = prompts.handle({"spec": spec})
-    llm = get_llm(args.llm)
+    llm = get_llm(args.llm, cache=args.cache)
     output = llm.generate(context["final_prompt"])
 
     print("\nETHICS IN THE WORLD OF INTELLIGENT SYSTEMS\n")
@@ -49,5 +88,58 @@ def main():
     if exported_path:
         logger.info(f"Story exported to: {exported_path}")
 
+def run_batch(args):
+    from loguru import logger
+    from story.batch import BatchRunner, Checkpoint, JsonlSink, load_manifest
+
+    jobs = load_manifest(args.manifest)
+    for job in jobs:
+        # Jobs without an explicit strategy follow --llm
+        job.llm = job.llm or args.llm
+    sink = JsonlSink(args.output or f"{args.manifest}.results.jsonl")
+    checkpoint = Checkpoint(args.checkpoint or f"{args.manifest}.checkpoint")
+    runner = BatchRunner(sink, checkpoint, concurrency=args.concurrency,
+                         executor=args.executor, cache=args.cache)
+    try:
+        summary = runner.run(jobs)
+    finally:
+        sink.close()
+
+    print(json.dumps(summary.to_dict(), indent=2))
+    logger.info(f"Batch finished: {summary.succeeded} ok, {summary.failed} failed, "
+                f"{summary.skipped} skipped, {summary.acts_per_minute:.1f} acts/min")
+
+def run_jobs(args):
+    from config import settings
+    from api.client import JobClient, JobError
+
+    url = args.api_url or settings.api_url
+    if not url:
+        sys.exit("No API URL: pass --api-url or set API_URL")
+    client = JobClient(url)
+    job_id = args.target
+    if args.action == "cancel":
+        print(json.dumps(client.cancel(job_id)))
+        return
+    if args.action == "submit":
+        job_id = client.submit(args.target, json.loads(args.params))
+        # A dropped connection loses nothing: `run.py jobs wait <id>` picks the job up again
+        print(f"Job {job_id} submitted", file=sys.stderr)
+        if args.no_wait:
+            print(job_id)
+            return
+
+    follow = None if args.json else (lambda text: print(text, end="", flush=True))
+    try:
+        result = client.wait(job_id, on_text=follow)
+    except JobError as e:
+        sys.exit(str(e))
+    if args.json:
+        print(json.dumps(result, indent=2))
+    elif "consensus" in result:
+        print(f"\nConsensus: {result['consensus']}")
+    elif result.get("state"):
+        print(f"\n{json.dumps(result['state'], indent=2)}")
+
 if __name__ == "__main__":
     main()
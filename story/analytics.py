@@ -0,0 +1,398 @@
+import json
+import math
+import os
+import tempfile
+import threading
+from collections import Counter
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from story.extraction import extract_act
+
+# Width of the dharma/karma histogram buckets in distributions
+BUCKET = 5
+# Footer scores are model output: an act's values are clamped to SCORE_LIMIT
+# and running totals to TOTAL_LIMIT, so nothing can overflow the columns
+SCORE_LIMIT = 10 ** 6
+TOTAL_LIMIT = 10 ** 12
+
+# One row per stored act; codes index the interned strings (-1: none)
+COLUMNS = {
+    "act": np.int32,
+    "session": np.int32,
+    "node": np.int32,
+    "parent": np.int32,
+    "choice": np.int32,
+    "dharma": np.int64,         # the act's own footer values
+    "karma": np.int64,
+    "total_dharma": np.int64,   # player standing after the act, along its branch
+    "total_karma": np.int64,
+    "inventory": np.int16,
+    "parsed": np.bool_,
+    "timestamp": np.float64,
+}
+# Per-node running aggregates over the node's subtree (its branch of the story)
+BRANCH_COLUMNS = ("acts", "dharma_sum", "dharma_sq", "karma_sum", "karma_sq")
+
+
+class Interner:
+    """Maps strings to dense int codes and back."""
+
+    def __init__(self, values: Iterable[str] = ()):
+        self.values: List[str] = list(values)
+        self.codes = {value: code for code, value in enumerate(self.values)}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def code(self, value: Optional[str]) -> int:
+        if value is None:
+            return -1
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def get(self, value: Optional[str]) -> int:
+        """The code of a known value, -1 otherwise (never adds)."""
+        return -1 if value is None else self.codes.get(value, -1)
+
+
+def _grow(array: np.ndarray, size: int, fill=0) -> np.ndarray:
+    if size <= len(array):
+        return array
+    grown = np.full(max(size, 2 * len(array), 64), fill, dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _clamp(value: int, limit: int) -> int:
+    return max(-limit, min(limit, int(value)))
+
+
+def _timestamp(value: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(value).timestamp() if value else 0.0
+    except ValueError:
+        return 0.0
+
+
+def distribution(values: np.ndarray) -> Dict[str, Any]:
+    """Count, mean, spread and a BUCKET-wide histogram of `values`."""
+    if not len(values):
+        return {"count": 0}
+    # Moments and buckets come from the distinct values and their counts, so
+    # memory follows the number of rows, never the spread of the values
+    distinct, counts = np.unique(values, return_counts=True)
+    n = len(values)
+    scores = distinct.astype(np.float64)
+    mean = float((scores * counts).sum()) / n
+    variance = float(((scores - mean) ** 2 * counts).sum()) / n
+    buckets, inverse = np.unique(distinct // BUCKET, return_inverse=True)
+    bucket_counts = np.bincount(inverse, weights=counts)
+    return {
+        "count": int(n),
+        "mean": round(mean, 3),
+        "std": round(math.sqrt(variance), 3),
+        "min": int(distinct[0]),
+        "max": int(distinct[-1]),
+        "histogram": {str(int(bucket) * BUCKET): int(count) for bucket, count in zip(buckets, bucket_counts)},
+    }
+
+
+def _moments(n: float, total: float, squares: float) -> Dict[str, Any]:
+    if not n:
+        return {"count": 0}
+    mean = total / n
+    return {"count": int(n), "mean": round(mean, 3), "std": round(math.sqrt(max(squares / n - mean * mean, 0.0)), 3)}
+
+
+class StoryAnalytics:
+    """Columnar per-act stats, built as acts are written.
+
+    Each stored entry becomes one row of numpy columns (act, session, node,
+    parent and choice as interned codes; footer dharma/karma/inventory; the
+    player's standing along the branch). The footer is parsed once, when
+    the entry is ingested. Choice popularity per node and per act, and
+    dharma/karma moments per branch (a node's whole subtree), are kept as
+    running aggregates; distributions are vectorised over the columns, so
+    queries stay in the milliseconds at millions of acts.
+
+    Rows follow the store's insertion order: `sync()` ingests whatever the
+    store gained since the last call, including other workers' writes. A
+    snapshot (`path`, .npz) saves re-parsing the history on restart.
+    """
+
+    def __init__(self, store, path: Optional[str] = None, snapshot_every: int = 1000):
+        self.store = store
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self._lock = threading.RLock()
+        self.rows = 0
+        self._cols = {name: np.zeros(64, dtype=dtype) for name, dtype in COLUMNS.items()}
+        self.acts, self.sessions, self.nodes, self.choices = Interner(), Interner(), Interner(), Interner()
+        # Per node code: parent node code, row of the node's act, subtree aggregates
+        self._node_parent = np.full(64, -1, dtype=np.int32)
+        self._node_row = np.full(64, -1, dtype=np.int64)
+        self._branch = {name: np.zeros(64, dtype=np.float64) for name in BRANCH_COLUMNS}
+        self.node_choices: Dict[int, Counter] = {}
+        self.act_choices: Dict[int, Counter] = {}
+        self._unsaved = 0
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def column(self, name: str) -> np.ndarray:
+        return self._cols[name][:self.rows]
+
+    # Ingestion
+
+    def sync(self) -> int:
+        """Ingest entries the store gained since the last sync; returns how many."""
+        with self._lock:
+            added = 0
+            for entry in self.store.iter_from(self.rows):
+                row = self.rows
+                try:
+                    self.add(entry)
+                except Exception as e:
+                    # Keep rows aligned with the store and move on: a bad entry
+                    # must not stop every later sync at the same place
+                    logger.error(f"Analytics skipped store entry {row}: {e}")
+                    if self.rows == row:
+                        self._add_blank()
+                added += 1
+            if self.path and self._unsaved >= self.snapshot_every:
+                self.save()
+            return added
+
+    def add(self, entry: Dict[str, Any]):
+        """Append one stored entry as a row and update the running aggregates."""
+        with self._lock:
+            _, state = extract_act(entry.get("content") or "")
+            row = self.rows
+            for name in COLUMNS:
+                self._cols[name] = _grow(self._cols[name], row + 1)
+            act = self.acts.code(entry.get("act"))
+            node = self.nodes.code(entry.get("node_id"))
+            parent = self.nodes.code(entry.get("parent_id"))
+            choice = self.choices.code(entry.get("choice"))
+
+            dharma = _clamp(state.dharma, SCORE_LIMIT) if state else 0
+            karma = _clamp(state.karma, SCORE_LIMIT) if state else 0
+            total_dharma, total_karma = 0, 0
+            if parent >= 0 and parent < len(self._node_row) and self._node_row[parent] >= 0:
+                parent_row = self._node_row[parent]
+                total_dharma = int(self._cols["total_dharma"][parent_row])
+                total_karma = int(self._cols["total_karma"][parent_row])
+            # Same accumulation as the session stats: dharma is clamped, karma is not
+            total_dharma = max(-100, min(100, total_dharma + dharma))
+            total_karma = _clamp(total_karma + karma, TOTAL_LIMIT)
+
+            values = {
+                "act": act, "session": self.sessions.code(entry.get("session_id")), "node": node,
+                "parent": parent, "choice": choice, "dharma": dharma, "karma": karma,
+                "total_dharma": total_dharma, "total_karma": total_karma,
+                "inventory": min(len(state.inventory), np.iinfo(np.int16).max) if state else 0,
+                "parsed": state is not None,
+                "timestamp": _timestamp(entry.get("timestamp")),
+            }
+            for name, value in values.items():
+                self._cols[name][row] = value
+            self.rows += 1
+            self._unsaved += 1
+
+            if choice >= 0:
+                if parent >= 0:
+                    self.node_choices.setdefault(parent, Counter())[choice] += 1
+                self.act_choices.setdefault(act, Counter())[choice] += 1
+            if node >= 0:
+                self._add_node(node, parent, row, total_dharma, total_karma)
+
+    def _add_blank(self):
+        """An unparsed row with no codes, standing in for an entry that could not be ingested."""
+        row = self.rows
+        for name in COLUMNS:
+            self._cols[name] = _grow(self._cols[name], row + 1)
+            self._cols[name][row] = -1 if name in ("act", "session", "node", "parent", "choice") else 0
+        self.rows += 1
+        self._unsaved += 1
+
+    def _add_node(self, node: int, parent: int, row: int, dharma: int, karma: int):
+        size = max(node, parent) + 1
+        self._node_parent = _grow(self._node_parent, size, -1)
+        self._node_row = _grow(self._node_row, size, -1)
+        for name in BRANCH_COLUMNS:
+            self._branch[name] = _grow(self._branch[name], size)
+        self._node_parent[node] = parent
+        self._node_row[node] = row
+        # The act counts towards its own branch and every branch above it
+        seen = set()
+        while node >= 0 and node not in seen:
+            seen.add(node)
+            self._branch["acts"][node] += 1
+            self._branch["dharma_sum"][node] += dharma
+            self._branch["dharma_sq"][node] += dharma * dharma
+            self._branch["karma_sum"][node] += karma
+            self._branch["karma_sq"][node] += karma * karma
+            node = int(self._node_parent[node])
+
+    # Queries
+
+    def _choice_counts(self, counter: Optional[Counter], limit: Optional[int] = None) -> Dict[str, int]:
+        if not counter:
+            return {}
+        return {self.choices.values[code]: count for code, count in counter.most_common(limit)}
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        with self._lock:
+            self.sync()
+            parsed = self.column("parsed")
+            popular = Counter()
+            for counter in self.act_choices.values():
+                popular.update(counter)
+            return {
+                "acts": self.rows,
+                "parsed": int(parsed.sum()),
+                "sessions": len(self.sessions),
+                "nodes": len(self.nodes),
+                "dharma": distribution(self.column("dharma")[parsed]),
+                "karma": distribution(self.column("karma")[parsed]),
+                "top_choices": self._choice_counts(popular, top),
+            }
+
+    def act(self, act_name: str) -> Dict[str, Any]:
+        """Choice popularity and dharma/karma distributions of one act across all sessions."""
+        with self._lock:
+            self.sync()
+            code = self.acts.get(act_name)
+            rows = self.column("act") == code if code >= 0 else np.zeros(self.rows, dtype=bool)
+            mask = rows & self.column("parsed")
+            return {
+                "act": act_name,
+                "acts": int(rows.sum()),
+                "choices": self._choice_counts(self.act_choices.get(code)),
+                "dharma": distribution(self.column("dharma")[mask]),
+                "karma": distribution(self.column("karma")[mask]),
+                "inventory": distribution(self.column("inventory")[mask]),
+            }
+
+    def node(self, node_id: str) -> Optional[Dict[str, Any]]:
+        """A node's standing, the choices taken from it and its branch's moments."""
+        with self._lock:
+            self.sync()
+            code = self.nodes.get(node_id)
+            if code < 0 or code >= len(self._node_row) or self._node_row[code] < 0:
+                return None
+            row = self._node_row[code]
+            n = self._branch["acts"][code]
+            return {
+                "node_id": node_id,
+                "dharma": int(self._cols["total_dharma"][row]),
+                "karma": int(self._cols["total_karma"][row]),
+                "choices": self._choice_counts(self.node_choices.get(code)),
+                "branch": {
+                    "acts": int(n),
+                    "dharma": _moments(n, self._branch["dharma_sum"][code], self._branch["dharma_sq"][code]),
+                    "karma": _moments(n, self._branch["karma_sum"][code], self._branch["karma_sq"][code]),
+                },
+            }
+
+    def session(self, session_id: str) -> Dict[str, Any]:
+        """Per-node standings and choice counts of one session (the MultiverseMap's choiceStats)."""
+        with self._lock:
+            self.sync()
+            code = self.sessions.get(session_id)
+            rows = np.flatnonzero((self.column("session") == code) & (self.column("node") >= 0)) if code >= 0 else []
+            nodes = {}
+            for row in rows:
+                node = int(self._cols["node"][row])
+                nodes[self.nodes.values[node]] = {
+                    "dharma": int(self._cols["total_dharma"][row]),
+                    "karma": int(self._cols["total_karma"][row]),
+                    "choices": self._choice_counts(self.node_choices.get(node)),
+                }
+            return {"session_id": session_id, "acts": len(rows), "nodes": nodes}
+
+    # Snapshots
+
+    def save(self):
+        """Write the columns and aggregates to `path` atomically."""
+        if not self.path:
+            return
+        with self._lock:
+            meta = {
+                "rows": self.rows,
+                "acts": self.acts.values, "sessions": self.sessions.values,
+                "nodes": self.nodes.values, "choices": self.choices.values,
+                "node_choices": {str(k): dict(v) for k, v in self.node_choices.items()},
+                "act_choices": {str(k): dict(v) for k, v in self.act_choices.items()},
+            }
+            arrays = {f"col_{name}": self.column(name) for name in COLUMNS}
+            nodes = len(self.nodes)
+            arrays.update({f"branch_{name}": self._branch[name][:nodes] for name in BRANCH_COLUMNS})
+            arrays["node_parent"] = self._node_parent[:nodes]
+            arrays["node_row"] = self._node_row[:nodes]
+            arrays["meta"] = np.frombuffer(json.dumps(meta).encode(), dtype=np.uint8)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".analytics-", suffix=".npz")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    np.savez(f, **arrays)
+                os.replace(tmp, self.path)
+                self._unsaved = 0
+            except OSError as e:
+                logger.error(f"Failed to write analytics snapshot {self.path}: {e}")
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+
+    def _load(self):
+        try:
+            with np.load(self.path) as data:
+                meta = json.loads(data["meta"].tobytes())
+                if meta["rows"] > self.store.count():
+                    logger.warning(f"Analytics snapshot {self.path} is ahead of the store; rebuilding")
+                    return
+                cols = {name: data[f"col_{name}"].astype(dtype) for name, dtype in COLUMNS.items()}
+                branch = {name: data[f"branch_{name}"].astype(np.float64) for name in BRANCH_COLUMNS}
+                node_parent, node_row = data["node_parent"].astype(np.int32), data["node_row"].astype(np.int64)
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable analytics snapshot {self.path}: {e}")
+            return
+        self.rows = meta["rows"]
+        self._cols, self._branch = cols, branch
+        self._node_parent, self._node_row = node_parent, node_row
+        self.acts, self.sessions = Interner(meta["acts"]), Interner(meta["sessions"])
+        self.nodes, self.choices = Interner(meta["nodes"]), Interner(meta["choices"])
+        self.node_choices = {int(k): Counter({int(c): n for c, n in v.items()})
+                             for k, v in meta["node_choices"].items()}
+        self.act_choices = {int(k): Counter({int(c): n for c, n in v.items()})
+                            for k, v in meta["act_choices"].items()}
+
+
+_analytics: Dict[int, StoryAnalytics] = {}
+_analytics_lock = threading.Lock()
+
+
+def get_analytics(store, path: Optional[str] = None, snapshot_every: int = 1000) -> StoryAnalytics:
+    """The process-wide analytics of `store` (one per store instance)."""
+    with _analytics_lock:
+        analytics = _analytics.get(id(store))
+        if analytics is None or analytics.store is not store:
+            analytics = _analytics[id(store)] = StoryAnalytics(store, path, snapshot_every)
+        return analytics
+
+
+def save_all():
+    """Snapshot every analytics instance with unsaved rows (e.g. at shutdown)."""
+    with _analytics_lock:
+        instances = list(_analytics.values())
+    for analytics in instances:
+        if analytics._unsaved:
+            analytics.save()
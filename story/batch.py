@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field, fields
+from statistics import median
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from loguru import logger
+
+
+@dataclass
+class BatchJob:
+    """One act to pre-generate. Unset fields fall back to the configured defaults."""
+    id: str
+    act_name: str
+    world_description: Optional[str] = None
+    model: Optional[str] = None
+    llm: Optional[str] = None
+    previous_context: Optional[str] = None
+    choice: Optional[str] = None
+    error: Optional[str] = None  # set for a malformed manifest row; the job fails alone
+
+
+def _job_id(index: int, data: Dict[str, Any]) -> str:
+    # Stable across runs, so a checkpoint still matches after a crash
+    digest = hashlib.sha1(json.dumps(data, sort_keys=True).encode()).hexdigest()[:10]
+    return f"{index}-{digest}"
+
+
+def _parse_row(index: int, row: Any) -> BatchJob:
+    if not isinstance(row, dict):
+        return BatchJob(id=_job_id(index, {"row": repr(row)}), act_name="",
+                        error=f"Job {index} is not a mapping: {row!r}")
+    row = dict(row)
+    row.setdefault("id", _job_id(index, row))
+    known = {f.name for f in fields(BatchJob)} - {"error"}
+    unknown = sorted(set(row) - known)
+    if unknown or not row.get("act_name"):
+        problem = f"unknown keys {', '.join(unknown)}" if unknown else "no act_name"
+        return BatchJob(id=str(row["id"]), act_name=str(row.get("act_name") or ""),
+                        error=f"Job {index} has {problem}")
+    return BatchJob(**row)
+
+
+def load_manifest(path: str) -> List[BatchJob]:
+    """Read jobs from a JSONL file (one job per line) or a YAML list/`jobs:` mapping.
+
+    A malformed row becomes a job that fails on its own instead of aborting the batch.
+    """
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise RuntimeError("YAML manifests need PyYAML: pip install pyyaml")
+        with open(path, "r") as f:
+            data = yaml.safe_load(f) or []
+        rows = data.get("jobs", []) if isinstance(data, dict) else data
+    else:
+        rows = []
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append(line.strip())
+    return [_parse_row(index, row) for index, row in enumerate(rows)]
+
+
+class Checkpoint:
+    """Append-only record of completed job ids; reopening it resumes the batch."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.done = {line.strip() for line in f if line.strip()}
+
+    def mark(self, job_id: str):
+        with self._lock:
+            with open(self.path, "a") as f:
+                f.write(job_id + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.done.add(job_id)
+
+
+class JsonlSink:
+    """Streams one JSON result per line, flushed as soon as each job finishes."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a")
+
+    def write(self, record: Dict[str, Any]):
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _answered_by(root) -> Tuple[Optional[str], int]:
+    """Model whose attempt produced the act, and how many models were tried before it."""
+    attempts, stack = [], [root]
+    while stack:
+        node = stack.pop()
+        if node.name == "llm_attempt":
+            attempts.append(node)
+        stack.extend(reversed(node.children))
+    attempts.sort(key=lambda node: node.start)
+    tried = list(dict.fromkeys(node.attrs.get("model") for node in attempts))
+    answered = [node.attrs.get("model") for node in attempts if node.attrs.get("status") == 200]
+    if not answered:
+        return None, 0  # cache hit or a provider without attempts
+    return answered[-1], tried.index(answered[-1])
+
+
+def run_job(job: BatchJob, cache: Optional[bool] = None) -> Dict[str, Any]:
+    """Generate one act. Module-level so it can run in a process pool."""
+    if job.error:
+        raise ValueError(job.error)
+    from common.constants import LLMStrategyType
+    from common.metrics import span
+    from llm.factory import get_llm
+    from llm.cache import with_cache
+    from llm.provider import OpenRouterLLM
+    from prompts import build_prompt
+    from story.spec import act_for, default_world_spec
+
+    # Per-job override builds a new spec; the shared settings are never mutated
+    spec = act_for(default_world_spec(job.world_description), job.act_name)
+
+    context_data = {"spec": spec}
+    if job.previous_context and job.choice:
+        context_data["previous_context"] = f"{job.previous_context}\n\nUSER CHOICE SELECTED: {job.choice}"
+    prompt = build_prompt().handle(context_data)["final_prompt"]
+
+    strategy = job.llm or LLMStrategyType.OPENROUTER.value
+    if job.model and strategy == LLMStrategyType.OPENROUTER.value:
+        llm = with_cache(OpenRouterLLM(model=job.model), cache)
+    else:
+        llm = get_llm(strategy, cache=cache)
+
+    requested = getattr(llm, "model", strategy)
+    start = time.monotonic()
+    with span("batch_job", id=job.id) as job_span:
+        story = llm.generate(prompt)
+    answered, hops = _answered_by(job_span)
+    return {
+        "id": job.id,
+        "act_name": job.act_name,
+        "model": answered or requested,
+        "requested_model": requested,
+        "hops": hops,
+        "story": story,
+        "latency": time.monotonic() - start,
+    }
+
+
+@dataclass
+class BatchSummary:
+    total: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    latencies: Dict[str, List[float]] = field(default_factory=dict)  # by the model that answered
+    fallbacks: Dict[str, int] = field(default_factory=dict)           # of those, acts reached after a hop
+    failures: List[Dict[str, str]] = field(default_factory=list)
+
+    @property
+    def acts_per_minute(self) -> float:
+        return self.succeeded / self.elapsed * 60 if self.elapsed else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        per_model = {}
+        for model, values in self.latencies.items():
+            ordered = sorted(values)
+            per_model[model] = {
+                "count": len(values),
+                "p50": median(ordered),
+                "p95": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+                "mean": sum(ordered) / len(ordered),
+                "fallbacks": self.fallbacks.get(model, 0),
+            }
+        data = asdict(self)
+        del data["latencies"], data["fallbacks"]
+        data["acts_per_minute"] = round(self.acts_per_minute, 2)
+        data["per_model"] = per_model
+        return data
+
+
+class BatchRunner:
+    """Runs batch jobs concurrently, checkpointing each result as it lands.
+
+    Workers only generate; the parent writes the sink and the checkpoint, so
+    a crash loses at most the jobs that were in flight.
+    """
+
+    def __init__(self, sink: JsonlSink, checkpoint: Checkpoint, concurrency: int = 4,
+                 executor: str = "thread", cache: Optional[bool] = None):
+        self.sink = sink
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency
+        self.executor = executor
+        self.cache = cache
+
+    def _pool(self) -> Executor:
+        if self.executor == "process":
+            return ProcessPoolExecutor(max_workers=self.concurrency)
+        return ThreadPoolExecutor(max_workers=self.concurrency)
+
+    def run(self, jobs: Iterable[BatchJob]) -> BatchSummary:
+        jobs = list(jobs)
+        summary = BatchSummary(total=len(jobs))
+        pending = [job for job in jobs if job.id not in self.checkpoint.done]
+        summary.skipped = len(jobs) - len(pending)
+        if summary.skipped:
+            logger.info(f"Resuming batch: {summary.skipped} jobs already done")
+
+        start = time.monotonic()
+        with self._pool() as pool:
+            futures = {pool.submit(run_job, job, self.cache): job for job in pending}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"Job {job.id} failed: {e}")
+                    summary.failed += 1
+                    summary.failures.append({"id": job.id, "error": str(e)})
+                    continue
+                self.sink.write(result)
+                self.checkpoint.mark(job.id)
+                summary.succeeded += 1
+                summary.latencies.setdefault(result["model"], []).append(result["latency"])
+                if result["hops"]:
+                    summary.fallbacks[result["model"]] = summary.fallbacks.get(result["model"], 0) + 1
+                logger.info(f"[{summary.succeeded + summary.failed}/{len(pending)}] {job.id} done")
+        summary.elapsed = time.monotonic() - start
+        return summary
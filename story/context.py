@@ -0,0 +1,163 @@
+import math
+import re
+from collections import deque
+from typing import Callable, List, Optional
+
+from story.footer import parse_story_footer
+
+# The web client joins acts (and decision markers) with this separator
+ACT_SEPARATOR = "\n\n---\n\n"
+DECISION_PREFIX = "> **DECISION:**"
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+OMITTED = "(Earlier events condensed.)"
+
+Summarizer = Callable[[str, str], str]
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / 4)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, keep_end: bool = False) -> str:
+    """Trim `text` to roughly `max_tokens`, on a word boundary."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    limit = max(max_tokens, 0) * 4
+    if keep_end:
+        cut = text[-limit:] if limit else ""
+        return "..." + cut[cut.find(" ") + 1:] if " " in cut else cut
+    cut = text[:limit]
+    return (cut.rsplit(" ", 1)[0] if " " in cut else cut) + "..."
+
+
+def split_acts(transcript: str) -> List[str]:
+    """Split a client transcript into acts, keeping decision markers attached."""
+    acts: List[str] = []
+    pending_decision = ""
+    for part in transcript.split(ACT_SEPARATOR):
+        part = part.strip()
+        if not part:
+            continue
+        if part.startswith(DECISION_PREFIX) and "\n" not in part:
+            pending_decision = part
+            continue
+        if pending_decision:
+            part = f"{pending_decision}\n\n{part}"
+            pending_decision = ""
+        acts.append(part)
+    if pending_decision:
+        acts.append(pending_decision)
+    return acts
+
+
+def extractive_summary(summary: str, act: str) -> str:
+    """Fold one act into the running summary without calling an LLM.
+
+    Keeps the decision that led to the act plus its opening and closing
+    sentences, appended as one bullet.
+    """
+    narrative, _ = parse_story_footer(act)
+    decision = ""
+    lines = []
+    for line in narrative.splitlines():
+        if line.startswith(DECISION_PREFIX):
+            decision = line[len(DECISION_PREFIX):].strip()
+        elif line.strip() and line.strip() != "---":
+            lines.append(line.strip())
+    sentences = [s for s in SENTENCE_RE.split(" ".join(lines)) if s]
+    if len(sentences) > 2:
+        sentences = [sentences[0], sentences[-1]]
+    gist = truncate_to_tokens(" ".join(sentences), 80)
+    bullet = f"- {'After choosing ' + decision + ': ' if decision else ''}{gist}"
+    return f"{summary}\n{bullet}".strip()
+
+
+class LLMSummarizer:
+    """Folds an act into the summary with a (cheap) LLM call."""
+
+    def __init__(self, llm, max_tokens: int = 400):
+        self.llm = llm
+        self.max_tokens = max_tokens
+
+    def __call__(self, summary: str, act: str) -> str:
+        narrative, _ = parse_story_footer(act)
+        prompt = (
+            f"Update the running summary of a story with the new chapter below. "
+            f"Keep names, items, and decisions. Answer in under {self.max_tokens * 3 // 4} words.\n\n"
+            f"SUMMARY SO FAR:\n{summary or '(none)'}\n\nNEW CHAPTER:\n{narrative}"
+        )
+        return self.llm.generate(prompt).strip()
+
+
+class StoryContextManager:
+    """Bounded "story so far" context: a rolling summary plus the last N acts.
+
+    Acts are folded into the summary one at a time as they age out of the
+    recent window, so each new act costs one fold, not a re-summary of the
+    whole history. `build` enforces `token_budget` before the prompt is sent.
+    """
+
+    def __init__(self, token_budget: int = 3000, recent_acts: int = 2,
+                 summarizer: Optional[Summarizer] = None):
+        self.token_budget = token_budget
+        self.recent_acts = max(recent_acts, 1)
+        self.summarizer = summarizer or extractive_summary
+        self.summary = ""
+        self.recent: deque = deque()
+        self.folded = 0
+
+    @property
+    def summary_budget(self) -> int:
+        return self.token_budget // 3
+
+    def add_act(self, act: str):
+        self.recent.append(act)
+        while len(self.recent) > self.recent_acts:
+            self._fold(self.recent.popleft())
+
+    def extend(self, acts: List[str]):
+        for act in acts:
+            self.add_act(act)
+
+    def _fold(self, act: str):
+        self.summary = self.summarizer(self.summary, act)
+        self.folded += 1
+        if estimate_tokens(self.summary) > self.summary_budget:
+            # Drop the oldest bullets first; recent events matter most
+            lines = self.summary.splitlines()
+            while len(lines) > 1 and estimate_tokens("\n".join(lines)) > self.summary_budget:
+                lines.pop(0)
+            self.summary = truncate_to_tokens("\n".join([OMITTED] + lines), self.summary_budget, keep_end=True)
+
+    def _render(self, recent: Optional[List[str]] = None) -> str:
+        recent = list(self.recent) if recent is None else recent
+        parts = []
+        if self.summary:
+            parts.append(f"STORY SO FAR (summary of {self.folded} earlier acts):\n{self.summary}")
+        if recent:
+            parts.append("MOST RECENT ACTS:\n" + ACT_SEPARATOR.join(recent))
+        return "\n\n".join(parts)
+
+    def build(self) -> str:
+        text = self._render()
+        # Shrink the raw window before touching the newest act
+        while estimate_tokens(text) > self.token_budget and len(self.recent) > 1:
+            self._fold(self.recent.popleft())
+            text = self._render()
+        if estimate_tokens(text) > self.token_budget and self.recent:
+            # The latest act alone is too long: keep its ending, where the story
+            # continues, in this prompt only; the stored act stays whole
+            room = self.token_budget - estimate_tokens(self.summary) - 20
+            text = self._render([truncate_to_tokens(self.recent[-1], max(room, self.token_budget // 2), keep_end=True)])
+        return truncate_to_tokens(text, self.token_budget, keep_end=True)
+
+
+def build_bounded_context(transcript: str, token_budget: int, recent_acts: int,
+                          summarizer: Optional[Summarizer] = None) -> str:
+    """Bound a full client transcript to `token_budget` tokens."""
+    manager = StoryContextManager(token_budget, recent_acts, summarizer)
+    manager.extend(split_acts(transcript))
+    return manager.build()
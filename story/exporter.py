@@ -1,24 +1,252 @@
+import hashlib
+import html
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Iterator, Optional
 from loguru import logger
+from common.metrics import timed
+from story.context import DECISION_PREFIX
+from story.extraction import extract_act
+
+Entry = Dict[str, Any]
+
+
+def slugify(title: str) -> str:
+    # Sanitize title for filename
+    filename = "".join(x for x in title if x.isalnum() or x in " -_").strip()
+    return filename.replace(" ", "_").lower() or "story"
+
+
+def _narrative(entry: Entry) -> str:
+    narrative, _ = extract_act(entry.get("content", ""))
+    if entry.get("choice"):
+        narrative = f"{DECISION_PREFIX} {entry['choice']}\n\n{narrative}"
+    return narrative
+
+
+def render_markdown(title: str, entries: Iterable[Entry]) -> Iterator[str]:
+    yield f"# {title}\n\n"
+    for number, entry in enumerate(entries, 1):
+        yield f"## {number}. {entry.get('act', '')}\n\n{_narrative(entry)}\n\n"
+
+
+def render_html(title: str, entries: Iterable[Entry]) -> Iterator[str]:
+    yield (f"<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\"><title>{html.escape(title)}</title></head>"
+           f"<body>\n<h1>{html.escape(title)}</h1>\n")
+    for number, entry in enumerate(entries, 1):
+        yield f"<section>\n<h2>{number}. {html.escape(entry.get('act', ''))}</h2>\n"
+        for paragraph in re.split(r"\n\s*\n", _narrative(entry)):
+            if paragraph.strip():
+                yield f"<p>{html.escape(paragraph.strip())}</p>\n"
+        yield "</section>\n"
+    yield "</body></html>\n"
+
+
+def render_json(title: str, entries: Iterable[Entry]) -> Iterator[str]:
+    # A JSON document emitted piecewise, one act at a time
+    yield '{"title": ' + json.dumps(title) + ', "acts": ['
+    for number, entry in enumerate(entries):
+        yield ("," if number else "") + "\n" + json.dumps(entry)
+    yield "\n]}\n"
+
+
+# Fixed zip timestamps keep the archive (and so its content hash) deterministic
+EPOCH = (1980, 1, 1, 0, 0, 0)
+EPUB_CONTAINER = """<?xml version="1.0"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+"""
+
+
+def _zip_write(archive: zipfile.ZipFile, name: str, data: str, compress: bool = True):
+    info = zipfile.ZipInfo(name, date_time=EPOCH)
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    archive.writestr(info, data)
+
+
+def write_epub(title: str, entries: Iterable[Entry], out: BinaryIO):
+    """EPUB 3: one XHTML chapter per act, written to the zip as it is read.
+    Only chapter titles are kept for the package manifest written last."""
+    chapters = []
+    with zipfile.ZipFile(out, "w") as archive:
+        _zip_write(archive, "mimetype", "application/epub+zip", compress=False)
+        _zip_write(archive, "META-INF/container.xml", EPUB_CONTAINER)
+        for number, entry in enumerate(entries, 1):
+            name = f"chapter{number}.xhtml"
+            chapter_title = f"{number}. {entry.get('act', '')}"
+            body = "".join(f"<p>{html.escape(p.strip())}</p>\n"
+                           for p in re.split(r"\n\s*\n", _narrative(entry)) if p.strip())
+            _zip_write(archive, f"OEBPS/{name}", (
+                '<?xml version="1.0" encoding="utf-8"?>\n'
+                '<html xmlns="http://www.w3.org/1999/xhtml"><head>'
+                f"<title>{html.escape(chapter_title)}</title></head><body>\n"
+                f"<h2>{html.escape(chapter_title)}</h2>\n{body}</body></html>\n"
+            ))
+            chapters.append((name, chapter_title))
+
+        nav = "".join(f'<li><a href="{name}">{html.escape(t)}</a></li>' for name, t in chapters)
+        _zip_write(archive, "OEBPS/nav.xhtml", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">'
+            f"<head><title>{html.escape(title)}</title></head><body>"
+            f'<nav epub:type="toc"><ol>{nav}</ol></nav></body></html>\n'
+        ))
+        items = "".join(f'<item id="c{i}" href="{name}" media-type="application/xhtml+xml"/>'
+                        for i, (name, _) in enumerate(chapters, 1))
+        spine = "".join(f'<itemref idref="c{i}"/>' for i in range(1, len(chapters) + 1))
+        identifier = hashlib.sha1(title.encode() + "".join(t for _, t in chapters).encode()).hexdigest()
+        _zip_write(archive, "OEBPS/content.opf", (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id">'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">'
+            f'<dc:identifier id="id">urn:sha1:{identifier}</dc:identifier>'
+            f"<dc:title>{html.escape(title)}</dc:title><dc:language>en</dc:language></metadata>"
+            '<manifest><item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+            f"{items}</manifest><spine>{spine}</spine></package>\n"
+        ))
+
+
+def _text_writer(render: Callable[[str, Iterable[Entry]], Iterator[str]]):
+    def write(title: str, entries: Iterable[Entry], out: BinaryIO):
+        for chunk in render(title, entries):
+            out.write(chunk.encode("utf-8"))
+    return write
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    extension: str
+    media_type: str
+    write: Callable[[str, Iterable[Entry], BinaryIO], None]
+
+
+EXPORT_FORMATS: Dict[str, ExportFormat] = {
+    "md": ExportFormat(".md", "text/markdown; charset=utf-8", _text_writer(render_markdown)),
+    "html": ExportFormat(".html", "text/html; charset=utf-8", _text_writer(render_html)),
+    "json": ExportFormat(".json", "application/json", _text_writer(render_json)),
+    "epub": ExportFormat(".epub", "application/epub+zip", write_epub),
+}
+
 
 class StoryExporter:
-    def __init__(self, export_dir: str = "exports"):
+    """Writes story documents atomically under content-hashed names.
+
+    Output goes to a temp file in `export_dir` and is renamed into place as
+    `<slug>-<sha256[:12]><ext>`, so readers never see partial files and two
+    stories with the same title never overwrite each other. With `max_age`,
+    `sweep` deletes documents not (re)written for that many seconds.
+    """
+
+    def __init__(self, export_dir: str = "exports", max_age: Optional[float] = None):
         self.export_dir = Path(export_dir)
-        self.export_dir.mkdir(exist_ok=True)
+        self.max_age = max_age
+
+    def sweep(self) -> int:
+        """Delete exports (and abandoned temp files) older than `max_age`."""
+        if self.max_age is None or not self.export_dir.is_dir():
+            return 0
+        cutoff = time.time() - self.max_age
+        removed = 0
+        for entry in os.scandir(self.export_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    removed += 1
+            except OSError:
+                continue  # already gone
+        return removed
+
+    def _write_atomic(self, title: str, extension: str, write: Callable[[BinaryIO], None]) -> str:
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.export_dir, prefix=".export-", suffix=extension)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+                f.flush()
+                os.fsync(f.fileno())
+            digest = hashlib.sha256()
+            with open(tmp, "rb") as f:
+                for block in iter(lambda: f.read(65536), b""):
+                    digest.update(block)
+            final = self.export_dir / f"{slugify(title)}-{digest.hexdigest()[:12]}{extension}"
+            os.replace(tmp, final)
+            return str(final)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
 
+    @timed("export")
+    def export(self, title: str, entries: Iterable[Entry], fmt: str = "md") -> str:
+        """Stream `entries` into a document; returns its path."""
+        spec = EXPORT_FORMATS[fmt]
+        path = self._write_atomic(title, spec.extension, lambda out: spec.write(title, entries, out))
+        logger.info(f"Story exported to {path}")
+        return path
+
+    @timed("export")
     def export_to_markdown(self, title: str, content: str):
-        # Sanitize title for filename
-        filename = "".join(x for x in title if x.isalnum() or x in " -_").strip()
-        filename = filename.replace(" ", "_").lower() + ".md"
-        
-        filepath = self.export_dir / filename
-        
         try:
-            with open(filepath, "w") as f:
-                f.write(f"# {title}\n\n")
-                f.write(content)
-            logger.info(f"Story exported to {filepath}")
-            return str(filepath)
+            path = self._write_atomic(title, ".md", lambda out: out.write(f"# {title}\n\n{content}".encode("utf-8")))
+            logger.info(f"Story exported to {path}")
+            return path
         except Exception as e:
             logger.error(f"Failed to export story: {e}")
             return None
+
+
+class ExportQueue:
+    """Background writer: exports run off the request path on one thread,
+    so concurrent requests never write the export directory at the same time.
+
+    Expired exports are swept on the writer thread at most every
+    `sweep_interval` seconds. The thread starts on the first submit after
+    construction or `shutdown`.
+    """
+
+    def __init__(self, exporter: Optional[StoryExporter] = None, workers: int = 1,
+                 sweep_interval: float = 600.0):
+        self.exporter = exporter or StoryExporter()
+        self.workers = workers
+        self.sweep_interval = sweep_interval
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._swept = float("-inf")
+
+    def _run(self, title: str, entries: Callable[[], Iterable[Entry]], fmt: str) -> str:
+        now = time.monotonic()
+        if now - self._swept >= self.sweep_interval:
+            self._swept = now
+            self.exporter.sweep()
+        return self.exporter.export(title, entries(), fmt)
+
+    def submit(self, title: str, entries: Callable[[], Iterable[Entry]], fmt: str = "md") -> Future:
+        """`entries` is called on the writer thread, so store reads happen there too."""
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{fmt}'. Choose from: {', '.join(EXPORT_FORMATS)}")
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="export")
+            return self._pool.submit(self._run, title, entries, fmt)
+
+    def shutdown(self):
+        """Finish queued exports and stop the writer thread."""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+
+def iter_file(path: str, chunk_size: int = 65536) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            yield block
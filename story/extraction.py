@@ -0,0 +1,223 @@
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+FOOTER_RE = re.compile(r"```json\s*([\s\S]*?)\s*(?:```|$)")
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+BARE_KEY_RE = re.compile(r"([{,]\s*)([A-Za-z_][\w-]*)\s*:")
+PY_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class ActState(BaseModel):
+    """Game state carried by the JSON footer of every act."""
+    image_prompt: Optional[str] = None
+    dharma: int = 0
+    karma: int = 0
+    inventory: List[str] = Field(default_factory=list)
+    choices: List[str] = Field(default_factory=list)
+
+    @field_validator("dharma", "karma", mode="before")
+    @classmethod
+    def _number(cls, value):
+        # Models write "+10", 10.0 or null as often as 10
+        if value is None:
+            return 0
+        if isinstance(value, str):
+            value = value.strip().lstrip("+")
+        return int(float(value))
+
+    @field_validator("inventory", "choices", mode="before")
+    @classmethod
+    def _strings(cls, value):
+        if value is None:
+            return []
+        if isinstance(value, (str, dict)):
+            value = [value]
+        return [(item.get("text") or json.dumps(item)) if isinstance(item, dict) else str(item) for item in value]
+
+
+class DebateStep(BaseModel):
+    speaker: str
+    content: str
+    round: Optional[int] = None
+
+
+class DebateResponse(BaseModel):
+    debate: List[DebateStep]
+    consensus: str
+
+
+class JsonScanner:
+    """Incrementally finds complete top-level JSON objects in streamed text.
+
+    Brace matching is string- and escape-aware inside objects; text between
+    objects is ignored. With `until` set (e.g. "]"), scanning stops at that
+    character outside any object, which is how a JSON array is walked.
+    """
+
+    def __init__(self, until: Optional[str] = None):
+        self.until = until
+        self.text = ""
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._start = -1
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def partial(self) -> str:
+        """The object currently being received, if any."""
+        return self.text[self._start:] if self._depth else ""
+
+    def feed(self, chunk: str) -> List[str]:
+        self.text += chunk
+        found = []
+        while self._pos < len(self.text) and not self.done:
+            char = self.text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"' and self._depth:
+                self._in_string = True
+            elif char == "{":
+                if self._depth == 0:
+                    self._start = self._pos
+                self._depth += 1
+            elif char == "}" and self._depth:
+                self._depth -= 1
+                if self._depth == 0:
+                    found.append(self.text[self._start:self._pos + 1])
+            elif char == self.until and self._depth == 0:
+                self.done = True
+            self._pos += 1
+        return found
+
+
+def _close_brackets(text: str) -> str:
+    # Terminate a truncated object: open string first, then brackets
+    stack, in_string, escape = [], False, False
+    for char in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif char == "\\":
+                escape = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in "{[":
+            stack.append("}" if char == "{" else "]")
+        elif char in "}]" and stack:
+            stack.pop()
+    tail = '"' if in_string else ""
+    return TRAILING_COMMA_RE.sub(r"\1", (text + tail).rstrip().rstrip(",") + "".join(reversed(stack)))
+
+
+def _repairs(raw: str):
+    text = raw.strip()
+    yield text
+    text = re.sub(r"^```(?:json)?|```$", "", text).strip()
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        return
+    text = text[start:]
+    end = max(text.rfind("}"), text.rfind("]"))
+    yield text[:end + 1] if end != -1 else text
+    text = text.replace("“", '"').replace("”", '"')
+    text = TRAILING_COMMA_RE.sub(r"\1", text)
+    yield text
+    text = BARE_KEY_RE.sub(r'\1"\2":', text)
+    text = re.sub(r"\b(True|False|None)\b", lambda m: PY_LITERALS[m.group(1)], text)
+    yield text
+    yield _close_brackets(text)
+
+
+def loads_tolerant(raw: str) -> Optional[Any]:
+    """json.loads with progressively stronger repairs for common model mistakes:
+    fences, chatter, smart quotes, trailing commas, bare keys, Python literals
+    and truncation. Returns None if nothing parses."""
+    for candidate in _repairs(raw):
+        try:
+            return json.loads(candidate)
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def load_object(raw: str) -> Optional[Dict[str, Any]]:
+    data = loads_tolerant(raw)
+    return data if isinstance(data, dict) else None
+
+
+def _validate(model, data: Optional[Dict[str, Any]]):
+    if data is None:
+        return None
+    try:
+        return model.model_validate(data)
+    except ValidationError:
+        return None
+
+
+def extract_act(text: str) -> Tuple[str, Optional[ActState]]:
+    """Split a finished act into narrative and its validated state footer.
+
+    The ```json fence is preferred; failing that, a trailing bare JSON object
+    is accepted. A fenced footer that cannot be repaired is still cut from
+    the narrative (state None); with no footer at all the text is unchanged.
+    """
+    match = FOOTER_RE.search(text)
+    if match:
+        return text[:match.start()].strip(), _validate(ActState, load_object(match.group(1)))
+
+    scanner = JsonScanner()
+    objects = scanner.feed(text)
+    if objects and text.rstrip().endswith(objects[-1]):
+        state = _validate(ActState, load_object(objects[-1]))
+        if state is not None:
+            return text[:text.rfind(objects[-1])].strip(), state
+    return text, None
+
+
+def extract_debate(text: str) -> Optional[DebateResponse]:
+    return _validate(DebateResponse, load_object(text))
+
+
+def format_footer(state: ActState) -> str:
+    return f"```json\n{state.model_dump_json(indent=2)}\n```"
+
+
+def build_footer_repair_prompt(narrative: str) -> str:
+    # Only the footer is regenerated, so the act itself is never paid for twice
+    return f"""
+    The following story act is missing its machine-readable state. Read it and
+    return ONLY a JSON object, with no other text, of the form:
+    {{
+        "image_prompt": "A visual description of the key scene",
+        "dharma": 0,
+        "karma": 0,
+        "inventory": ["Item"],
+        "choices": ["Choice 1: ...", "Choice 2: ...", "Choice 3: ..."]
+    }}
+    dharma and karma are integer changes caused by this act; choices are three
+    distinct options for what happens next.
+
+    **Act:**
+    {narrative}
+    """
+
+
+def repair_act_state(llm, narrative: str) -> Optional[ActState]:
+    """Ask `llm` (ideally in JSON mode) for just the footer of `narrative`."""
+    return _validate(ActState, load_object(llm.generate(build_footer_repair_prompt(narrative))))
+
+
+async def arepair_act_state(llm, narrative: str) -> Optional[ActState]:
+    return _validate(ActState, load_object(await llm.agenerate(build_footer_repair_prompt(narrative))))
@@ -0,0 +1,104 @@
+import json
+import re
+from typing import Any, Dict, Optional, Tuple
+
+from story.extraction import ActState, extract_act, load_object
+
+FENCE_OPEN = "```json"
+FENCE_CLOSE = "```"
+# A complete "image_prompt" string value, matched before the rest of the footer arrives
+IMAGE_PROMPT_RE = re.compile(r'"image_prompt"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+
+def parse_story_footer(text: str) -> Tuple[str, Optional[Dict[str, Any]]]:
+    """Split a finished act into narrative and its validated ```json state footer."""
+    narrative, state = extract_act(text)
+    return narrative, state.model_dump() if state else None
+
+
+class FooterParser:
+    """Incrementally separates streamed act text from its trailing JSON footer.
+
+    `feed` returns the narrative text that is safe to forward right away. A
+    tail that could be the start of the ```json fence is held back until the
+    next chunk decides it, and everything after the fence is buffered and
+    parsed as soon as the closing fence arrives.
+    """
+
+    def __init__(self):
+        self._pending = ""
+        self._footer: Optional[str] = None
+        self.data: Optional[Dict[str, Any]] = None
+        self.closed = False
+
+    @property
+    def state(self) -> Optional[ActState]:
+        """The footer validated as an ActState, once it has been parsed."""
+        if self.data is None:
+            return None
+        try:
+            return ActState.model_validate(self.data)
+        except ValueError:
+            return None
+
+    @property
+    def image_prompt(self) -> Optional[str]:
+        """The footer's image prompt, as soon as its value has streamed in."""
+        if self.data is not None:
+            return self.data.get("image_prompt") or None
+        if self._footer is None:
+            return None
+        match = IMAGE_PROMPT_RE.search(self._footer)
+        if match is None:
+            return None
+        try:
+            return json.loads(f'"{match.group(1)}"') or None
+        except ValueError:
+            return None
+
+    @property
+    def in_footer(self) -> bool:
+        return self._footer is not None
+
+    def feed(self, chunk: str) -> str:
+        if self._footer is not None:
+            if not self.closed:
+                self._footer += chunk
+                self._try_close()
+            return ""
+
+        self._pending += chunk
+        idx = self._pending.find(FENCE_OPEN)
+        if idx != -1:
+            narrative = self._pending[:idx]
+            self._footer = self._pending[idx + len(FENCE_OPEN):]
+            self._pending = ""
+            self._try_close()
+            return narrative
+
+        hold = self._partial_fence_length(self._pending)
+        ready = self._pending[:len(self._pending) - hold]
+        self._pending = self._pending[len(self._pending) - hold:]
+        return ready
+
+    def finish(self) -> str:
+        """Flush held-back text and parse an unterminated footer if possible."""
+        rest, self._pending = self._pending, ""
+        if self._footer is not None and not self.closed:
+            self.data = load_object(self._footer)
+            self.closed = True
+        return rest
+
+    def _try_close(self):
+        end = self._footer.find(FENCE_CLOSE)
+        if end == -1:
+            return
+        self.data = load_object(self._footer[:end])
+        self.closed = True
+
+    @staticmethod
+    def _partial_fence_length(text: str) -> int:
+        for size in range(min(len(FENCE_OPEN) - 1, len(text)), 0, -1):
+            if FENCE_OPEN.startswith(text[-size:]):
+                return size
+        return 0
@@ -0,0 +1,236 @@
+import bisect
+import itertools
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from story.context import ACT_SEPARATOR, DECISION_PREFIX
+
+
+@dataclass
+class StoryNode:
+    """One act. The edge from its parent is the choice that led to it."""
+    id: str
+    parent_id: Optional[str]
+    act: str
+    content: str
+    choice: Optional[str] = None
+    depth: int = 0
+    # Player state after this act (dharma, karma, inventory, choices, image_prompt)
+    state: Dict[str, Any] = field(default_factory=dict)
+    children: List[str] = field(default_factory=list)
+    created_at: float = field(default_factory=time.time)
+    seq: int = 0
+    revision: int = 0
+
+    def summary(self) -> Dict[str, Any]:
+        """What the map needs to draw the node; content is fetched per path."""
+        return {
+            "id": self.id,
+            "parent_id": self.parent_id,
+            "act": self.act,
+            "choice": self.choice,
+            "depth": self.depth,
+            "children": list(self.children),
+            "dharma": self.state.get("dharma", 0),
+            "karma": self.state.get("karma", 0),
+            "revision": self.revision,
+        }
+
+
+class StoryGraph:
+    """Branching story history: a forest of acts linked to their parents.
+
+    Each act is stored once, however many branches continue from it, and a
+    branch is just a leaf id: `path` walks parent links, so reconstructing a
+    branch is O(depth) and never copies text. Every mutation bumps
+    `revision` and is logged, so clients can page through the graph once and
+    then poll `changes(since)` for what was added or pruned.
+    """
+
+    def __init__(self, max_changes: int = 10000):
+        self.nodes: Dict[str, StoryNode] = {}
+        self.roots: List[str] = []
+        self.revision = 0
+        self.max_changes = max_changes
+        # (revision, op, node_id), op is "add" | "update" | "remove"; revisions ascend
+        self._changes: List[Tuple[int, str, str]] = []
+        self._seq = itertools.count()
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, node_id: str) -> bool:
+        return node_id in self.nodes
+
+    def get(self, node_id: str) -> StoryNode:
+        try:
+            return self.nodes[node_id]
+        except KeyError:
+            raise KeyError(f"Unknown story node: {node_id}") from None
+
+    def _log(self, op: str, node_id: str):
+        self._changes.append((self.revision, op, node_id))
+        if len(self._changes) > self.max_changes:
+            del self._changes[:len(self._changes) - self.max_changes]
+
+    def add(self, content: str, parent_id: Optional[str] = None, choice: Optional[str] = None,
+            act: str = "", state: Optional[Dict[str, Any]] = None,
+            node_id: Optional[str] = None) -> StoryNode:
+        """Append an act under `parent_id` (a new root if None); forking a
+        branch is adding a second child to an existing node."""
+        with self._lock:
+            parent = self.get(parent_id) if parent_id is not None else None
+            self.revision += 1
+            node = StoryNode(
+                id=node_id or uuid.uuid4().hex,
+                parent_id=parent_id,
+                act=act,
+                content=content,
+                choice=choice,
+                depth=parent.depth + 1 if parent else 0,
+                state=dict(state or {}),
+                seq=next(self._seq),
+                revision=self.revision,
+            )
+            if node.id in self.nodes:
+                raise ValueError(f"Duplicate story node: {node.id}")
+            self.nodes[node.id] = node
+            if parent is None:
+                self.roots.append(node.id)
+            else:
+                parent.children.append(node.id)
+                parent.revision = self.revision
+                self._log("update", parent.id)
+            self._log("add", node.id)
+            return node
+
+    def find_child(self, parent_id: Optional[str], choice: Optional[str]) -> Optional[StoryNode]:
+        with self._lock:
+            siblings = self.get(parent_id).children if parent_id is not None else self.roots
+            for child_id in siblings:
+                if self.nodes[child_id].choice == choice:
+                    return self.nodes[child_id]
+        return None
+
+    def path(self, node_id: str) -> List[StoryNode]:
+        """Root-to-node acts of the branch ending at `node_id`."""
+        with self._lock:
+            nodes = []
+            node: Optional[StoryNode] = self.get(node_id)
+            while node is not None:
+                nodes.append(node)
+                node = self.nodes.get(node.parent_id) if node.parent_id is not None else None
+        nodes.reverse()
+        return nodes
+
+    def transcript(self, node_id: str) -> str:
+        """The branch as the web client's transcript (decision markers between acts)."""
+        parts = []
+        for node in self.path(node_id):
+            if node.choice:
+                parts.append(f"{DECISION_PREFIX} {node.choice}")
+            parts.append(node.content)
+        return ACT_SEPARATOR.join(parts)
+
+    def is_ancestor(self, ancestor_id: str, node_id: str) -> bool:
+        with self._lock:
+            node = self.nodes.get(node_id)
+            while node is not None:
+                if node.id == ancestor_id:
+                    return True
+                node = self.nodes.get(node.parent_id) if node.parent_id is not None else None
+        return False
+
+    def leaves(self) -> List[str]:
+        with self._lock:
+            return [n.id for n in self.nodes.values() if not n.children]
+
+    def prune(self, node_id: str) -> List[str]:
+        """Remove `node_id` and its whole subtree; returns the removed ids."""
+        with self._lock:
+            node = self.get(node_id)
+            self.revision += 1
+            if node.parent_id is None:
+                self.roots.remove(node_id)
+            else:
+                parent = self.nodes[node.parent_id]
+                parent.children.remove(node_id)
+                parent.revision = self.revision
+                self._log("update", parent.id)
+            removed, stack = [], [node_id]
+            while stack:
+                current = self.nodes.pop(stack.pop())
+                stack.extend(current.children)
+                removed.append(current.id)
+                self._log("remove", current.id)
+            return removed
+
+    def page(self, cursor: int = 0, limit: int = 100) -> Dict[str, Any]:
+        """Node summaries in creation order (parents before children), `limit`
+        at a time; pass `next_cursor` back until it is None."""
+        with self._lock:
+            # Insertion order is creation order, and pruning keeps it
+            ordered = list(self.nodes.values())
+            start = bisect.bisect_left(ordered, cursor, key=lambda n: n.seq)
+            chunk = ordered[start:start + limit]
+            more = start + limit < len(ordered)
+            return {
+                "revision": self.revision,
+                "total": len(ordered),
+                "nodes": [n.summary() for n in chunk],
+                "next_cursor": chunk[-1].seq + 1 if more and chunk else None,
+            }
+
+    def changes(self, since: int) -> Dict[str, Any]:
+        """Nodes added or updated and ids removed after revision `since`.
+        `reset` means the log no longer reaches back that far: page again."""
+        with self._lock:
+            if since >= self.revision:
+                return {"revision": self.revision, "reset": False, "nodes": [], "removed": []}
+            oldest = self._changes[0][0] if self._changes else self.revision + 1
+            if since < oldest - 1:
+                return {"revision": self.revision, "reset": True, "nodes": [], "removed": []}
+            start = bisect.bisect_right(self._changes, since, key=lambda change: change[0])
+            touched: Dict[str, str] = {}
+            for _, op, node_id in self._changes[start:]:
+                touched[node_id] = op
+            return {
+                "revision": self.revision,
+                "reset": False,
+                "nodes": [self.nodes[i].summary() for i, op in touched.items() if op != "remove"],
+                "removed": [i for i, op in touched.items() if op == "remove"],
+            }
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"revision": self.revision,
+                    "nodes": [dict(vars(node), children=list(node.children)) for node in self.nodes.values()]}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StoryGraph":
+        """Inverse of `to_dict`; the change log starts empty, so diff clients reset."""
+        graph = cls()
+        for fields in data.get("nodes", []):
+            node = StoryNode(**fields)
+            graph.nodes[node.id] = node
+            if node.parent_id is None:
+                graph.roots.append(node.id)
+        graph.revision = data.get("revision", 0)
+        graph._seq = itertools.count(max((n.seq for n in graph.nodes.values()), default=-1) + 1)
+        return graph
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> "StoryGraph":
+        """Rebuild a graph from stored entries that carry `node_id`/`parent_id`."""
+        graph = cls()
+        for entry in entries:
+            if not entry.get("node_id") or entry["node_id"] in graph:
+                continue
+            parent_id = entry.get("parent_id")
+            graph.add(entry.get("content", ""), parent_id if parent_id in graph else None,
+                      entry.get("choice"), entry.get("act", ""), node_id=entry["node_id"])
+        return graph
@@ -0,0 +1,214 @@
+import re
+import threading
+import zlib
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from story.context import estimate_tokens, truncate_to_tokens
+
+WORD_RE = re.compile(r"[a-z0-9][a-z0-9'-]*")
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+
+def chunk_text(text: str, max_tokens: int = 120) -> List[str]:
+    """Split prose into passages of at most ~`max_tokens`, on paragraph
+    boundaries where possible, so a hit quotes whole thoughts."""
+    chunks: List[str] = []
+    current = ""
+    for paragraph in PARAGRAPH_RE.split(text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while estimate_tokens(paragraph) > max_tokens:
+            head = truncate_to_tokens(paragraph, max_tokens).removesuffix("...")
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(head)
+            paragraph = paragraph[len(head):].strip()
+        if current and estimate_tokens(current) + estimate_tokens(paragraph) > max_tokens:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class HashingEmbedder:
+    """Hashed TF-IDF: words are hashed into `dim` buckets (no vocabulary to
+    grow), documents are stored as L2-normalised log term frequencies and
+    queries are weighted by the IDF seen so far. Pure NumPy, no model files."""
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+        self.documents = 0
+        self.df = np.zeros(dim, dtype=np.float32)
+
+    def _counts(self, text: str) -> np.ndarray:
+        buckets = [zlib.crc32(word.encode()) % self.dim for word in WORD_RE.findall(text.lower())]
+        return np.bincount(buckets, minlength=self.dim).astype(np.float32)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = self._counts(text)
+            self.df += counts > 0
+            vectors[row] = np.log1p(counts)
+        self.documents += len(texts)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-9)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        idf = np.log((1 + self.documents) / (1 + self.df)) + 1
+        vector = np.log1p(self._counts(text)) * idf
+        return vector / max(float(np.linalg.norm(vector)), 1e-9)
+
+
+@lru_cache(maxsize=4)
+def _load_sentence_model(name: str):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(name, device="cpu")
+
+
+class LocalEmbedder:
+    """A sentence-transformers model on CPU; loaded once per process and
+    shared by every session."""
+
+    def __init__(self, model_name: str):
+        self.model = _load_sentence_model(model_name)
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        return self.model.encode(list(texts), normalize_embeddings=True,
+                                 convert_to_numpy=True).astype(np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed([text])[0]
+
+
+def make_embedder(model_name: Optional[str] = None):
+    """The configured local model if it is installed, else hashed TF-IDF."""
+    if model_name:
+        try:
+            return LocalEmbedder(model_name)
+        except ImportError:
+            print(f"sentence-transformers not installed; using hashed TF-IDF instead of {model_name}")
+    return HashingEmbedder()
+
+
+class VectorStore:
+    """Append-only matrix of unit vectors with brute-force top-k.
+
+    Rows live in one preallocated float32 block that doubles when full, so
+    appends are amortised O(1) and a search is one matrix-vector product plus
+    an `argpartition`; at tens of thousands of rows that is a few milliseconds.
+    """
+
+    def __init__(self, dim: int, capacity: int = 256):
+        self.dim = dim
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, vectors: np.ndarray) -> range:
+        needed = self._size + len(vectors)
+        if needed > len(self._matrix):
+            grown = np.zeros((max(needed, 2 * len(self._matrix)), self.dim), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size:needed] = vectors
+        rows = range(self._size, needed)
+        self._size = needed
+        return rows
+
+    def search(self, query: np.ndarray, k: int, limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Top `k` (row, cosine score) among the first `limit` rows, best first."""
+        size = self._size if limit is None else min(limit, self._size)
+        if size == 0 or k <= 0:
+            return []
+        scores = self._matrix[:size] @ query
+        if k < size:
+            top = np.argpartition(scores, -k)[-k:]
+        else:
+            top = np.arange(size)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(row), float(scores[row])) for row in top]
+
+
+@dataclass(frozen=True)
+class Passage:
+    act_index: int
+    text: str
+    score: float = 0.0
+
+
+class StoryMemory:
+    """Per-session retrieval index over past acts.
+
+    Acts are chunked and embedded as they are appended; `relevant` finds
+    the passages most similar to a query (the chosen option, inventory,
+    ...) among acts older than a given index, typically those that have
+    already aged out of the raw recent-acts window.
+    """
+
+    def __init__(self, embedder=None, chunk_tokens: int = 120):
+        self.embedder = embedder or HashingEmbedder()
+        self.chunk_tokens = chunk_tokens
+        self.store = VectorStore(self.embedder.dim)
+        self.passages: List[Passage] = []
+        # Row offset where each act starts; acts are indexed in order
+        self._act_rows: List[int] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    @property
+    def acts(self) -> int:
+        return len(self._act_rows)
+
+    def add_act(self, narrative: str, choice: Optional[str] = None) -> int:
+        chunks = chunk_text(narrative, self.chunk_tokens)
+        if choice:
+            # The decision is its own passage so "what did I choose about X" can match it
+            chunks.insert(0, f"Earlier decision: {choice}")
+        vectors = self.embedder.embed(chunks) if chunks else np.zeros((0, self.store.dim), np.float32)
+        with self._lock:
+            act_index = len(self._act_rows)
+            self._act_rows.append(len(self.passages))
+            self.store.add(vectors)
+            self.passages.extend(Passage(act_index, chunk) for chunk in chunks)
+        return act_index
+
+    def search(self, query: str, k: int = 4, before_act: Optional[int] = None) -> List[Passage]:
+        with self._lock:
+            if before_act is None or before_act >= len(self._act_rows):
+                limit = len(self.passages)
+            else:
+                limit = self._act_rows[before_act] if before_act > 0 else 0
+            if not query.strip() or limit == 0:
+                return []
+            hits = self.store.search(self.embedder.embed_query(query), k, limit)
+            return [Passage(self.passages[row].act_index, self.passages[row].text, score)
+                    for row, score in hits if score > 0]
+
+    def relevant(self, query: str, k: int = 4, before_act: Optional[int] = None,
+                 token_budget: int = 600) -> List[str]:
+        """Passages for a prompt: best first, within `token_budget`, then
+        put back in story order so the model reads them chronologically."""
+        chosen: List[Passage] = []
+        used = 0
+        for passage in self.search(query, k, before_act):
+            cost = estimate_tokens(passage.text)
+            if used + cost > token_budget:
+                continue
+            chosen.append(passage)
+            used += cost
+        chosen.sort(key=lambda p: p.act_index)
+        return [f"(Act {p.act_index + 1}) {p.text}" for p in chosen]
@@ -1,20 +1,39 @@
-from typing import Dict, Any
-from common.types import Act, Character
+from functools import lru_cache
+from typing import Optional, Tuple
+from common.types import Act, Character, WorldSpec
+from common.metrics import timed
 
 from config import CharacterData, WorldConfig
 
-def build_act_specification(character_data: CharacterData, world_config: WorldConfig, act_name: str) -> Act:
-    characters = []
+@lru_cache(maxsize=256)
+def world_characters(world: WorldSpec) -> Tuple[Character, ...]:
     # Simple logic to flatten factions into characters for now
-    for faction in character_data.factions:
-         characters.append(Character(name=faction, role="Faction", description=faction))
-         
-    if character_data.advisor:
-         characters.append(Character(name="Advisor", role="Advisor", description=character_data.advisor))
+    characters = [Character(name=faction, role="Faction", description=faction) for faction in world.factions]
+    if world.advisor:
+        characters.append(Character(name="Advisor", role="Advisor", description=world.advisor))
+    return tuple(characters)
+
+_configured: Optional[Tuple[WorldConfig, CharacterData, WorldSpec]] = None
+
+def default_world_spec(description: Optional[str] = None) -> WorldSpec:
+    """The configured world, optionally with a per-request description."""
+    global _configured
+    from config import settings
+    cached = _configured
+    if cached is None or cached[0] is not settings.world or cached[1] is not settings.characters:
+        cached = _configured = (settings.world, settings.characters,
+                                WorldSpec.from_config(settings.world, settings.characters))
+    return cached[2].with_description(description)
 
+@timed("build_act_specification")
+def act_for(world: WorldSpec, act_name: str) -> Act:
     return Act(
         name=act_name,
         description=f"A story act exploring {act_name} in the defined world.",
-        characters=characters,
-        world_context=world_config.model_dump()
+        characters=list(world_characters(world)),
+        world_context=world.world_context(),
+        world=world,
     )
+
+def build_act_specification(character_data: CharacterData, world_config: WorldConfig, act_name: str) -> Act:
+    return act_for(WorldSpec.from_config(world_config, character_data), act_name)
@@ -0,0 +1,120 @@
+import socketserver
+import threading
+
+import pytest
+
+import image.factory
+import llm.catalog
+from common.shared import DELETE_IF_SCRIPT, LocalSharedState, SharedStateError, encode_command, read_reply
+
+
+@pytest.fixture(autouse=True)
+def offline_catalog(monkeypatch):
+    """An empty, diskless model catalog with no background refresh: tests never hit OpenRouter."""
+    import config
+    catalog = llm.catalog.ModelCatalog("http://catalog.invalid/models")
+    monkeypatch.setattr(llm.catalog, "_catalog", catalog)
+    monkeypatch.setattr(config.settings, "model_catalog_refresh", 0)
+    return catalog
+
+
+@pytest.fixture(autouse=True)
+def stub_images(monkeypatch, tmp_path):
+    """Local placeholder renders cached under tmp_path: tests never hit the image service."""
+    import config
+    monkeypatch.setattr(config.settings, "image_provider", "stub")
+    monkeypatch.setattr(config.settings, "image_dir", str(tmp_path / "images"))
+    image.factory.reset_image_queue()
+    yield
+    image.factory.reset_image_queue()
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    """Serves the Redis commands RedisSharedState uses, from a LocalSharedState."""
+
+    def reply(self, value):
+        if value is None:
+            self.wfile.write(b"$-1\r\n")
+        elif isinstance(value, bool):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, int):
+            self.wfile.write(b":%d\r\n" % value)
+        elif isinstance(value, list):
+            self.wfile.write(b"*%d\r\n" % len(value))
+            for item in value:
+                self.reply(item)
+        else:
+            data = str(value).encode()
+            self.wfile.write(b"$%d\r\n%s\r\n" % (len(data), data))
+
+    def handle(self):
+        state: LocalSharedState = self.server.state
+        while True:
+            try:
+                command = read_reply(self.rfile)
+            except ConnectionError:
+                return
+            name, args = command[0].upper(), command[1:]
+            try:
+                if name == "SUBSCRIBE":
+                    self.stream(state, args[0])
+                    return
+                if name == "SET":
+                    ttl = int(args[args.index("PX") + 1]) / 1000 if "PX" in args else None
+                    ok = state.set(args[0], args[1], ttl=ttl, nx="NX" in args)
+                    self.wfile.write(b"+OK\r\n" if ok else b"$-1\r\n")
+                    continue
+                if name == "EVAL":
+                    # Only the one script the client sends
+                    if args[0] != DELETE_IF_SCRIPT:
+                        raise SharedStateError("ERR unknown script")
+                    self.reply(int(state.delete_if(args[2], args[3])))
+                    continue
+                handlers = {
+                    "GET": lambda: state.get(args[0]),
+                    "DEL": lambda: int(state.delete(args[0])),
+                    "INCRBY": lambda: state.incr(args[0], int(args[1])),
+                    "RPUSH": lambda: state.rpush(args[0], *args[1:]),
+                    "LRANGE": lambda: state.lrange(args[0], int(args[1]), int(args[2])),
+                    "LLEN": lambda: state.llen(args[0]),
+                    "PUBLISH": lambda: state.publish(args[0], args[1]),
+                }
+                self.reply(handlers[name]())
+            except SharedStateError as e:
+                self.wfile.write(f"-{e}\r\n".encode())
+            except KeyError:
+                self.wfile.write(f"-ERR unknown command '{name}'\r\n".encode())
+
+    def stream(self, state: LocalSharedState, channel: str):
+        self.reply(["subscribe", channel, 1])
+        with state.subscribe(channel) as subscription:
+            while not self.server.stopping.is_set():
+                message = subscription.get(timeout=0.05)
+                if message is not None:
+                    self.reply(["message", channel, message])
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.state = LocalSharedState()
+        self.stopping = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.server_address[1]}/0"
+
+
+@pytest.fixture
+def resp_server():
+    """A local stand-in for a Redis server, speaking enough RESP for the tests."""
+    server = RespServer()
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.stopping.set()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,437 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import pytest
+from fastapi.testclient import TestClient
+
+import api.council
+import api.main
+from api.client import JobClient
+from api.jobs import JobRecord, JobRunner, JobStore
+from api.prefetch import BranchPrefetcher
+from common.shared import LocalSharedState
+from llm.provider import LLMProvider
+from llm.scheduler import RequestScheduler
+from story.exporter import ExportQueue, StoryExporter
+
+ACT = 'The council convened.\n```json\n{"dharma": 3, "karma": 1, "inventory": [], "choices": ["A", "B", "C"]}\n```'
+
+class FakeLLM(LLMProvider):
+    def __init__(self, model: str = "fake", **kwargs):
+        self.model = model
+
+    def generate(self, prompt: str) -> str:
+        return ACT
+
+    async def astream(self, prompt: str):
+        for i in range(0, len(ACT), 7):
+            yield ACT[i:i + 7]
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(api.main, "OpenRouterLLM", FakeLLM)
+    scheduler = RequestScheduler(rate=1000, burst=1000)
+    monkeypatch.setattr(api.main, "get_scheduler", lambda: scheduler)
+    with TestClient(api.main.app) as c:
+        yield c
+
+def generate_payload(**overrides):
+    payload = {"model": "fake", "act_name": "Act 1", "world_description": "A world"}
+    payload.update(overrides)
+    return payload
+
+def test_generate(client):
+    response = client.post("/generate", json=generate_payload())
+    assert response.status_code == 200
+    assert response.json()["story"] == ACT
+
+def test_generate_returns_parsed_state_and_repairs_only_the_footer(client, monkeypatch):
+    prompts = []
+
+    class FooterlessLLM(FakeLLM):
+        def __init__(self, model: str = "fake", json_mode: bool = False, **kwargs):
+            super().__init__(model)
+            self.json_mode = json_mode
+
+        def generate(self, prompt):
+            prompts.append((self.json_mode, prompt))
+            return '{"dharma": 2, "choices": ["X", "Y", "Z"]}' if self.json_mode else "A story without a footer."
+
+    body = client.post("/generate", json=generate_payload()).json()
+    assert body["narrative"] == "The council convened."
+    assert body["state"]["choices"] == ["A", "B", "C"]
+
+    monkeypatch.setattr(api.main, "OpenRouterLLM", FooterlessLLM)
+    body = client.post("/generate", json=generate_payload()).json()
+    assert body["state"]["choices"] == ["X", "Y", "Z"]
+    assert body["story"].startswith("A story without a footer.\n\n```json")
+    # One act, then one JSON-mode request that only carries the act back
+    assert [json_mode for json_mode, _ in prompts] == [False, True]
+    assert "A story without a footer." in prompts[1][1]
+
+def test_generate_stream_emits_tokens_then_state(client):
+    with client.stream("POST", "/generate/stream", json=generate_payload()) as response:
+        body = "".join(response.iter_text())
+
+    events = [block.split("\n")[0] for block in body.strip().split("\n\n")]
+    assert events[0] == "event: token"
+    assert events[-2:] == ["event: state", "event: done"]
+    assert '"choices": ["A", "B", "C"]' in body
+    assert "```" not in body
+
+def test_session_lifecycle(client):
+    created = client.post("/sessions", json=generate_payload())
+    assert created.status_code == 200
+    session = created.json()
+    assert session["choices"] == ["A", "B", "C"]
+    assert session["dharma"] == 3
+
+    advanced = client.post(f"/sessions/{session['id']}/choices", json={"choice_index": 1}).json()
+    assert advanced["act_count"] == 2
+    assert advanced["decisions"] == ["B"]
+    assert advanced["dharma"] == 6
+    assert advanced["karma"] == 2
+
+    state = client.get(f"/sessions/{session['id']}").json()
+    assert len(state["acts"]) == 2
+
+def test_session_rejects_bad_choice_and_unknown_id(client):
+    session = client.post("/sessions", json=generate_payload()).json()
+    assert client.post(f"/sessions/{session['id']}/choices", json={"choice_index": 7}).status_code == 422
+    assert client.get("/sessions/missing").status_code == 404
+
+def test_session_graph_forks_and_pages(client):
+    session = client.post("/sessions", json=generate_payload()).json()
+    sid = session["id"]
+    first = client.post(f"/sessions/{sid}/choices", json={"choice_index": 0}).json()
+    assert first["graph_revision"] > session["graph_revision"]
+
+    forked = client.post(f"/sessions/{sid}/fork", json={"node_id": session["head"]}).json()
+    assert forked["head"] == session["head"] and forked["act_count"] == 1
+    assert client.delete(f"/sessions/{sid}/graph/nodes/{session['head']}").status_code == 409
+    second = client.post(f"/sessions/{sid}/choices", json={"choice_index": 2}).json()
+
+    changes = client.get(f"/sessions/{sid}/graph/changes", params={"since": first["graph_revision"]}).json()
+    assert {n["id"] for n in changes["nodes"]} == {session["head"], second["head"]}
+    graph = client.get(f"/sessions/{sid}/graph", params={"limit": 2}).json()
+    assert graph["total"] == 3 and graph["next_cursor"] is not None
+    root = [n for n in graph["nodes"] if n["parent_id"] is None][0]
+    assert [n["choice"] for n in client.get(f"/sessions/{sid}/graph").json()["nodes"]] == [None, "A", "C"]
+    assert len(root["children"]) == 2
+
+    path = client.get(f"/sessions/{sid}/graph/nodes/{second['head']}/path").json()["nodes"]
+    assert [n["choice"] for n in path] == [None, "C"] and path[0]["content"] == ACT
+    assert client.delete(f"/sessions/{sid}/graph/nodes/{first['head']}").json()["removed"] == [first["head"]]
+
+def test_session_choice_served_from_prefetch(client, monkeypatch):
+    calls = []
+
+    class CountingLLM(FakeLLM):
+        async def agenerate(self, prompt):
+            calls.append(prompt)
+            await asyncio.sleep(0.01)
+            return ACT
+
+    monkeypatch.setattr(api.main, "OpenRouterLLM", CountingLLM)
+    monkeypatch.setattr(api.main.settings, "prefetch_enabled", True)
+
+    session = client.post("/sessions", json=generate_payload()).json()
+    advanced = client.post(f"/sessions/{session['id']}/choices", json={"choice": "C"}).json()
+
+    # The pick was served by one of the three speculative branches
+    assert advanced["prefetched"] is True
+    assert any("USER CHOICE SELECTED: C" in prompt for prompt in calls[1:4])
+
+def test_kept_alternates_are_added_under_the_lock_and_saved(client, monkeypatch):
+    class SlowBranchLLM(FakeLLM):
+        async def agenerate(self, prompt):
+            # The branches not picked finish only after the pick has been saved
+            await asyncio.sleep(0.2 if "SELECTED: A" in prompt or "SELECTED: B" in prompt else 0)
+            return ACT
+
+    monkeypatch.setattr(api.main, "OpenRouterLLM", SlowBranchLLM)
+    monkeypatch.setattr(api.main.settings, "prefetch_enabled", True)
+    monkeypatch.setattr(api.main.prefetcher, "keep_alternates", True)
+
+    session = client.post("/sessions", json=generate_payload()).json()
+    client.post(f"/sessions/{session['id']}/choices", json={"choice": "C"})
+    deadline = time.time() + 5
+    while time.time() < deadline and len(client.get(f"/sessions/{session['id']}/graph").json()["nodes"]) < 4:
+        time.sleep(0.02)
+
+    # Another worker (or this one after a restart of its cache) sees the saved siblings
+    api.main.sessions._sessions.clear()
+    nodes = client.get(f"/sessions/{session['id']}/graph").json()["nodes"]
+    assert sorted(n["choice"] for n in nodes if n["choice"]) == ["A", "B", "C"]
+
+def test_prefetch_drops_idle_session_semaphores():
+    prefetcher = BranchPrefetcher(per_session=2)
+
+    async def generate(choice):
+        await asyncio.sleep(0.01)
+        return choice
+
+    async def scenario():
+        prefetcher.schedule("expired", 1, ["A", "B", "C"], generate)
+        await asyncio.sleep(0)
+        running = prefetcher.stats()["sessions"]
+        await asyncio.gather(*prefetcher._tasks.values())
+        return running
+
+    # Never taken or released (the session expired): nothing is left per session
+    assert asyncio.run(scenario()) == 1 and prefetcher.stats()["sessions"] == 0
+
+@pytest.fixture
+def council(monkeypatch):
+    models = []
+
+    class CouncilLLM(FakeLLM):
+        def __init__(self, model):
+            self.model = model
+
+        async def agenerate(self, prompt):
+            if "Cyber-Consensus" in prompt:
+                return " Act. "
+            models.append(self.model)
+            speaker = prompt.split("You are ", 1)[1].split(",", 1)[0]
+            if speaker == "Duryodhana-Net":
+                raise RuntimeError("model down")  # loses only its own turns
+            await asyncio.sleep(0.05 if speaker == "Krishna-AI" else 0)
+            return f"{speaker}: Balance {{first}}." if "round 1 of" in prompt else '"Agreed."'
+
+    monkeypatch.setattr(api.council, "get_council_llm", lambda api_key=None, model=None: CouncilLLM(model))
+    return models
+
+def test_turn_runs_debate_and_act(client, council):
+    for mode in ("parallel", "pipeline"):
+        response = client.post("/turn", json=generate_payload(mode=mode, previous_context="Act 1", choice="A"))
+        assert response.status_code == 200
+        body = response.json()
+        assert body["debate"]["consensus"] == "Act."
+        assert body["story"] == ACT
+
+def test_council_debate_runs_configured_members_rounds_and_models(client, council, monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(api.main.settings, "council_models", {"Krishna-AI": "big/model"})
+    members = [
+        {"name": "Krishna-AI", "role": "Strategist", "personality": "Calm"},
+        {"name": "Vidura", "role": "Advisor", "personality": "Blunt", "model": "own/model"},
+    ]
+    payload = {"world_context": "A world", "topic": "Tax", "rounds": 3, "members": members}
+    body = client.post("/council/debate", json=payload).json()
+
+    assert [step["round"] for step in body["debate"]] == [1, 1, 2, 2, 3, 3]
+    assert body["consensus"] == "Act." and sorted(set(council)) == ["big/model", "own/model"]
+
+def test_turn_stream_interleaves_debate_turns_and_tokens(client, council):
+    with client.stream("POST", "/turn/stream", json=generate_payload(mode="pipeline")) as response:
+        body = "".join(response.iter_text())
+
+    blocks = [block.split("\n") for block in body.strip().split("\n\n")]
+    events = [lines[0][len("event: "):] for lines in blocks]
+    assert events[:5] == ["debate_turn"] * 4 + ["consensus"]
+    # Turns arrive as they complete: the slower member's turn comes second in each round
+    turns = [json.loads(lines[1][len("data: "):]) for lines in blocks[:4]]
+    assert [(t["round"], t["speaker"], t["content"]) for t in turns] == [
+        (1, "Arjuna-Logic", "Balance {first}."), (1, "Krishna-AI", "Balance {first}."),
+        (2, "Arjuna-Logic", "Agreed."), (2, "Krishna-AI", "Agreed."),
+    ]
+    assert "token" in events and events[-1] == "done"
+
+def test_generate_returns_503_when_queue_full(client, monkeypatch):
+    full = RequestScheduler(max_concurrency=0, max_queue=0)
+    monkeypatch.setattr(api.main, "get_scheduler", lambda: full)
+
+    response = client.post("/generate", json=generate_payload())
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+    assert client.get("/scheduler/stats").status_code == 200
+
+def test_metrics_and_slowest_traces(client):
+    client.post("/generate", json=generate_payload())
+    text = client.get("/metrics").text
+    assert 'narrative_stage_seconds_count{stage="prompt_build"}' in text
+    assert 'narrative_stage_seconds_count{stage="save_state"}' in text
+    assert 'http_request_seconds_count{method="POST",route="/generate",status="200"}' in text
+
+    traces = client.get("/traces/slowest").json()
+    generate = next(t for t in traces if t["name"] == "POST /generate")
+    stages = {child["name"] for child in generate["children"]}
+    assert {"build_act_specification", "prompt_build", "queue", "save_state"} <= stages
+
+def test_session_export_streams_each_format(client, tmp_path):
+    session = client.post("/sessions", json=generate_payload()).json()
+    client.post(f"/sessions/{session['id']}/choices", json={"choice_index": 1})
+
+    markdown = client.get(f"/sessions/{session['id']}/export").text
+    assert markdown.startswith("# Act 1") and markdown.count("The council convened.") == 2
+    assert "> **DECISION:** B" in markdown and "```json" not in markdown
+
+    acts = client.get(f"/sessions/{session['id']}/export?format=json").json()["acts"]
+    assert [a.get("choice") for a in acts] == [None, "B"]
+    epub = client.get(f"/sessions/{session['id']}/export?format=epub")
+    assert epub.headers["content-type"] == "application/epub+zip" and epub.content[:2] == b"PK"
+
+    # Content-hashed names: re-exporting the same session reuses the same file
+    client.get(f"/sessions/{session['id']}/export")
+    assert len(list((tmp_path / "exports").glob("act_1-*.md"))) == 1
+    assert client.get("/sessions/missing/export").status_code == 404
+
+def test_export_queue_expires_old_files_and_restarts_after_shutdown(tmp_path):
+    queue = ExportQueue(StoryExporter(str(tmp_path), max_age=60))
+    stale = tmp_path / "old_story-000000000000.md"
+    stale.write_text("# Old")
+    os.utime(stale, (time.time() - 120, time.time() - 120))
+
+    entries = lambda: [{"act": "Act 1", "content": ACT}]
+    path = queue.submit("Act 1", entries).result()
+    assert os.path.exists(path) and not stale.exists()
+    queue.shutdown()
+    # The app's lifespan shuts the writer down; a later app run gets a new one
+    assert queue.submit("Act 1", entries, "json").result().endswith(".json")
+    queue.shutdown()
+
+def test_session_export_follows_the_current_branch(client):
+    session = client.post("/sessions", json=generate_payload()).json()
+    sid = session["id"]
+    client.post(f"/sessions/{sid}/choices", json={"choice_index": 0})
+    client.post(f"/sessions/{sid}/fork", json={"node_id": session["head"]})
+    client.post(f"/sessions/{sid}/choices", json={"choice_index": 2})
+
+    acts = client.get(f"/sessions/{sid}/export?format=json").json()["acts"]
+    assert [a.get("choice") for a in acts] == [None, "C"]
+    # Once the session is gone, the branch ending at the last saved act is exported
+    client.delete(f"/sessions/{sid}")
+    acts = client.get(f"/sessions/{sid}/export?format=json").json()["acts"]
+    assert [a.get("choice") for a in acts] == [None, "C"]
+
+def test_jobs_report_partial_output_and_results(client, council, monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    jobs = JobClient("http://testserver", client=client)
+
+    streamed = []
+    result = jobs.wait(jobs.submit("generate", generate_payload()), on_text=streamed.append, poll_interval=0.01)
+    assert result["story"] == ACT and result["state"]["choices"] == ["A", "B", "C"]
+    assert result["narrative"] == "The council convened."
+    assert "".join(streamed).strip() == "The council convened."
+
+    job_id = jobs.submit("debate", {"world_context": "A world", "topic": "Tax", "rounds": 1})
+    assert jobs.wait(job_id, poll_interval=0.01)["consensus"] == "Act."
+    job = jobs.get(job_id, offset=3)
+    assert job["status"] == "succeeded" and job["offset"] == 3
+    assert job["partial"] == "una-Logic: Balance {first}.\nKrishna-AI: Balance {first}.\n"
+
+    assert client.post("/jobs", json={"kind": "generate", "params": {"model": "m"}}).status_code == 422
+    assert client.get("/jobs/missing").status_code == 404
+
+def test_jobs_queue_bound_and_cancel(client, monkeypatch):
+    idle = JobRunner(JobStore(), workers=0, max_queue=1)
+    monkeypatch.setattr(api.main, "jobs", idle)
+
+    job_id = client.post("/jobs", json={"kind": "generate", "params": generate_payload()}).json()["id"]
+    assert client.post("/jobs", json={"kind": "generate", "params": generate_payload()}).status_code == 503
+    assert client.delete(f"/jobs/{job_id}").status_code == 200
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "cancelled"
+    assert client.delete(f"/jobs/{job_id}").status_code == 409
+
+def test_job_store_spills_finished_records_to_disk(tmp_path):
+    store = JobStore(max_records=2, directory=str(tmp_path), ttl=60)
+    done = JobRecord(id="done", kind="generate", status="succeeded", finished_at=time.time(), result={"story": "S"})
+    store.add(done)
+    store.add(JobRecord(id="queued", kind="generate"))
+    store.add(JobRecord(id="running", kind="generate", status="running"))
+
+    # Only the finished record leaves memory, and it reads back from disk
+    assert len(store) == 2 and not store.owns("done") and store.spilled == 1
+    assert store.get("done").result == {"story": "S"}
+
+    store.ttl = 0
+    assert store.get("done") is None and not (tmp_path / "done.json").exists()
+
+    # With shared state, other workers answer polls from the mirrored copy
+    shared = LocalSharedState()
+    JobStore(shared=shared).add(JobRecord(id="elsewhere", kind="debate", status="running"))
+    assert JobStore(shared=shared).get("elsewhere").status == "running"
+
+def test_job_runner_mirrors_records_off_the_event_loop(tmp_path):
+    writers = []
+
+    class RecordingState(LocalSharedState):
+        def set(self, key, value, ttl=None, nx=False):
+            writers.append((threading.current_thread(), json.loads(value)))
+            return super().set(key, value, ttl, nx)
+
+    shared = RecordingState()
+    runner = JobRunner(JobStore(max_records=1, directory=str(tmp_path), shared=shared, sync_interval=0),
+                       workers=1)
+
+    async def handler(record):
+        for text in ("one ", "two"):
+            runner.progress(record, text)
+            await asyncio.sleep(0.01)
+        return {"story": "done"}
+
+    async def scenario():
+        first = await runner.submit("generate", handler)
+        second = await runner.submit("generate", handler)
+        while not (first.finished and second.finished):
+            await asyncio.sleep(0.01)
+        await runner.stop()
+        return threading.current_thread(), first
+
+    loop_thread, first = asyncio.run(scenario())
+    assert writers and all(thread is not loop_thread for thread, _ in writers)
+    # Writes land in order: the last mirrored copy of a job is its final state
+    last = {data["id"]: data for _, data in writers}
+    assert last[first.id]["status"] == "succeeded" and last[first.id]["partial"] == "one two"
+    assert (tmp_path / f"{first.id}.json").exists()  # spilled past max_records
+
+def test_stats_follow_saved_acts(client):
+    session = client.post("/sessions", json=generate_payload()).json()
+    client.post(f"/sessions/{session['id']}/choices", json={"choice_index": 1})
+    graph = client.get(f"/sessions/{session['id']}/graph").json()
+    root = next(node["id"] for node in graph["nodes"] if node["parent_id"] is None)
+
+    stats = client.get("/stats", params={"session_id": session["id"], "node_id": root}).json()
+    assert stats["summary"]["acts"] == 2 and stats["summary"]["top_choices"] == {"B": 1}
+    assert stats["node"]["choices"] == {"B": 1} and stats["node"]["branch"]["acts"] == 2
+    assert stats["session"]["nodes"][root] == {"dharma": 3, "karma": 1, "choices": {"B": 1}}
+    assert client.get("/stats", params={"node_id": "missing"}).status_code == 404
+
+def test_image_renders_from_streamed_prompt_and_serves_files(client, monkeypatch):
+    illustrated = ACT.replace('{"dharma"', '{"image_prompt": "A neon battlefield at dusk", "dharma"')
+
+    async def astream(self, prompt):
+        for i in range(0, len(illustrated), 7):
+            yield illustrated[i:i + 7]
+
+    monkeypatch.setattr(FakeLLM, "astream", astream)
+    with client.stream("POST", "/generate/stream", json=generate_payload()) as response:
+        body = "".join(response.iter_text())
+
+    blocks = body.strip().split("\n\n")
+    events = [block.split("\n")[0] for block in blocks]
+    # Queued as soon as the prompt streamed in, before the footer was complete
+    assert events.index("event: image") < events.index("event: state")
+    image = json.loads(blocks[events.index("event: image")].split("data: ", 1)[1])
+    assert image["prompt"] == "A neon battlefield at dusk"
+
+    for _ in range(100):
+        status = client.get(f"/images/{image['id']}").json()
+        if status["status"] == "done":
+            break
+        time.sleep(0.02)
+    assert status["url"] == f"/images/{image['id']}/file"
+    full = client.get(status["url"])
+    thumbnail = client.get(status["thumbnail_url"])
+    assert full.headers["content-type"] == thumbnail.headers["content-type"] == "image/png"
+    assert len(thumbnail.content) < len(full.content)
+
+    # A near-identical prompt reuses the rendered image
+    again = client.post("/images", json={"prompt": "a neon battlefield at dusk!"})
+    assert again.status_code == 202 and again.json()["id"] == image["id"]
+    assert client.get("/images/stats").json()["rendered"] == 1
+    assert client.get("/images/missing/file").status_code == 404
@@ -0,0 +1,31 @@
+import llm.factory
+import llm.router
+import llm.scheduler
+from benchmarks.compare import compare
+from benchmarks.fake_openrouter import FakeConfig
+from benchmarks.load import run_suite
+from config import settings
+
+def test_quick_benchmark_against_fake_openrouter(monkeypatch, tmp_path):
+    # run_suite repoints these globals; let monkeypatch restore them afterwards
+    monkeypatch.setenv("OPENROUTER_API_KEY", "bench-key")
+    monkeypatch.setattr(settings, "openrouter_base_url", settings.openrouter_base_url)
+    monkeypatch.setattr(llm.factory, "_shared_llms", {})
+    monkeypatch.setattr(llm.router, "_router", None)
+    monkeypatch.setattr(llm.scheduler, "_scheduler", None)
+    monkeypatch.chdir(tmp_path)
+
+    config = FakeConfig(latency_median=0.001, tokens_per_second=0, rate_limit_every=4,
+                        rate_limit_burst=1, retry_after=0, malformed_rate=0.5)
+    report = run_suite([2], 1, config, ["generate", "council"])
+
+    assert report["upstream"]["rate_limited"] >= 1
+    rows = {row["scenario"]: row for row in report["results"]}
+    for name in ("/generate", "/council/debate"):
+        assert rows[name]["ok"] == 2 and not rows[name]["errors"]
+        assert rows[name]["p50"] <= rows[name]["p99"]
+
+    results = {(r["scenario"], r["concurrency"]): r for r in report["results"]}
+    slower = {key: dict(row, p99=row["p99"] * 2) for key, row in results.items()}
+    _, regressions = compare(results, slower, threshold=0.2)
+    assert len(regressions) == 2
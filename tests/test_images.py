@@ -0,0 +1,70 @@
+import asyncio
+
+from image.base import StubImageProvider
+from image.cache import ImageCache
+from image.queue import DONE, ImageQueue
+from llm.scheduler import PRIORITY_INTERACTIVE, PRIORITY_PREFETCH
+
+PROMPT = "A neon battlefield at dusk, drones circling over a chrome citadel"
+
+def test_cache_dedups_near_identical_prompts_and_persists(tmp_path):
+    cache = ImageCache(str(tmp_path))
+    params = {"provider": "stub", "width": 64, "height": 32}
+    entry, existing = cache.reserve(PROMPT, params)
+    assert not existing
+    # Case, punctuation and filler words are near-duplicates; a different scene is not
+    assert cache.reserve(PROMPT.upper() + "!", params)[0].key == entry.key
+    assert cache.reserve("Neon battlefield at dusk with drones circling over the chrome citadel",
+                         params)[0].key == entry.key
+    assert cache.reserve(PROMPT.replace("dusk", "dawn"), params)[0].key != entry.key
+    assert cache.reserve("A quiet monastery in the snow", params)[0].key != entry.key
+    assert cache.reserve(PROMPT, {**params, "width": 128})[0].key != entry.key
+
+    data = StubImageProvider().generate(PROMPT, 64, 32)
+    cache.put(entry.key, data)
+    reloaded = ImageCache(str(tmp_path))
+    assert open(reloaded.path(entry.key), "rb").read() == data
+    assert reloaded.path(entry.key, thumbnail=True) == reloaded.path(entry.key)
+    assert reloaded.reserve(PROMPT.replace("A neon", "The neon"), params) == (reloaded.get(entry.key), True)
+    assert reloaded.stats() == {"entries": 1, "exact_hits": 0, "near_hits": 1}
+
+def test_queue_limits_concurrency_and_orders_by_priority_then_session(tmp_path):
+    provider = StubImageProvider(delay=0.02)
+    started = []
+    running, peak = 0, 0
+    render = provider.agenerate
+
+    async def tracked(prompt, width, height):
+        nonlocal running, peak
+        started.append(prompt)
+        running += 1
+        peak = max(peak, running)
+        try:
+            return await render(prompt, width, height)
+        finally:
+            running -= 1
+
+    provider.agenerate = tracked
+    queue = ImageQueue(provider, ImageCache(str(tmp_path)), width=64, height=32, thumbnail_width=16,
+                       max_concurrency=2, per_session=1)
+
+    async def scenario():
+        busy = [queue.submit(f"busy session picture number {i}", "busy") for i in range(3)]
+        other = queue.submit("a storm over the river delta", "other")
+        later = queue.submit("a quiet monastery in the snow", "calm", PRIORITY_PREFETCH)
+        first = queue.submit("a chariot race through neon streets", "calm", PRIORITY_INTERACTIVE)
+        jobs = [*busy, other, later, first]
+        while not all(job.finished for job in jobs):
+            await asyncio.sleep(0.01)
+        await queue.stop()
+        return jobs
+
+    jobs = asyncio.run(scenario())
+    assert all(job.status == DONE for job in jobs)
+    assert peak == 2  # two renders overall, one per session at a time
+    # The calm session's interactive image overtakes its own prefetch and the busy backlog
+    assert started[:2] == ["busy session picture number 0", "a storm over the river delta"]
+    order = {prompt: i for i, prompt in enumerate(started)}
+    assert order["a chariot race through neon streets"] < order["busy session picture number 2"]
+    assert order["a chariot race through neon streets"] < order["a quiet monastery in the snow"]
+    assert open(queue.path(jobs[0].id, thumbnail=True), "rb").read() == provider.generate(jobs[0].prompt, 16, 8)
@@ -1,6 +1,16 @@
+import asyncio
+import json
+import time
+import httpx
 import pytest
-from llm.provider import MockLLM, OpenRouterLLM
+from llm.provider import MockLLM, OpenRouterLLM, FALLBACK_MODELS
 from common.constants import LLMStrategyType
+from llm.http import set_async_client, close_async_client
+from llm.cache import CachedLLM, ResponseCache
+import llm.factory
+from llm.factory import get_shared_llm
+from llm.router import ModelRouter
+from llm.scheduler import PRIORITY_BATCH, PRIORITY_INTERACTIVE, RequestScheduler, TokenBucket
 
 def test_mock_llm_generation():
     llm = MockLLM()
@@ -11,3 +21,303 @@ def test_openrouter_init_without_key(monkeypatch):
     monkeypatch.delenv("OPENROUTER_API_KEY", raising=False)
     with pytest.raises(ValueError, match="OPENROUTER_API_KEY environment variable is not set"):
         OpenRouterLLM()
+
+def test_mock_llm_agenerate():
+    response = asyncio.run(MockLLM().agenerate("Test prompt"))
+    assert "mock response" in response
+
+def test_openrouter_agenerate_routes_around_rate_limits(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    calls = []
+
+    def handler(request):
+        model = json.loads(request.content)["model"]
+        calls.append(model)
+        if model == "test/model":
+            return httpx.Response(429, headers={"Retry-After": "120"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": f"Act by {model}"}}]})
+
+    async def run():
+        set_async_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            llm = OpenRouterLLM(model="test/model", backoff=0, router=ModelRouter())
+            first = await llm.agenerate("a")
+            # The tripped model is skipped, and the pooled client serves concurrent calls
+            rest = await asyncio.gather(llm.agenerate("b"), llm.agenerate("c"))
+            return [first, *rest]
+        finally:
+            await close_async_client()
+
+    fallback = FALLBACK_MODELS[0]
+    assert asyncio.run(run()) == [f"Act by {fallback}"] * 3
+    assert calls == ["test/model", fallback, fallback, fallback]
+
+def test_model_router_orders_by_health_and_probes_half_open():
+    now = [0.0]
+    router = ModelRouter(failure_threshold=2, cooldown=10, clock=lambda: now[0])
+    router.record_success("slow", 5.0)
+    router.record_success("fast", 1.0)
+    assert router.order(["slow", "fast", "new"]) == ["fast", "slow", "new"]
+
+    router.record_failure("fast")
+    router.record_failure("fast")
+    assert "fast" not in router.order(["slow", "fast"])
+
+    now[0] = 11.0
+    assert router.begin("fast")  # half-open probe
+    assert not router.begin("fast")  # only one probe at a time
+    router.record_success("fast", 1.0)
+    assert router.order(["slow", "fast"])[0] == "fast"
+
+def test_openrouter_hedges_slow_primary(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+
+    async def handler(request):
+        model = json.loads(request.content)["model"]
+        if model == "slow/model":
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"choices": [{"message": {"content": model}}]})
+
+    async def run():
+        set_async_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            llm = OpenRouterLLM(model="slow/model", router=ModelRouter(adaptive=False), hedge_after=0.05)
+            return await llm.agenerate("a")
+        finally:
+            await close_async_client()
+
+    assert asyncio.run(run()) == FALLBACK_MODELS[0]
+
+def test_cancelled_half_open_probe_frees_the_model(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    now = [0.0]
+    router = ModelRouter(adaptive=False, failure_threshold=1, cooldown=10, clock=lambda: now[0])
+    router.record_failure("slow/model")
+    now[0] = 11.0  # cooldown over: the next call is the half-open probe
+
+    async def handler(request):
+        model = json.loads(request.content)["model"]
+        if model == "slow/model":
+            await asyncio.sleep(1)
+        return httpx.Response(200, json={"choices": [{"message": {"content": model}}]})
+
+    async def run():
+        set_async_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            llm = OpenRouterLLM(model="slow/model", router=router, hedge_after=0.05)
+            return await llm.agenerate("a")
+        finally:
+            await close_async_client()
+
+    # The hedge wins and the probe is cancelled without an outcome
+    assert asyncio.run(run()) == FALLBACK_MODELS[0]
+    assert router.begin("slow/model")
+
+def test_openrouter_astream_yields_deltas(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    body = "".join(
+        f"data: {json.dumps({'choices': [{'delta': {'content': t}}]})}\n\n" for t in ["Once ", "upon"]
+    ) + ": OPENROUTER PROCESSING\n\ndata: [DONE]\n\n"
+
+    def handler(request):
+        assert json.loads(request.content)["stream"] is True
+        return httpx.Response(200, text=body)
+
+    async def run():
+        set_async_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            return [t async for t in OpenRouterLLM(model="test/model").astream("p")]
+        finally:
+            await close_async_client()
+
+    assert asyncio.run(run()) == ["Once ", "upon"]
+
+class CountingLLM(MockLLM):
+    def __init__(self, model="count/model"):
+        self.model = model
+        self.calls = 0
+
+    def generate(self, prompt: str) -> str:
+        self.calls += 1
+        return f"story for {prompt}"
+
+def test_cached_llm_serves_repeats_from_memory():
+    inner = CountingLLM()
+    llm = CachedLLM(inner, ResponseCache(max_entries=2))
+
+    assert llm.generate("a") == llm.generate("a") == "story for a"
+    assert asyncio.run(llm.agenerate("a")) == "story for a"
+    assert inner.calls == 1
+    # A different model is a different cache key
+    assert CachedLLM(CountingLLM("other/model"), llm.cache).generate("a") == "story for a"
+    assert llm.cache.stats()["misses"] == 2
+
+def test_response_cache_lru_ttl_and_disk_tier(tmp_path, monkeypatch):
+    cache = ResponseCache(max_entries=1, ttl=10, disk_dir=str(tmp_path))
+    cache.set("k1", "v1")
+    cache.set("k2", "v2")
+    # k1 fell out of memory but is still on disk
+    assert cache.get("k1") == "v1"
+    assert cache.stats()["disk_hits"] == 1
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 60)
+    assert cache.get("k1") is None
+    assert cache.get("k2") is None
+
+def test_scheduler_priority_and_fairness():
+    order = []
+
+    async def job(scheduler, key, priority, name):
+        async with scheduler.slot(key, "m", priority):
+            order.append(name)
+            await asyncio.sleep(0)
+
+    async def run():
+        scheduler = RequestScheduler(max_concurrency=1, rate=1000, burst=1000)
+        async with scheduler.slot("busy", "m"):
+            # Queue while the only slot is held
+            tasks = [
+                asyncio.create_task(job(scheduler, "batch", PRIORITY_BATCH, "batch")),
+                asyncio.create_task(job(scheduler, "a", PRIORITY_INTERACTIVE, "a1")),
+                asyncio.create_task(job(scheduler, "a", PRIORITY_INTERACTIVE, "a2")),
+                asyncio.create_task(job(scheduler, "b", PRIORITY_INTERACTIVE, "b1")),
+            ]
+            await asyncio.sleep(0)
+            assert scheduler.stats()["queue_depth"] == 4
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run())
+    # Key b is not stuck behind key a's backlog; batch work goes last
+    assert order == ["a1", "b1", "a2", "batch"]
+
+def test_scheduler_forgets_keys_once_served():
+    async def run():
+        scheduler = RequestScheduler(max_concurrency=1, rate=1000, burst=1000)
+        for i in range(50):
+            async with scheduler.slot(f"client-{i}", "m"):
+                pass
+        return scheduler
+
+    # One-off API keys do not accumulate fairness state
+    assert asyncio.run(run())._key_finish == {}
+
+def test_shared_llms_are_bounded_and_keep_no_client_keys(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "server-key")
+    monkeypatch.setattr(llm.factory, "_shared_llms", {})
+    monkeypatch.setattr(llm.factory, "MAX_SHARED_LLMS", 2)
+
+    assert get_shared_llm("m1") is get_shared_llm("m1")
+    client_llm = get_shared_llm("m1", "sk-client")
+    assert client_llm is not get_shared_llm("m1", "sk-client") and client_llm.api_key == "sk-client"
+    get_shared_llm("m2")
+    get_shared_llm("m1")
+    get_shared_llm("m3")  # evicts m2, the least recently used
+    assert [key[0] for key in llm.factory._shared_llms] == ["m1", "m3"]
+
+def test_rate_limited_key_does_not_hold_a_slot():
+    done = []
+
+    async def job(scheduler, key):
+        async with scheduler.slot(key, "m"):
+            done.append(key)
+
+    async def run():
+        scheduler = RequestScheduler(max_concurrency=1, rate=2.0, burst=1)
+        await job(scheduler, "throttled")  # spends its only token
+        started = time.monotonic()
+        throttled = asyncio.create_task(job(scheduler, "throttled"))
+        await asyncio.sleep(0)
+        await job(scheduler, "other")
+        other_took = time.monotonic() - started
+        await throttled
+        return other_took
+
+    # The other key runs at once instead of waiting out the throttled key's 0.5s
+    assert asyncio.run(run()) < 0.25
+    assert done == ["throttled", "other", "throttled"]
+
+def test_scheduler_drops_refilled_buckets():
+    now = [0.0]
+    scheduler = RequestScheduler(rate=10.0, burst=2, clock=lambda: now[0])
+    for i in range(200):
+        scheduler._bucket_wait(f"client-{i}", "m")
+        now[0] += 0.05  # each bucket is full again 0.1s after its one call
+
+    assert len(scheduler._buckets) <= 64
+
+def test_token_bucket_smooths_bursts():
+    bucket = TokenBucket(rate=2.0, capacity=2, now=0.0)
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == 0.0
+    assert bucket.reserve(0.0) == pytest.approx(0.5)
+
+def test_openrouter_json_mode_falls_back_when_rejected(monkeypatch):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    payloads = []
+
+    def handler(request):
+        payload = json.loads(request.content)
+        payloads.append(payload)
+        if "response_format" in payload:
+            return httpx.Response(400, json={"error": "response_format is not supported"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": '{"ok": true}'}}]})
+
+    async def run():
+        set_async_client(httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            llm = OpenRouterLLM(model="json/model", backoff=0, router=ModelRouter(), json_mode=True)
+            return await llm.agenerate("a"), await llm.agenerate("b"), llm.router.snapshot()
+        finally:
+            await close_async_client()
+
+    first, second, health = asyncio.run(run())
+    assert first == second == '{"ok": true}'
+    # Rejected once, then plain requests; the model is not counted as failing
+    assert [("response_format" in p) for p in payloads] == [True, False, False]
+    assert health["json/model"]["success_rate"] == 1.0
+
+CATALOG = {"data": [
+    {"id": "small:free", "context_length": 4096, "pricing": {"prompt": "0", "completion": "0"},
+     "supported_parameters": ["response_format"]},
+    {"id": "large:free", "context_length": 131072, "pricing": {"prompt": "0", "completion": "0"}},
+    {"id": "paid", "context_length": 200000, "pricing": {"prompt": "0.000003", "completion": "0.000015"},
+     "supported_parameters": ["response_format"]},
+]}
+
+def test_model_catalog_revalidates_with_etag_and_caches_on_disk(tmp_path):
+    seen = []
+
+    def handler(request):
+        seen.append(request.headers.get("If-None-Match"))
+        if request.headers.get("If-None-Match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, json=CATALOG, headers={"ETag": '"v1"'})
+
+    from llm.catalog import DEFAULT_MODELS, ModelCatalog
+    path = tmp_path / "catalog.json"
+    client = httpx.Client(transport=httpx.MockTransport(handler))
+    catalog = ModelCatalog("http://test/models", cache_path=str(path), client=client)
+    assert catalog.ids() == DEFAULT_MODELS and catalog.select(["x"], 10_000) == ["x"]
+
+    assert catalog.refresh() and not catalog.refresh()  # fresh: no request
+    assert not catalog.refresh(force=True)               # 304: body kept
+    assert seen == [None, '"v1"'] and len(catalog) == 3
+
+    # A new process starts from the disk copy without fetching
+    reloaded = ModelCatalog("http://test/models", cache_path=str(path), client=client)
+    assert reloaded.fresh and reloaded.etag == '"v1"' and len(seen) == 2
+    assert reloaded.ids(free=True) == ["large:free", "small:free"]
+    assert [m.id for m in reloaded.query(min_context=8000)] == ["large:free", "paid"]
+    assert reloaded.supports_json("small:free") and reloaded.supports_json("large:free") is False
+    # Preferred models that are too small (or gone) give way to free ones that fit
+    assert reloaded.select(["small:free", "gone"], tokens=10_000) == ["large:free"]
+    assert reloaded.select(["paid"], tokens=1000, json_mode=True, limit=2) == ["paid", "small:free"]
+
+def test_openrouter_skips_models_the_prompt_overflows(monkeypatch, offline_catalog):
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    offline_catalog._install(CATALOG["data"])
+    offline_catalog._loaded = True
+    llm = OpenRouterLLM(model="small:free", backoff=0, router=ModelRouter())
+    assert llm._candidate_models("short")[0] == "small:free"
+    assert llm._candidate_models("word " * 20_000)[0] == "large:free"
@@ -0,0 +1,151 @@
+import asyncio
+import time
+
+import pytest
+
+from api.sessions import SessionStore
+from common.shared import LocalSharedState, RedisSharedState, SharedStateError, create_shared_state
+from llm.cache import ResponseCache
+from llm.scheduler import shared_bucket_wait
+
+ACT = 'Act.\n```json\n{"dharma": 5, "karma": 1, "inventory": ["Key"], "choices": ["A", "B"]}\n```'
+
+
+@pytest.fixture(params=["local", "resp"])
+def shared(request, resp_server):
+    if request.param == "local":
+        yield LocalSharedState()
+    else:
+        state = create_shared_state(resp_server.url)
+        yield state
+        state.close()
+
+
+def test_kv_lists_and_expiry(shared):
+    assert shared.set("k", "v") and shared.get("k") == "v"
+    assert not shared.set("k", "other", nx=True) and shared.get("k") == "v"
+    assert shared.delete("k") and shared.get("k") is None
+    assert shared.incr("n") == 1 and shared.incr("n", 5) == 6
+
+    shared.set("short", "x", ttl=0.05)
+    time.sleep(0.1)
+    assert shared.get("short") is None
+
+    assert shared.rpush("list", "a", "b", "c") == 3
+    assert shared.lrange("list", 1, -1) == ["b", "c"] and shared.llen("list") == 3
+    with pytest.raises(SharedStateError):
+        shared.get("list")
+
+
+def test_pubsub_and_locks(shared):
+    with shared.subscribe("events") as subscription:
+        assert shared.publish("events", "hello") == 1
+        assert subscription.get(timeout=1) == "hello"
+        assert subscription.get(timeout=0.05) is None
+
+    with shared.subscribe("idle") as subscription:
+        # An idle timeout must leave the subscription usable
+        assert subscription.get(timeout=0.05) is None
+        shared.publish("idle", "later")
+        assert subscription.get(timeout=1) == "later"
+
+    lock = shared.lock("job", ttl=5)
+    assert lock.acquire()
+    assert not shared.lock("job", timeout=0.05).acquire()
+    lock.release()
+
+    # A holder whose lock expired must not release the next holder's
+    stale = shared.lock("expiring", ttl=0.05)
+    assert stale.acquire()
+    time.sleep(0.1)
+    current = shared.lock("expiring", ttl=5)
+    assert current.acquire()
+    stale.release()
+    assert shared.get("lock:expiring") == current.token
+    current.release()
+
+    async def contend():
+        order = []
+
+        async def worker(name):
+            async with shared.lock("section", timeout=2):
+                order.append(name)
+                await asyncio.sleep(0.02)
+                order.append(name)
+
+        await asyncio.gather(worker("a"), worker("b"))
+        return order
+
+    order = asyncio.run(contend())
+    assert order[0] == order[1] and order[2] == order[3]
+
+
+def test_session_eviction_bounds_the_snapshots_it_holds(shared):
+    store = SessionStore(max_sessions=2, shared=shared)
+    ids = [store.create("model", f"Act {i}", "A world").id for i in range(3)]
+
+    assert len(store) == 2
+    # In-process state ends the evicted session; a remote store keeps it for other workers
+    evicted = shared.get(f"session:{ids[0]}")
+    assert (evicted is None) == (not shared.remote)
+    assert all(shared.get(f"session:{sid}") is not None for sid in ids[1:])
+
+
+def test_workers_share_sessions_cache_and_rate_limits(shared):
+    # Two stores on one backend behave like two API workers
+    first, second = SessionStore(shared=shared), SessionStore(shared=shared)
+    session = first.create("model", "Act 1", "A world", api_key="sk-client-secret")
+
+    async def advance(store, live, choice=None):
+        async with store.locked(live) as current:
+            current.apply_act(ACT, choice)
+
+    asyncio.run(advance(first, session))
+    other = second.get(session.id)
+    assert other is not session and other.acts == [ACT] and other.inventory == ["Key"]
+    # Request-supplied keys never reach the shared state
+    assert "sk-client-secret" not in shared.get(f"session:{session.id}")
+    assert other.api_key is None and session.api_key == "sk-client-secret"
+
+    asyncio.run(advance(second, other, "A"))
+    assert first.get(session.id) is session  # reloaded in place
+    assert session.decisions == ["A"] and session.dharma == 10 and len(session.graph) == 2
+    assert session.api_key == "sk-client-secret"
+    first._sessions.clear()  # evicted locally: rebuilt from the snapshot, key from memory
+    assert first.get(session.id).api_key == "sk-client-secret"
+
+    assert second.delete(session.id) and first.get(session.id) is None
+
+    ResponseCache(shared=shared).set("key", "generation")
+    cache = ResponseCache(shared=shared)
+    assert cache.get("key") == "generation" and cache.stats()["shared_hits"] == 1
+
+    waits = [shared_bucket_wait(shared, "k:m", rate=10.0, capacity=2) for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0] and 0.05 < waits[2] < waits[3] <= 0.2
+
+
+def test_resp_client_reconnects(resp_server):
+    state = RedisSharedState.from_url(resp_server.url)
+    state.set("k", "v")
+    state._local.conn.sock.close()
+    assert state.get("k") == "v"
+
+
+def test_resp_client_never_resends_a_written_command(resp_server, monkeypatch):
+    state = RedisSharedState.from_url(resp_server.url)
+    state.rpush("history", "first")
+    conn = state._local.conn
+
+    def lose_reply():
+        raise TimeoutError("timed out")
+
+    monkeypatch.setattr(conn.reader, "readline", lose_reply)
+    with pytest.raises(SharedStateError):
+        state.rpush("history", "second")
+    assert state._local.conn is None and conn.sock.fileno() == -1
+    # Applied once by the server, not retried by the client
+    deadline = time.monotonic() + 1
+    while state.llen("history") < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert state.lrange("history", 0, -1) == ["first", "second"]
+    assert create_shared_state(None).__class__ is LocalSharedState
@@ -0,0 +1,37 @@
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+# Generous for slow CI machines; a mock run takes well under half a second locally
+STARTUP_BUDGET = float(os.environ.get("STARTUP_BUDGET", "2.0"))
+
+
+def run_mock(tmp_path, *args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, str(ROOT / "run.py"), "--llm", "mock", *args],
+                            cwd=tmp_path, capture_output=True, text=True, timeout=60)
+    return result, time.perf_counter() - start
+
+
+def test_mock_run_cold_start_stays_within_budget(tmp_path):
+    run_mock(tmp_path)  # warm the bytecode cache; the budget is for process start, not compilation
+    result, elapsed = run_mock(tmp_path)
+    assert result.returncode == 0, result.stderr
+    assert "mock response" in result.stdout
+    assert elapsed < STARTUP_BUDGET, f"run.py --llm mock took {elapsed:.2f}s (budget {STARTUP_BUDGET}s)"
+
+
+def test_mock_path_skips_http_stack_and_reports_imports(tmp_path):
+    result, _ = run_mock(tmp_path, "--profile-startup")
+    assert result.returncode == 0, result.stderr
+    assert "Startup:" in result.stderr and "config" in result.stderr
+
+    # Settings are built on first use, not at import; the mock provider needs no HTTP client
+    probe = ("import sys, config, llm.factory, story.spec, prompts; print(config._settings is None); "
+             "llm.factory.get_llm('mock').generate('x'); "
+             "print(sorted(m for m in ('httpx', 'requests', 'llm.provider') if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, timeout=60)
+    assert out.stdout.split() == ["True", "[]"], out.stderr
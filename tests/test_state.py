@@ -0,0 +1,154 @@
+import json
+import multiprocessing
+import numpy as np
+import pytest
+
+from common.state import StateManager
+from common.store import JsonlStoryStore, SqliteStoryStore, get_store, migrate_once
+from story.analytics import StoryAnalytics, distribution
+
+@pytest.fixture(params=["jsonl", "sqlite", "shared"])
+def manager(request, tmp_path):
+    return StateManager(str(tmp_path / "story_state.json"), backend=request.param)
+
+def test_save_and_filter_by_act(manager):
+    manager.save_state("Act 1", "first")
+    manager.save_state("Act 2", "second", session_id="s1")
+    manager.save_state("Act 1", "third")
+
+    assert [e["content"] for e in manager.iter_history(act="Act 1")] == ["first", "third"]
+    assert [e["content"] for e in manager.iter_history(session_id="s1")] == ["second"]
+    assert len(manager.load_state()["history"]) == 3
+
+def test_filter_by_timestamp(manager):
+    manager.save_state("Act 1", "old")
+    cutoff = "9999"
+    assert list(manager.iter_history(since=cutoff)) == []
+    assert len(list(manager.iter_history(until=cutoff))) == 1
+
+def test_legacy_json_is_migrated_once(tmp_path):
+    legacy = tmp_path / "story_state.json"
+    legacy.write_text(json.dumps({"history": [
+        {"timestamp": "2026-01-01T00:00:00", "act": "Old Act", "content": "legacy"}
+    ]}))
+
+    manager = StateManager(str(legacy), backend="jsonl")
+    manager.save_state("New Act", "fresh")
+
+    assert [e["content"] for e in manager.iter_history()] == ["legacy", "fresh"]
+    # A fresh store instance reads the index instead of migrating again
+    assert JsonlStoryStore(str(tmp_path / "story_state.jsonl")).count() == 2
+
+def test_legacy_migration_resumes_and_runs_once_across_workers(tmp_path):
+    history = [{"timestamp": f"2026-01-0{i}", "act": "Old Act", "content": c} for i, c in enumerate("abc", 1)]
+    legacy = tmp_path / "story_state.json"
+    legacy.write_text(json.dumps({"history": history}))
+    path = str(tmp_path / "story_state.jsonl")
+    JsonlStoryStore(path).append(history[0])  # a previous run crashed after one entry
+
+    assert migrate_once(str(legacy), JsonlStoryStore(path), path) == 2
+    # Another worker starting later finds the completion marker
+    assert migrate_once(str(legacy), JsonlStoryStore(path), path) == 0
+    assert [e["content"] for e in JsonlStoryStore(path).iter_entries()] == ["a", "b", "c"]
+
+def test_sqlite_reads_in_pages(tmp_path):
+    store = SqliteStoryStore(str(tmp_path / "story.sqlite3"))
+    store.page_size = 2
+    for i in range(5):
+        store.append({"timestamp": str(i), "act": "A" if i % 2 == 0 else "B", "content": str(i)})
+    assert [e["content"] for e in store.iter_entries(act="A")] == ["0", "2", "4"]
+    assert [e["content"] for e in store.iter_from(1)] == ["1", "2", "3", "4"]
+    assert list(store.iter_from(5)) == []
+
+def test_jsonl_recovers_unindexed_and_torn_entries(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    store = JsonlStoryStore(path)
+    store.append({"timestamp": "t1", "act": "A", "content": "one"})
+    # Simulate a crash: a complete line missing from the index, then a torn line
+    with open(path, "a") as f:
+        f.write(json.dumps({"timestamp": "t2", "act": "B", "content": "two"}) + "\n")
+        f.write('{"timestamp": "t3", "act"')
+
+    reopened = JsonlStoryStore(path)
+    reopened.append({"timestamp": "t4", "act": "A", "content": "four"})
+    assert [e["content"] for e in reopened.iter_entries()] == ["one", "two", "four"]
+
+def _append_many(path, worker):
+    store = JsonlStoryStore(path)
+    for i in range(20):
+        store.append({"timestamp": f"{worker}-{i}", "act": f"W{worker}", "content": "x" * 500})
+
+def test_jsonl_concurrent_writers(tmp_path):
+    path = str(tmp_path / "log.jsonl")
+    procs = [multiprocessing.Process(target=_append_many, args=(path, w)) for w in range(3)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+
+    store = JsonlStoryStore(path)
+    assert store.count() == 60
+    assert len(list(store.iter_entries(act="W1"))) == 20
+
+def scored_act(dharma, karma):
+    footer = {"dharma": dharma, "karma": karma, "inventory": ["Key"], "choices": ["A", "B"]}
+    return f"Text.\n```json\n{json.dumps(footer)}\n```"
+
+def test_analytics_aggregate_acts_as_they_are_saved(manager):
+    manager.save_state("Act 1", scored_act(10, 1), session_id="s1", node_id="root")
+    manager.save_state("Act 1", scored_act(-5, 2), session_id="s1", choice="A", node_id="a", parent_id="root")
+    manager.save_state("Act 1", scored_act(95, 0), session_id="s1", choice="B", node_id="b", parent_id="root")
+    manager.save_state("Act 1", scored_act(3, 3), session_id="s1", choice="A", node_id="aa", parent_id="a")
+    manager.save_state("Act 2", "No footer.")
+    assert list(manager.store.iter_from(3))[0]["node_id"] == "aa"
+
+    stats = manager.analytics
+    summary = stats.summary()
+    assert summary["acts"] == 5 and summary["parsed"] == 4 and summary["top_choices"] == {"A": 2, "B": 1}
+    assert stats.act("Act 1")["dharma"]["histogram"] == {"-5": 1, "0": 1, "10": 1, "95": 1}
+
+    # Standings accumulate along each branch; a branch covers the node's whole subtree
+    root = stats.node("root")
+    assert root["choices"] == {"A": 1, "B": 1}
+    assert root["branch"]["acts"] == 4 and root["branch"]["dharma"]["mean"] == 30.75
+    assert stats.node("b")["dharma"] == 100 and stats.node("missing") is None
+    assert stats.session("s1")["nodes"]["aa"] == {"dharma": 8, "karma": 6, "choices": {}}
+
+def test_analytics_survives_huge_scores_and_bad_entries(manager, monkeypatch):
+    import story.analytics
+    manager.save_state("Act 1", scored_act(0, 3_000_000_000), session_id="s", node_id="n1")
+    manager.save_state("Act 1", scored_act(0, -500_000_000), session_id="s", node_id="n2", parent_id="n1")
+    manager.save_state("Act 1", scored_act(0, 500_000_000), session_id="s", node_id="n3", parent_id="n2")
+
+    karma = manager.analytics.summary()["karma"]  # no allocation over the value range
+    limit = story.analytics.SCORE_LIMIT
+    assert (karma["count"], karma["min"], karma["max"]) == (3, -limit, limit)
+    assert manager.analytics.node("n3")["karma"] == limit
+
+    extract_act = story.analytics.extract_act
+    def flaky(content):
+        if "Broken" in content:
+            raise ValueError("unreadable")
+        return extract_act(content)
+    monkeypatch.setattr(story.analytics, "extract_act", flaky)
+    manager.save_state("Act 2", "Broken act.")
+    manager.save_state("Act 2", scored_act(4, 0), session_id="s", choice="A", node_id="n4", parent_id="n3")
+
+    # The bad entry is skipped once; later acts still land in their own rows
+    assert manager.analytics.summary()["acts"] == 5
+    assert manager.analytics.node("n4")["dharma"] == 4 and manager.analytics.sync() == 0
+
+def test_distribution_memory_follows_rows_not_range():
+    stats = distribution(np.array([500_000_000, -500_000_000, 3, 4, 12], dtype=np.int64))
+    assert (stats["min"], stats["max"], stats["count"]) == (-500_000_000, 500_000_000, 5)
+    assert stats["histogram"] == {"-500000000": 1, "0": 2, "10": 1, "500000000": 1}
+
+def test_analytics_snapshot_resumes_and_catches_up(tmp_path):
+    manager = StateManager(str(tmp_path / "story_state.json"), backend="jsonl")
+    manager.save_state("Act 1", scored_act(10, 1), session_id="s", node_id="n1")
+    manager.analytics.save()
+    manager.save_state("Act 1", scored_act(5, 1), session_id="s", choice="A", node_id="n2", parent_id="n1")
+
+    restored = StoryAnalytics(manager.store, manager.analytics.path)
+    assert len(restored) == 1  # the snapshot, without re-parsing the act
+    assert restored.node("n2")["dharma"] == 15 and restored.node("n1")["choices"] == {"A": 1}
@@ -1,5 +1,14 @@
+import json
+import numpy as np
 from config import CharacterData, WorldConfig
-from story.spec import build_act_specification
+from story.spec import act_for, build_act_specification, default_world_spec
+from prompts import build_prompt, static_prefix
+from story.footer import FooterParser, parse_story_footer
+from story.extraction import JsonScanner, extract_act, loads_tolerant
+from story.batch import BatchRunner, Checkpoint, JsonlSink, load_manifest
+from story.context import StoryContextManager, build_bounded_context, estimate_tokens, split_acts
+from story.graph import StoryGraph
+from story.memory import StoryMemory, VectorStore, chunk_text
 
 def test_build_act_specification():
     char_data = CharacterData(
@@ -21,3 +30,216 @@ def test_build_act_specification():
     assert spec.characters[0].name == "Faction A"
     assert spec.characters[2].role == "Advisor"
     assert spec.world_context["description"] == "A dark world"
+
+def test_world_override_builds_new_spec_and_shares_prompt_prefix():
+    from config import settings
+    configured = settings.world.description
+    base = default_world_spec()
+    custom = default_world_spec("A drowned world")
+
+    assert custom is not base and custom.description == "A drowned world"
+    assert settings.world.description == configured
+    assert default_world_spec() is base and hash(base) == hash(default_world_spec(configured))
+
+    first = build_prompt().handle({"spec": act_for(base, "Act 1")})
+    second = build_prompt().handle({"spec": act_for(base, "Act 2"), "previous_context": "Earlier."})
+    # Stable world/format block first, act-specific text after it
+    assert first["prompt_prefix"] is second["prompt_prefix"]
+    assert second["final_prompt"].startswith(second["prompt_prefix"])
+    assert 'titled "Act 2"' in second["final_prompt"][len(second["prompt_prefix"]):]
+    assert static_prefix.cache_info().hits >= 1
+
+def test_footer_parser_splits_streamed_footer():
+    text = 'Arjuna hesitated.\n```json\n{"dharma": 5, "choices": ["A", "B", "C"]}\n```'
+    parser = FooterParser()
+    narrative = ""
+    # Feed in small chunks so the fence is split across boundaries
+    for i in range(0, len(text), 3):
+        narrative += parser.feed(text[i:i + 3])
+    narrative += parser.finish()
+
+    assert narrative == "Arjuna hesitated.\n"
+    assert parser.data == {"dharma": 5, "choices": ["A", "B", "C"]}
+
+def test_footer_parser_exposes_image_prompt_before_footer_closes():
+    parser = FooterParser()
+    parser.feed('Story.\n```json\n{"image_prompt": "A \\"neon\\" ci')
+    assert parser.image_prompt is None
+    parser.feed('ty", "dharma": 2')
+    assert not parser.closed
+    assert parser.image_prompt == 'A "neon" city'
+
+def test_parse_story_footer_without_block():
+    content, data = parse_story_footer("Just a story.")
+    assert content == "Just a story."
+    assert data is None
+
+def test_loads_tolerant_repairs_common_model_mistakes():
+    assert loads_tolerant('Sure! {"a": 1, "b": [1, 2,],}') == {"a": 1, "b": [1, 2]}
+    assert loads_tolerant("{choices: ['x'], done: True}") is None  # single quotes stay invalid
+    assert loads_tolerant('{choices: ["x"], done: True}') == {"choices": ["x"], "done": True}
+    # Truncated mid-string: close the string and the open brackets
+    assert loads_tolerant('{"choices": ["Fight", "Fle') == {"choices": ["Fight", "Fle"]}
+
+def test_json_scanner_finds_objects_across_chunks():
+    text = 'turns: {"speaker": "A", "content": "a } in text"}, {"speaker": "B", "content": "b"}] {"x": 1}'
+    scanner = JsonScanner(until="]")
+    found = []
+    for i in range(0, len(text), 4):
+        found += scanner.feed(text[i:i + 4])
+    assert [json.loads(raw)["speaker"] for raw in found] == ["A", "B"]
+    assert scanner.done
+
+def test_extract_act_validates_and_coerces_footer():
+    narrative, state = extract_act('The gate fell.\n```json\n{"dharma": "+5", "karma": null, "choices": ["A", "B"],}\n```')
+    assert narrative == "The gate fell."
+    assert (state.dharma, state.karma, state.choices) == (5, 0, ["A", "B"])
+
+    # Unfenced trailing object is accepted; a broken fenced footer is cut from the narrative
+    narrative, state = extract_act('The gate fell.\n{"choices": ["A"]}')
+    assert narrative == "The gate fell." and state.choices == ["A"]
+    narrative, state = extract_act('The gate fell.\n```json\n{"choices": ]]\n```')
+    assert narrative == "The gate fell." and state is None
+
+def test_story_context_stays_within_budget():
+    acts = [f"Act {i} begins in the citadel. " + "Battle rages on. " * 200 + f"Act {i} ends." for i in range(10)]
+    transcript = "\n\n---\n\n".join(acts)
+
+    context = build_bounded_context(transcript, token_budget=1500, recent_acts=2)
+
+    assert estimate_tokens(context) <= 1500
+    assert "Act 9 ends." in context
+    assert "summary of" in context
+
+def test_split_acts_keeps_decisions_with_their_act():
+    transcript = "First act.\n\n---\n\n> **DECISION:** Fight\n\n---\n\nSecond act."
+    assert split_acts(transcript) == ["First act.", "> **DECISION:** Fight\n\nSecond act."]
+
+def test_story_context_folds_incrementally():
+    folds = []
+    def summarizer(summary, act):
+        folds.append(act)
+        return f"{summary}|{act}"
+
+    manager = StoryContextManager(token_budget=10_000, recent_acts=1, summarizer=summarizer)
+    for act in ["a", "b", "c"]:
+        manager.add_act(act)
+
+    assert folds == ["a", "b"]
+    assert manager.summary == "|a|b"
+
+def test_story_context_truncates_only_the_prompt():
+    long_act = "The siege opens at dawn. " + "Drones circle the walls. " * 400 + "The gate holds."
+    manager = StoryContextManager(token_budget=300, recent_acts=2)
+    manager.add_act(long_act)
+
+    assert estimate_tokens(manager.build()) <= 300 and "The gate holds." in manager.build()
+    assert list(manager.recent) == [long_act]  # later folds still see the whole act
+
+def test_story_memory_recalls_relevant_older_passages():
+    memory = StoryMemory(chunk_tokens=40)
+    memory.add_act("Rachel steals the Royal Signet from the vault beneath the citadel.\n\n"
+                   "Guards chase her through the flooded tunnels.")
+    memory.add_act("The council debates the grain tax for hours.", choice="Attend the council")
+    memory.add_act("A storm hits the harbour and the ships are lost.", choice="Sail north")
+
+    passages = memory.relevant("Use the Royal Signet to open the gate", k=2, before_act=2)
+    assert passages[0].startswith("(Act 1) Rachel steals the Royal Signet")
+    assert all("storm" not in p for p in passages)  # act 3 is still in the raw window
+    assert memory.search("Sail north", k=1)[0].text == "Earlier decision: Sail north"
+
+    prompt = build_prompt().handle({"spec": act_for(default_world_spec(), "Act 4"),
+                                    "previous_context": "Recent acts.", "relevant_passages": passages})
+    suffix = prompt["final_prompt"][len(prompt["prompt_prefix"]):]
+    assert "RELEVANT EARLIER PASSAGES" in suffix and "Royal Signet" in suffix
+
+def test_vector_store_grows_and_returns_top_k():
+    store = VectorStore(dim=8, capacity=2)
+    vectors = np.eye(8, dtype=np.float32)
+    store.add(vectors[:5])
+    store.add(vectors[5:])
+    assert len(store) == 8
+    assert [row for row, _ in store.search(vectors[6], k=1)] == [6]
+    assert store.search(vectors[6], k=3, limit=5)[0][1] == 0.0
+    assert all(estimate_tokens(c) <= 20 for c in chunk_text("word " * 200, max_tokens=20))
+
+def test_story_graph_paths_forks_and_diffs():
+    graph = StoryGraph()
+    root = graph.add("Act one.", act="Act 1")
+    left = graph.add("Went left.", root.id, "Left")
+    right = graph.add("Went right.", root.id, "Right")
+    deep = graph.add("Deeper.", left.id, "On")
+
+    assert [n.id for n in graph.path(deep.id)] == [root.id, left.id, deep.id]
+    assert graph.transcript(right.id) == "Act one.\n\n---\n\n> **DECISION:** Right\n\n---\n\nWent right."
+    assert split_acts(graph.transcript(right.id)) == ["Act one.", "> **DECISION:** Right\n\nWent right."]
+    assert graph.leaves() == [right.id, deep.id]
+
+    first = graph.page(limit=3)
+    rest = graph.page(first["next_cursor"], limit=3)
+    assert [n["id"] for n in first["nodes"] + rest["nodes"]] == [root.id, left.id, right.id, deep.id]
+    assert rest["next_cursor"] is None
+
+    seen = graph.revision
+    assert graph.prune(left.id) == [left.id, deep.id]
+    diff = graph.changes(seen)
+    assert sorted(diff["removed"]) == sorted([left.id, deep.id])
+    assert [n["id"] for n in diff["nodes"]] == [root.id] and diff["nodes"][0]["children"] == [right.id]
+    assert graph.changes(graph.revision)["nodes"] == []
+
+def test_batch_runner_resumes_from_checkpoint(tmp_path):
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text('{"act_name": "A", "llm": "mock"}\n{"act_name": "B", "llm": "mock", "world_description": "Dunes"}\n')
+    jobs = load_manifest(str(manifest))
+    checkpoint_path = str(tmp_path / "jobs.checkpoint")
+
+    # Pretend the first job finished before a crash
+    Checkpoint(checkpoint_path).mark(jobs[0].id)
+    sink = JsonlSink(str(tmp_path / "results.jsonl"))
+    summary = BatchRunner(sink, Checkpoint(checkpoint_path), concurrency=2, cache=False).run(load_manifest(str(manifest)))
+    sink.close()
+
+    assert (summary.succeeded, summary.skipped, summary.failed) == (1, 1, 0)
+    results = [json.loads(line) for line in (tmp_path / "results.jsonl").read_text().splitlines()]
+    assert [r["act_name"] for r in results] == ["B"]
+    assert "mock" in summary.to_dict()["per_model"]
+
+def test_batch_reports_the_answering_model_and_isolates_bad_rows(tmp_path, monkeypatch):
+    import requests
+    import llm.router
+
+    class Response:
+        def __init__(self, status, model):
+            self.status_code, self.headers = status, {}
+            self.content = json.dumps({"choices": [{"message": {"content": f"Act by {model}"}}]}).encode()
+            self.text = self.content.decode()
+
+        def json(self):
+            return json.loads(self.content)
+
+    def post(url, headers, json, timeout):
+        return Response(429 if json["model"] == "busy/model" else 200, json["model"])
+
+    monkeypatch.setenv("OPENROUTER_API_KEY", "test-key")
+    monkeypatch.setattr(requests, "post", post)
+    monkeypatch.setattr(llm.router, "_router", None)
+    manifest = tmp_path / "jobs.jsonl"
+    manifest.write_text('{"act_name": "A", "model": "busy/model"}\n'
+                        '{"act_name": "B", "llm": "mock", "colour": "red"}\n'
+                        'not json\n'
+                        '{"act_name": "C", "llm": "mock"}\n')
+
+    sink = JsonlSink(str(tmp_path / "results.jsonl"))
+    summary = BatchRunner(sink, Checkpoint(str(tmp_path / "jobs.checkpoint")), cache=False).run(
+        load_manifest(str(manifest)))
+    sink.close()
+
+    assert (summary.succeeded, summary.failed) == (2, 2)
+    errors = sorted(failure["error"] for failure in summary.failures)
+    assert errors == ["Job 1 has unknown keys colour", "Job 2 is not a mapping: 'not json'"]
+    results = {r["act_name"]: r for r in map(json.loads, (tmp_path / "results.jsonl").read_text().splitlines())}
+    fallback = "mistralai/mistral-7b-instruct:free"
+    assert results["A"]["model"] == fallback and results["A"]["requested_model"] == "busy/model"
+    assert results["A"]["hops"] == 1 and results["C"]["hops"] == 0
+    per_model = summary.to_dict()["per_model"]
+    assert "busy/model" not in per_model and per_model[fallback]["fallbacks"] == 1